@@ -0,0 +1,160 @@
+'''
+Run a backout plan in parallel sqlplus sessions
+
+Usage:
+    help:
+        python backout_runner.py -h
+    run:
+        python backout_runner.py -plan <timestamp>_<db>_rollback_plan
+                                 -user simp_<windows id> -db bw3_qa
+                                 [-parallel 4] [-dry_run]
+
+    prompts:
+        - Password: <database password>
+
+Description
+- the plan directory is written by sysimp_verify -plan: one script per
+  part and plan.json listing them, largest part first.
+- each part only touches tables no other part touches (no foreign key
+  or subquery between them), so the parts run in any order, each in its
+  own sqlplus session, at most -parallel at a time.
+- a part runs with 'whenever sqlerror exit' and is committed when it
+  completes, or rolled back with -dry_run. A failed part is rolled back
+  and leaves the other parts alone: rerun the failed parts only with
+  -parts.
+- every part logs to <plan dir>/part_NNN.log, the exit status is 1 if
+  any part failed.
+'''
+
+import argparse
+import getpass
+import json
+import os
+import Queue
+import subprocess
+import sys
+import threading
+
+from timing import clock
+
+
+def load_plan(plan_dir):
+    with open(os.path.join(plan_dir, 'plan.json')) as f:
+        plan = json.load(f)
+    if plan.get('plan_version') != 1:
+        raise ValueError('unsupported plan version {}'.format(
+            plan.get('plan_version')))
+    return plan
+
+
+class Runner:
+
+    '''
+    Run the parts of a plan, parallel sessions at a time
+    '''
+
+    def __init__(self, plan_dir, db_conn_str, parallel=4, dry_run=False):
+        self.plan_dir = plan_dir
+        self.plan = load_plan(plan_dir)
+        self.db_conn_str = db_conn_str
+        self.parallel = max(1, parallel)
+        self.end = 'rollback;' if dry_run else 'commit;'
+
+        '''oracle. Jenkins is linux2'''
+        if sys.platform == 'linux2':
+            self.oracle = '$ORACLE_HOME/bin/sqlplus'
+        else:
+            self.oracle = 'sqlplus'
+
+        self.results = {}
+        self.lock = threading.Lock()
+
+    def run_part(self, part):
+        '''
+        Run one part in a new sqlplus session, return (ok, seconds)
+        '''
+        script = os.path.abspath(os.path.join(self.plan_dir, part['script']))
+        logfile = os.path.splitext(script)[0] + '.log'
+        start = clock()
+        with open(logfile, 'w') as f:
+            session = subprocess.Popen(
+                self.oracle,
+                stdin=subprocess.PIPE,
+                stdout=f,
+                stderr=subprocess.STDOUT,
+                shell=True)
+            session.communicate('\n'.join([
+                self.db_conn_str,
+                'whenever sqlerror exit failure rollback',
+                'set echo on',
+                '@' + script,
+                self.end,
+                'exit']) + '\n')
+        with open(logfile) as f:
+            ok = session.returncode == 0 and 'ORA-' not in f.read()
+        return ok, clock() - start
+
+    def worker(self, queue):
+        while True:
+            try:
+                part = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                ok, seconds = self.run_part(part)
+            except (OSError, IOError) as e:
+                ok, seconds = False, 0.0
+                print '{}: {}'.format(part['script'], e)
+            with self.lock:
+                self.results[part['script']] = (ok, seconds)
+                print '{:<14} {:<6} {:>8} statements {:>8.1f}s  {}'.format(
+                    part['script'], 'ok' if ok else 'FAILED',
+                    part['statements'], seconds, ', '.join(part['tables']))
+                sys.stdout.flush()
+
+    def run(self, scripts=None):
+        '''
+        Run every part, or only the named scripts, return the failed ones
+        '''
+        queue = Queue.Queue()
+        for part in self.plan['parts']:
+            if scripts is None or part['script'] in scripts:
+                queue.put(part)
+        threads = [threading.Thread(target=self.worker, args=(queue,))
+                   for n in range(min(self.parallel, queue.qsize()))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return sorted(script for script, (ok, seconds)
+                      in self.results.items() if not ok)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='run the parts of a backout plan in parallel sessions')
+    parser.add_argument('-plan', required=True,
+                        help='plan directory written by sysimp_verify -plan')
+    parser.add_argument('-user', required=True, help='db username')
+    parser.add_argument('-db', required=True, help='db SID')
+    parser.add_argument('-parallel', type=int, default=4,
+                        help='sessions running at the same time (default 4)')
+    parser.add_argument('-parts', nargs='+',
+                        help='run only these part scripts, e.g. part_002.sql')
+    parser.add_argument('-dry_run', action='store_true',
+                        help='roll every part back instead of committing')
+    args = parser.parse_args()
+
+    pw = getpass.getpass()
+    runner = Runner(args.plan, '{}/{}@{}'.format(args.user, pw, args.db),
+                    args.parallel, args.dry_run)
+    if not runner.plan.get('parallel_safe', True):
+        print 'plan was built without foreign key metadata: single part'
+
+    start = clock()
+    failed = runner.run(args.parts)
+    print '\n{} parts in {:.1f}s, {} failed'.format(
+        len(runner.results), clock() - start, len(failed))
+    if failed:
+        print 'rerun with: -parts {}'.format(' '.join(failed))
+        sys.exit(1)
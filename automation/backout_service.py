@@ -0,0 +1,236 @@
+'''
+Long running backout service for sysimp_verify
+
+Usage:
+    start:
+        python sysimp_verify.py serve -user SYSIMP_UTIL -db bw3_qa
+                                      [-port 8765 | -socket <path>]
+                                      [-pool_max 4] [-metadata_ttl_s 300]
+    request, localhost HTTP:
+        curl -d '{"dml": "/path/release.sql", "binds": true}'
+             http://127.0.0.1:8765/backout
+        curl http://127.0.0.1:8765/status
+    request, Unix socket: the same JSON object on one line, answered by
+    one JSON line; the line "status" is answered by the status
+
+    prompts:
+        - Password: <database password>
+
+Description
+- the service keeps a session pool per database and the foreign key
+  metadata of the tables it has seen, so a request pays for the
+  capture and the script generation only: no interpreter start,
+  driver load, login or dictionary queries for tables seen within
+  -metadata_ttl_s.
+- a request names the dml script and, optionally, the database (the
+  first -db by default) and the options of a run: capture, binds,
+  bind_chunk, validation, plan, bulk_rows, keyword_rules, out_dir.
+  It is captured on a pooled session, rolled back, and the scripts
+  and capture file are written; the response lists them.
+  The sqlplus verification of a full run is left to the caller.
+- every request is served by its own thread, sessions beyond
+  -pool_max are waited for. A session is rolled back before it goes
+  back to the pool, and dropped if that fails.
+- responses: {"status": "ok", "artifacts": {...}, "seconds": ...} or
+  {"status": "error", "error": "..."}.
+'''
+
+import BaseHTTPServer
+import json
+import os
+import SocketServer
+import threading
+
+from timing import clock
+
+METADATA_TTL_S = 300
+
+
+def release_session(pool, conn):
+    '''
+    give a session back to its pool rolled back, or drop it
+    '''
+    try:
+        conn.rollback()
+    except Exception:
+        pool.drop(conn)
+    else:
+        pool.release(conn)
+
+
+class MetadataCache:
+
+    '''
+    Dictionary metadata of one database, entries expire after ttl_s
+    '''
+
+    def __init__(self, ttl_s=METADATA_TTL_S):
+        self.ttl_s = ttl_s
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or clock() - entry[0] > self.ttl_s:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (clock(), value)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class BackoutService:
+
+    '''
+    Serve backout requests from session pools
+
+    pools: {database: session pool}, handler(request, connection,
+    metadata) does the work and returns the response fields
+    '''
+
+    def __init__(self, pools, handler, metadata_ttl_s=METADATA_TTL_S,
+                 default_db=None):
+        self.pools = pools
+        self.handler = handler
+        self.default_db = default_db or sorted(pools)[0]
+        self.metadata = dict((db, MetadataCache(metadata_ttl_s))
+                             for db in pools)
+        self.started = clock()
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def handle(self, request):
+        '''
+        response to request, a dict decoded from JSON
+        '''
+        start = clock()
+        try:
+            if not isinstance(request, dict) or not request.get('dml'):
+                raise ValueError('a request needs "dml", the script path')
+            db = request.get('db') or self.default_db
+            if db not in self.pools:
+                raise ValueError('unknown database {}'.format(db))
+            pool = self.pools[db]
+            conn = pool.acquire()
+            try:
+                response = self.handler(request, conn, self.metadata[db])
+            finally:
+                release_session(pool, conn)
+            response['status'] = 'ok'
+        except Exception as e:
+            response = {'status': 'error', 'error': str(e) or repr(e)}
+        response['seconds'] = round(clock() - start, 3)
+        with self.lock:
+            self.requests += 1
+            if response['status'] != 'ok':
+                self.errors += 1
+        return response
+
+    def status(self):
+        return {
+            'status': 'ok',
+            'uptime_s': round(clock() - self.started, 1),
+            'requests': self.requests,
+            'errors': self.errors,
+            'pools': dict((db, {'opened': pool.opened, 'busy': pool.busy})
+                          for db, pool in self.pools.items()),
+            'metadata': dict((db, {'entries': len(cache.entries),
+                                   'hits': cache.hits,
+                                   'misses': cache.misses})
+                             for db, cache in self.metadata.items())}
+
+
+class HttpHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/status':
+            self.reply(200, self.server.service.status())
+        else:
+            self.reply(404, {'status': 'error', 'error': 'not found'})
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/backout':
+            self.reply(404, {'status': 'error', 'error': 'not found'})
+            return
+        length = int(self.headers.getheader('content-length') or 0)
+        try:
+            request = json.loads(self.rfile.read(length))
+        except ValueError as e:
+            self.reply(400, {'status': 'error', 'error': str(e)})
+            return
+        response = self.server.service.handle(request)
+        self.reply(200 if response['status'] == 'ok' else 422, response)
+
+    def reply(self, code, body):
+        data = json.dumps(body, sort_keys=True, default=str)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class HttpServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class LineHandler(SocketServer.StreamRequestHandler):
+
+    '''
+    one JSON request per line, one JSON response line each
+    '''
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                response = {'status': 'error', 'error': str(e)}
+            else:
+                if request == 'status':
+                    response = self.server.service.status()
+                else:
+                    response = self.server.service.handle(request)
+            self.wfile.write(json.dumps(response, sort_keys=True,
+                                        default=str) + '\n')
+            self.wfile.flush()
+
+
+def serve(service, port=None, socket_path=None):
+    '''
+    serve requests until interrupted, on a Unix socket if socket_path
+    is given, else on localhost port
+    '''
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = SocketServer.ThreadingUnixStreamServer(socket_path,
+                                                        LineHandler)
+        where = socket_path
+    else:
+        server = HttpServer(('127.0.0.1', port), HttpHandler)
+        where = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    server.daemon_threads = True
+    server.service = service
+    print 'serving backout requests on {}'.format(where)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
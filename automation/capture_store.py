@@ -0,0 +1,512 @@
+'''
+Compact on-disk snapshot of a sysimp_verify capture
+
+Usage:
+    write_capture('<timestamp>_<db>_capture.sysimp', config_dict,
+                  {'dml': 'release.sql', 'db': 'bw3_qa'})
+    ...
+    capture = load_capture('<timestamp>_<db>_capture.sysimp')
+    Backout(backout_path, capture).create_backout()
+
+    capture = capture_of(config_dict, {'dml': 'release.sql'})
+
+    reader = CaptureReader('<timestamp>_<db>_capture.sysimp')
+    kind, table, sql, images = reader.statement(31452)
+
+Description
+- everything Backout and ValidationScript read from a ConfigDict:
+  statements, line numbers, tables, row images, column types and the
+  foreign key pairs. load_capture returns an object with the same
+  attributes, so both generate from a snapshot without a database.
+- layout, all integers big endian:
+    magic, version (2 bytes)
+    one zlib block per statement
+    one zlib block per table: its value dictionary
+    zlib JSON index: meta, tables, statements in line order with the
+        offset and length of their block
+    trailer: index offset (8 bytes), index length (4 bytes), magic
+- a statement block holds its SQL text and is columnar: the row images
+  (inserted / deleted rows, or pre and post update images) as runs of
+  rows with the same column names, one array of 4 byte dictionary ids
+  per column. Values and column name lists are stored once per table,
+  so repeated codes, dates and nulls cost 4 bytes a row before
+  compression.
+- reading a statement by line number decodes its block and the table
+  dictionary only; the dictionary is kept for the next statement on
+  the same table.
+- values: None, str, unicode, int, long, float, Decimal, datetime,
+  date, timedelta and LobRef (the side file path relative to the
+  capture file, not its content).
+  Any other type raises TypeError when writing.
+- the index also keeps a fingerprint per statement of the script, in
+  script order, and the table fingerprints (last DDL time, max
+  ora_rowscn) taken before the run when there are any. A later run
+  of an edited script replays the statements matching a prefix of
+  them and reads their rows back from the file (-resume_capture).
+- a file of another CAPTURE_VERSION raises ValueError when opened.
+'''
+
+import array
+import datetime
+import decimal
+import hashlib
+import json
+import os
+import struct
+import sys
+import zlib
+
+from lob_store import LobRef
+
+CAPTURE_VERSION = 1
+MAGIC = 'SYSIMPCP'
+TRAILER = struct.Struct('>QI8s')
+
+# row image sets per statement kind, in block order
+IMAGE_SETS = {'insert': ('rows',),
+              'delete': ('rows',),
+              'update': ('pre', 'post')}
+
+# exact types whose equal values always encode the same
+MEMO_TYPES = (str, unicode, int, long, type(None),
+              datetime.datetime, datetime.date)
+
+
+def statement_fingerprint(sql):
+    '''
+    fingerprint of a parsed statement's text
+    '''
+    return hashlib.sha1(sql).hexdigest()[:16]
+
+
+def encode_value(val, base=''):
+    '''
+    tag byte and payload of a dictionary value, LOB side file paths
+    relative to base
+    '''
+    if val is None:
+        return 'N'
+    if isinstance(val, str):
+        return 's' + val
+    if isinstance(val, unicode):
+        return 'u' + val.encode('utf-8')
+    if isinstance(val, bool):
+        raise TypeError('unsupported capture value {!r}'.format(val))
+    if isinstance(val, (int, long)):
+        return 'i' + str(val)
+    if isinstance(val, float):
+        return 'f' + repr(val)
+    if isinstance(val, decimal.Decimal):
+        return 'd' + str(val)
+    if isinstance(val, datetime.datetime):
+        # by hand: strftime rejects years before 1900 in Python 2, and
+        # Oracle sentinel dates like 0001-01-01 are common
+        return 'D' + '{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}.{:06d}'.format(
+            val.year, val.month, val.day, val.hour, val.minute, val.second,
+            val.microsecond)
+    if isinstance(val, datetime.date):
+        return 'a' + '{:04d}-{:02d}-{:02d}'.format(
+            val.year, val.month, val.day)
+    if isinstance(val, datetime.timedelta):
+        return 't' + '{} {} {}'.format(
+            val.days, val.seconds, val.microseconds)
+    if isinstance(val, LobRef):
+        return 'L' + '{}\0{}\0{}'.format(
+            val.kind, val.size,
+            os.path.relpath(os.path.abspath(val.path), base or os.curdir))
+    raise TypeError('unsupported capture value {!r}'.format(val))
+
+
+def decode_value(data, base=''):
+    tag, payload = data[:1], data[1:]
+    if tag == 'N':
+        return None
+    if tag == 's':
+        return payload
+    if tag == 'u':
+        return payload.decode('utf-8')
+    if tag == 'i':
+        return int(payload)
+    if tag == 'f':
+        return float(payload)
+    if tag == 'd':
+        return decimal.Decimal(payload)
+    if tag == 'D':
+        day, time = payload.split(' ')
+        hms, microsecond = time.split('.')
+        return datetime.datetime(*[int(v) for v in day.split('-')] +
+                                 [int(v) for v in hms.split(':')] +
+                                 [int(microsecond)])
+    if tag == 'a':
+        return datetime.date(*[int(v) for v in payload.split('-')])
+    if tag == 't':
+        days, seconds, microseconds = [int(v) for v in payload.split()]
+        return datetime.timedelta(days, seconds, microseconds)
+    if tag == 'L':
+        kind, size, path = payload.split('\0', 2)
+        return LobRef(os.path.join(base, path), kind, int(size))
+    raise ValueError('unknown capture value tag {!r}'.format(tag))
+
+
+def native(text):
+    '''
+    JSON strings back to the str the capture had
+    '''
+    return text.encode('utf-8') if isinstance(text, unicode) else text
+
+
+def id_array(ids=()):
+    return array.array('I', ids)
+
+
+def array_bytes(ids):
+    '''
+    ids as 4 byte big endian integers
+    '''
+    if sys.byteorder == 'little':
+        ids = array.array('I', ids)
+        ids.byteswap()
+    return ids.tostring()
+
+
+def bytes_array(data):
+    ids = array.array('I')
+    ids.fromstring(data)
+    if sys.byteorder == 'little':
+        ids.byteswap()
+    return ids
+
+
+class Dictionary:
+
+    '''
+    Distinct values and column name lists (shapes) of one table,
+    numbered in order of appearance
+    '''
+
+    def __init__(self, base=''):
+        self.base = base
+        self.ids = {}
+        self.memo = {}
+        self.values = []
+        self.shape_ids = {}
+        self.shapes = []
+
+    def shape(self, names):
+        n = self.shape_ids.get(names)
+        if n is None:
+            n = self.shape_ids[names] = len(self.shapes)
+            self.shapes.append(names)
+        return n
+
+    def id(self, val):
+        if type(val) in MEMO_TYPES:
+            key = (type(val), val)
+            n = self.memo.get(key)
+            if n is None:
+                n = self.memo[key] = self.id_of(encode_value(val, self.base))
+            return n
+        return self.id_of(encode_value(val, self.base))
+
+    def id_of(self, data):
+        n = self.ids.get(data)
+        if n is None:
+            n = self.ids[data] = len(self.values)
+            self.values.append(data)
+        return n
+
+    def block(self):
+        out = [struct.pack('>I', len(self.values))]
+        for data in self.values:
+            out.append(struct.pack('>I', len(data)))
+            out.append(data)
+        return zlib.compress(''.join(out))
+
+
+def read_dictionary(block, base=''):
+    data = zlib.decompress(block)
+    count, = struct.unpack_from('>I', data)
+    pos = 4
+    values = []
+    for n in xrange(count):
+        size, = struct.unpack_from('>I', data, pos)
+        pos += 4
+        values.append(decode_value(data[pos:pos + size], base))
+        pos += size
+    return values
+
+
+def encode_images(rows, dictionary):
+    '''
+    one image set as runs of rows with the same column names:
+    ([[shape, rows]], column id arrays per run)
+    '''
+    runs = []
+    arrays = []
+    last = None
+    for row in rows:
+        names = tuple(col for col, val in row)
+        if names != last:
+            last = names
+            runs.append([dictionary.shape(names), 0])
+            arrays.append([id_array() for col in names])
+        runs[-1][1] += 1
+        for ids, (col, val) in zip(arrays[-1], row):
+            ids.append(dictionary.id(val))
+    return runs, arrays
+
+
+def write_capture(path, cd, meta=None):
+    '''
+    Write the capture held by ConfigDict cd to path, return
+    (statements, rows, bytes written)
+    '''
+    lists = {
+        'insert': zip(cd.insert_line_nums, cd.insert_tables,
+                      cd.insert_statements, [[r] for r in cd.inserts]),
+        'delete': zip(cd.delete_line_nums, cd.delete_tables,
+                      cd.delete_statements, cd.deletes),
+        'update': zip(cd.update_line_nums, cd.update_tables, cd.updates,
+                      cd.pre_update, cd.post_update)}
+    statements = []
+    for kind, entries in lists.items():
+        for entry in entries:
+            statements.append((entry[0], kind, entry[1], entry[2],
+                               entry[3:]))
+    statements.sort(key=lambda s: s[0])
+
+    base = os.path.dirname(os.path.abspath(path))
+    dictionaries = {}
+    index = []
+    rows = 0
+    with open(path, 'wb') as f:
+        f.write(MAGIC + struct.pack('>H', CAPTURE_VERSION))
+        for line, kind, tn, sql, image_sets in statements:
+            dictionary = dictionaries.get(tn)
+            if dictionary is None:
+                dictionary = dictionaries[tn] = Dictionary(base)
+            header = []
+            body = []
+            for name, images in zip(IMAGE_SETS[kind], image_sets):
+                runs, arrays = encode_images(images, dictionary)
+                header.append([name, runs])
+                for ids in arrays:
+                    body.extend(array_bytes(column) for column in ids)
+                rows += len(images)
+            data = json.dumps(header, separators=(',', ':'))
+            block = zlib.compress(
+                struct.pack('>I', len(data)) + data +
+                struct.pack('>I', len(sql)) + sql + ''.join(body))
+            index.append([line, kind, tn, f.tell(), len(block)])
+            f.write(block)
+
+        tables = {}
+        for tn, dictionary in sorted(dictionaries.items()):
+            block = dictionary.block()
+            tables[tn] = {'dictionary': [f.tell(), len(block)],
+                          'values': len(dictionary.values),
+                          'shapes': dictionary.shapes}
+            f.write(block)
+
+        for tn in tables:
+            tables[tn]['columns'] = list(cd.column_dict.get(tn, ()))
+            tables[tn]['types'] = cd.column_types.get(tn, {})
+        index_block = zlib.compress(json.dumps({
+            'capture_version': CAPTURE_VERSION,
+            'meta': meta or {},
+            'line_list': cd.line_list,
+            'actual_tables': cd.actual_tables,
+            'foreign_key_pairs': getattr(cd, 'foreign_key_pairs', None),
+            'fingerprints': getattr(cd, 'statement_fingerprints', None),
+            'table_fingerprint': getattr(cd, 'table_fingerprint', None),
+            'tables': tables,
+            'statements': index}, default=str))
+        offset = f.tell()
+        f.write(index_block)
+        f.write(TRAILER.pack(offset, len(index_block), MAGIC))
+        size = f.tell()
+    return len(index), rows, size
+
+
+class Capture:
+
+    '''
+    A loaded capture, with the ConfigDict attributes Backout and
+    ValidationScript use
+    '''
+
+    def __init__(self, index):
+        self.meta = index['meta']
+        self.line_list = index['line_list']
+        self.actual_tables = [native(tn) for tn in index['actual_tables']]
+        pairs = index['foreign_key_pairs']
+        self.foreign_key_pairs = None if pairs is None \
+            else [tuple(native(tn) for tn in p) for p in pairs]
+        tables = index['tables']
+        self.column_dict = dict(
+            (native(tn), tuple(native(col) for col in t['columns']))
+            for tn, t in tables.items())
+        self.column_types = dict(
+            (native(tn), dict((native(col), native(kind))
+                              for col, kind in t['types'].items()))
+            for tn, t in tables.items())
+        self.statement_fingerprints = index.get('fingerprints')
+        self.table_fingerprint = index.get('table_fingerprint')
+        self.current_line_num = None
+        self.del_or_up = []
+        for kind in ('insert', 'delete'):
+            for name in ('{}s', '{}_statements', '{}_line_nums',
+                         '{}_tables'):
+                setattr(self, name.format(kind), [])
+        self.updates = []
+        self.update_line_nums = []
+        self.update_tables = []
+        self.pre_update = []
+        self.post_update = []
+
+    def add(self, line, kind, tn, sql, images):
+        add_statement(self, line, kind, tn, sql, images)
+
+
+def add_statement(cd, line, kind, tn, sql, images):
+    '''
+    append a decoded statement to the lists of cd, a ConfigDict or
+    Capture, as its capture would have
+    '''
+    if kind == 'insert':
+        cd.inserts.append(images['rows'][0])
+        cd.insert_statements.append(sql)
+        cd.insert_line_nums.append(line)
+        cd.insert_tables.append(tn)
+    elif kind == 'delete':
+        cd.deletes.append(images['rows'])
+        cd.delete_statements.append(sql)
+        cd.delete_line_nums.append(line)
+        cd.delete_tables.append(tn)
+    else:
+        cd.pre_update.append(images['pre'])
+        cd.post_update.append(images['post'])
+        cd.updates.append(sql)
+        cd.update_line_nums.append(line)
+        cd.update_tables.append(tn)
+
+
+def capture_of(cd, meta=None):
+    '''
+    a Capture of what ConfigDict cd captured, without its connection
+    '''
+    capture = Capture({'meta': meta or {}, 'line_list': list(cd.line_list),
+                       'actual_tables': [], 'foreign_key_pairs': None,
+                       'tables': {}})
+    capture.actual_tables = list(cd.actual_tables)
+    capture.foreign_key_pairs = getattr(cd, 'foreign_key_pairs', None)
+    capture.statement_fingerprints = getattr(cd, 'statement_fingerprints',
+                                             None)
+    capture.table_fingerprint = getattr(cd, 'table_fingerprint', None)
+    capture.column_dict = dict(cd.column_dict)
+    capture.column_types = dict(cd.column_types)
+    for name in ('inserts', 'insert_statements', 'insert_line_nums',
+                 'insert_tables', 'deletes', 'delete_statements',
+                 'delete_line_nums', 'delete_tables', 'updates',
+                 'update_line_nums', 'update_tables', 'pre_update',
+                 'post_update', 'del_or_up'):
+        setattr(capture, name, list(getattr(cd, name)))
+    return capture
+
+
+class CaptureReader:
+
+    '''
+    Random access to the statements of a capture file
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, 'rb')
+        head = self.f.read(len(MAGIC) + 2)
+        if head[:len(MAGIC)] != MAGIC:
+            raise ValueError('{} is not a capture file'.format(path))
+        version, = struct.unpack('>H', head[len(MAGIC):])
+        if version != CAPTURE_VERSION:
+            raise ValueError('unsupported capture version {}'.format(
+                version))
+        self.f.seek(-TRAILER.size, 2)
+        offset, size, magic = TRAILER.unpack(self.f.read(TRAILER.size))
+        if magic != MAGIC:
+            raise ValueError('{} is truncated'.format(path))
+        self.index = json.loads(zlib.decompress(self.read(offset, size)))
+        self.index['tables'] = dict(
+            (native(tn), t) for tn, t in self.index['tables'].items())
+        self.shapes = dict(
+            (tn, [[native(col) for col in names] for names in t['shapes']])
+            for tn, t in self.index['tables'].items())
+        self.lines = dict((entry[0], n)
+                          for n, entry in enumerate(self.index['statements']))
+        self.dictionaries = {}
+
+    def read(self, offset, size):
+        self.f.seek(offset)
+        return self.f.read(size)
+
+    def close(self):
+        self.f.close()
+
+    def dictionary(self, tn):
+        values = self.dictionaries.get(tn)
+        if values is None:
+            values = self.dictionaries[tn] = read_dictionary(
+                self.read(*self.index['tables'][tn]['dictionary']),
+                os.path.dirname(self.path))
+        return values
+
+    def statement(self, line):
+        '''
+        (kind, table, sql, {image set: rows}) of the statement starting
+        on line, KeyError if no statement was captured there
+        '''
+        return self.decode(self.index['statements'][self.lines[line]])[1:]
+
+    def decode(self, entry):
+        line, kind, tn, offset, size = entry
+        tn = native(tn)
+        data = zlib.decompress(self.read(offset, size))
+        length, = struct.unpack_from('>I', data)
+        header = json.loads(data[4:4 + length])
+        pos = 4 + length
+        length, = struct.unpack_from('>I', data, pos)
+        sql = data[pos + 4:pos + 4 + length]
+        pos += 4 + length
+        values = self.dictionary(tn)
+        shapes = self.shapes[tn]
+        pair = tuple if kind != 'update' else list
+        images = {}
+        for name, runs in header:
+            rows = images[name] = []
+            for shape, count in runs:
+                names = shapes[shape]
+                columns = []
+                for col in names:
+                    ids = bytes_array(data[pos:pos + 4 * count])
+                    pos += 4 * count
+                    columns.append([values[n] for n in ids])
+                for k in xrange(count):
+                    rows.append([pair((col, column[k]))
+                                 for col, column in zip(names, columns)])
+        return line, native(kind), tn, sql, images
+
+    def load(self):
+        '''
+        the whole capture as a Capture
+        '''
+        capture = Capture(self.index)
+        for entry in self.index['statements']:
+            capture.add(*self.decode(entry))
+        return capture
+
+
+def load_capture(path):
+    reader = CaptureReader(path)
+    try:
+        return reader.load()
+    finally:
+        reader.close()
@@ -0,0 +1,389 @@
+'''
+Read/write dependency graph over the statements of a dml script
+
+Usage:
+    graph = DependencyGraph(config_dict.iter_statements())
+    for i, j, reason in graph.conflicts:
+        ...
+    graph.independent(i, j)
+    graph.batches()
+
+Description
+- statements are what ConfigDict.iter_statements yields:
+  (kind, statement, table name, line number), numbered from 1.
+- table level: a statement writes its own table and reads every table
+  named in a subquery (from/join). A later statement that reads a
+  table written earlier, or writes a table read earlier, depends on it.
+- predicate level: each statement is reduced to the row images it can
+  touch, as {column: set of values} built from the top level
+  'col = literal', 'col in (...)' and 'col is null' terms of its where
+  clause:
+    insert: the inserted values
+    delete: the where clause
+    update: the where clause, and the where clause with the set
+            values applied (the rows after the update)
+  Two statements on the same table may touch the same rows when some
+  image of one is compatible with some image of the other, i.e. no
+  column is pinned to different values. Terms that can't be read this
+  way are dropped, which only ever adds conflicts, never hides one.
+- every same table overlap is reported as a conflict: the backout of
+  such a script depends on running exactly in reverse order, and the
+  statements can't be batched, reordered or captured in bulk.
+- candidate pairs are found through one bucket column per table (the
+  most selective equality column), so scripts with keyed statements
+  are analysed in roughly linear time.
+'''
+
+import re
+
+SUBQUERY_TABLE = re.compile(r'\b(?:from|join)\s+([\w$#]+(?:\.[\w$#]+)?)', re.I)
+TERM = re.compile(
+    r'''^\(?\s*(?:\w+\.)?(?P<col>\w+)\s*
+        (?:
+            =\s*(?P<eq>'(?:[^']|'')*'|[-+]?\d+(?:\.\d+)?)
+          | (?P<in>in)\s*\((?P<list>[^()]*)\)
+          | (?P<null>is\s+null)
+        )\s*\)?$''', re.I | re.X)
+LITERAL = re.compile(r"'(?:[^']|'')*'|[-+]?\d+(?:\.\d+)?")
+LITERAL_LIST = re.compile(
+    r"\s*('(?:[^']|'')*'|[-+]?\d+(?:\.\d+)?|null)\s*(?:,|$)", re.I)
+NUMBER = re.compile(r'\s*[-+]?(?:\d+\.?\d*|\.\d+)(?:e[-+]?\d+)?\s*$', re.I)
+
+
+def table_key(tn):
+    '''
+    bw3.cbr_x and cbr_x are treated as the same table
+    '''
+    return tn.strip().lower().split('.')[-1]
+
+
+def norm_value(v):
+    '''
+    Normalise a literal. Numbers compare by value, so '5.00' and 5 are
+    taken to be equal: a false match only adds a conflict.
+    '''
+    if v is None:
+        return None
+    if v[:1] == "'":
+        v = v[1:-1].replace("''", "'")
+    if NUMBER.match(v):
+        return repr(float(v))
+    return v
+
+
+SPLIT_TOKENS = {}
+
+
+def split_top(text, word):
+    '''
+    split text on a keyword or separator outside quotes and parentheses
+    '''
+    tokens = SPLIT_TOKENS.get(word)
+    if tokens is None:
+        sep = re.escape(word)
+        if word.isalpha():
+            sep = r'(?<![\w$#])' + sep + r'(?![\w$#])'
+        tokens = SPLIT_TOKENS[word] = re.compile(
+            r"'(?:[^']|'')*'|(?P<open>\()|(?P<close>\))|(?P<sep>" + sep + ')',
+            re.I)
+    parts = []
+    depth = 0
+    start = 0
+    for m in tokens.finditer(text):
+        if m.group('open'):
+            depth += 1
+        elif m.group('close'):
+            depth -= 1
+        elif m.group('sep') and depth == 0:
+            parts.append(text[start:m.start()])
+            start = m.end()
+    parts.append(text[start:])
+    return parts
+
+
+def strip_parens(text):
+    text = text.strip()
+    while text.startswith('(') and text.endswith(')'):
+        inner = text[1:-1]
+        depth = 0
+        for c in inner:
+            if c == '(':
+                depth += 1
+            elif c == ')':
+                depth -= 1
+                if depth < 0:
+                    return text
+        text = inner.strip()
+    return text
+
+
+def predicate_constraints(predicate):
+    '''
+    Return {column: frozenset(values)} for the top level equality terms
+    of a where clause. An empty dict matches every row.
+    '''
+    predicate = strip_parens(predicate)
+    if len(split_top(predicate, 'or')) > 1:
+        return {}
+    constraints = {}
+    for term in split_top(predicate, 'and'):
+        m = TERM.match(term.strip())
+        if not m:
+            continue
+        col = m.group('col').lower()
+        if m.group('eq') is not None:
+            values = frozenset([norm_value(m.group('eq'))])
+        elif m.group('in'):
+            values = frozenset(norm_value(v)
+                               for v in LITERAL.findall(m.group('list')))
+        else:
+            values = frozenset([None])
+        if col in constraints:
+            values = constraints[col] & values
+        constraints[col] = values
+    return constraints
+
+
+def is_literal(v):
+    v = v.strip()
+    if v.lower() == 'null':
+        return True
+    m = LITERAL.match(v)
+    return m is not None and m.end() == len(v)
+
+
+def literal_value(v):
+    v = v.strip()
+    if v.lower() == 'null':
+        return None
+    return norm_value(v)
+
+
+def compatible(a, b):
+    for col in a:
+        if col in b and not (a[col] & b[col]):
+            return False
+    return True
+
+
+class Statement:
+
+    '''
+    Row images and table reads of one parsed statement
+    '''
+
+    def __init__(self, index, kind, sql, tn, line):
+        self.index = index
+        self.kind = kind
+        self.sql = sql
+        self.table = table_key(tn)
+        self.line = line
+        self.reads = set()
+        self.images = []
+
+        self.values = []
+
+        sql = sql.rstrip().rstrip(';')
+        if kind == 'insert':
+            m = re.match(r'insert\s+into\s+[^(]*\((?P<cols>[^)]*)\)\s*'
+                         r'values\s*\((?P<vals>.*)\)\s*$', sql, re.I | re.S)
+            if m:
+                cols = [c.strip().lower().split('.')[-1]
+                        for c in m.group('cols').split(',')]
+                text = m.group('vals')
+                literals = LITERAL_LIST.findall(text)
+                if len(literals) == len(cols) and \
+                        len(LITERAL_LIST.sub('', text).strip()) == 0:
+                    self.values = zip(cols, literals)
+                else:
+                    vals = split_top(text, ',')
+                    if len(cols) == len(vals):
+                        self.values = [(c, v) for c, v in zip(cols, vals)
+                                       if is_literal(v)]
+            self.images.append({})
+            for t in SUBQUERY_TABLE.findall(sql):
+                self.reads.add(table_key(t))
+            return
+
+        where = re.search(r'\bwhere\s', sql, re.I)
+        predicate = sql[where.end():] if where else ''
+        pre = predicate_constraints(predicate) if predicate else {}
+        self.images.append(pre)
+        if kind == 'update':
+            set_start = re.search(r'\bset\s', sql, re.I)
+            set_part = sql[set_start.end():where.start()] \
+                if set_start and where else ''
+            post = dict(pre)
+            for term in split_top(set_part, ','):
+                m = re.match(r'\s*(?:\w+\.)?(\w+)\s*=\s*(.*?)\s*$', term,
+                             re.S)
+                if not m:
+                    continue
+                col = m.group(1).lower()
+                if is_literal(m.group(2)):
+                    post[col] = frozenset([literal_value(m.group(2))])
+                else:
+                    post.pop(col, None)
+            self.images.append(post)
+            for t in SUBQUERY_TABLE.findall(set_part):
+                self.reads.add(table_key(t))
+        for t in SUBQUERY_TABLE.findall(predicate):
+            self.reads.add(table_key(t))
+
+    def restrict(self, columns):
+        '''
+        Build an insert's image from the columns some predicate on the
+        table uses. Other columns can never rule out an overlap, and
+        skipping them keeps wide inserts cheap.
+        '''
+        self.images = [dict((c, frozenset([literal_value(v)]))
+                            for c, v in self.values if c in columns)]
+
+    def overlaps(self, other):
+        for a in self.images:
+            for b in other.images:
+                if compatible(a, b):
+                    return True
+        return False
+
+
+class DependencyGraph:
+
+    '''
+    Table and predicate level dependencies between script statements
+
+    edges[j] is the set of earlier statements j depends on.
+    conflicts lists (i, j, reason) for statements on the same table
+    that may touch the same rows.
+    '''
+
+    def __init__(self, statements):
+        self.statements = [Statement(index, kind, sql, tn, line)
+                           for index, (kind, sql, tn, line)
+                           in enumerate(statements, start=1)]
+        self.edges = dict((s.index, set()) for s in self.statements)
+        columns = {}
+        for s in self.statements:
+            if s.kind != 'insert':
+                for image in s.images:
+                    columns.setdefault(s.table, set()).update(image)
+        for s in self.statements:
+            if s.kind == 'insert':
+                s.restrict(columns.get(s.table, ()))
+        self.conflicts = []
+        self.build()
+
+    def pivot_columns(self):
+        '''
+        per table, the equality column pinned by the most statements,
+        the one with the most distinct values on a tie
+        '''
+        stats = {}
+        for s in self.statements:
+            cols = None
+            for image in s.images:
+                cols = set(image) if cols is None else cols & set(image)
+            table = stats.setdefault(s.table, {})
+            for col in cols or ():
+                count, values = table.get(col, (0, set()))
+                for image in s.images:
+                    values.update(image[col])
+                table[col] = (count + 1, values)
+        pivots = {}
+        for table, cols in stats.items():
+            if cols:
+                pivots[table] = max(sorted(cols), key=lambda c: (
+                    cols[c][0], len(cols[c][1])))
+        return pivots
+
+    def build(self):
+        pivots = self.pivot_columns()
+        buckets = {}
+        wildcards = {}
+        table_statements = {}
+        writers = {}
+        readers = {}
+
+        for s in self.statements:
+            pivot = pivots.get(s.table)
+            keys = set()
+            wild = False
+            for image in s.images:
+                if pivot in image:
+                    keys.update(image[pivot])
+                else:
+                    wild = True
+
+            if wild:
+                candidates = table_statements.get(s.table, [])
+            else:
+                seen = set()
+                candidates = []
+                for k in keys:
+                    for i in buckets.get((s.table, k), ()):
+                        if i not in seen:
+                            seen.add(i)
+                            candidates.append(i)
+                for i in wildcards.get(s.table, ()):
+                    if i not in seen:
+                        seen.add(i)
+                        candidates.append(i)
+
+            for i in candidates:
+                earlier = self.statements[i - 1]
+                if earlier.overlaps(s):
+                    self.edges[s.index].add(i)
+                    if earlier.kind != 'insert' or s.kind != 'insert':
+                        self.conflicts.append(
+                            (i, s.index,
+                             '{} and {} on {} may touch the same rows'
+                             .format(earlier.kind, s.kind, s.table)))
+
+            for t in s.reads:
+                self.edges[s.index].update(writers.get(t, ()))
+            self.edges[s.index].update(
+                i for i in readers.get(s.table, ()) if i != s.index)
+
+            table_statements.setdefault(s.table, []).append(s.index)
+            if wild:
+                wildcards.setdefault(s.table, []).append(s.index)
+            for k in keys:
+                buckets.setdefault((s.table, k), []).append(s.index)
+            writers.setdefault(s.table, []).append(s.index)
+            for t in s.reads:
+                readers.setdefault(t, []).append(s.index)
+
+    def independent(self, i, j):
+        '''
+        True if neither statement depends on the other directly
+        '''
+        return i not in self.edges[j] and j not in self.edges[i]
+
+    def conflicting_tables(self):
+        '''
+        tables that can't be captured in bulk: same table overlaps, or
+        statements reading a table the script writes
+        '''
+        tables = set(self.statements[j - 1].table
+                     for i, j, reason in self.conflicts)
+        written = set(s.table for s in self.statements)
+        for s in self.statements:
+            if s.reads & written:
+                tables.add(s.table)
+        return sorted(tables)
+
+    def batches(self):
+        '''
+        Return lists of statement indexes. Statements in one batch don't
+        depend on each other and may run in any order or together, each
+        batch only depends on earlier batches.
+        '''
+        level = {}
+        batches = []
+        for s in self.statements:
+            lv = 1 + max([level[i] for i in self.edges[s.index]] or [-1])
+            level[s.index] = lv
+            if lv == len(batches):
+                batches.append([])
+            batches[lv].append(s.index)
+        return batches
@@ -0,0 +1,170 @@
+'''
+Watch a directory of dml scripts and reprocess the ones that change
+
+Usage:
+    python sysimp_verify.py watch -dir SCRIPTS/dml -user <db user>
+                                  -db <SID> [-debounce_s 2] [-workers 1]
+
+    prompts:
+        - Password: <database password>
+
+Description
+- the directory is polled every -interval_s for *.sql files, comparing
+  modification time and size, so no file system notification package
+  is needed.
+- a new or changed file is processed once it has been left alone for
+  -debounce_s: an editor saving in several writes gives one run. A
+  file saved again while it is processed is queued once more.
+- a file whose content is the same as in its last successful run
+  (touched, checked out again) is skipped. After a failed run the
+  same content is processed again on its next change, e.g. once the
+  table or connection problem is fixed and the file is touched.
+- files are processed on -workers background threads, each run on a
+  pooled session. The latest <script>_rollback.sql, _validation.sql,
+  _capture.sysimp and _report.json (status, error, statements, seconds)
+  per script are kept in -out_dir, <dir>/sysimp_watch by default.
+'''
+
+import fnmatch
+import hashlib
+import os
+import Queue
+import threading
+import time
+
+from timing import clock
+
+DEBOUNCE_S = 2.0
+INTERVAL_S = 1.0
+
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), ''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class DmlWatcher:
+
+    '''
+    Poll directory, hand changed scripts to process(path) in the
+    background; process returns a response dict with a 'status'
+    '''
+
+    def __init__(self, directory, process, debounce_s=DEBOUNCE_S,
+                 interval_s=INTERVAL_S, workers=1, pattern='*.sql'):
+        self.directory = directory
+        self.process = process
+        self.debounce_s = debounce_s
+        self.interval_s = interval_s
+        self.workers = max(1, workers)
+        self.pattern = pattern
+        self.seen = {}
+        self.pending = {}
+        self.hashes = {}
+        self.queue = Queue.Queue()
+        self.queued = set()
+        self.running = set()
+        self.lock = threading.Lock()
+
+    def scan(self):
+        '''
+        {path: (modification time, size)} of the matching files
+        '''
+        files = {}
+        for name in os.listdir(self.directory):
+            if not fnmatch.fnmatch(name.lower(), self.pattern):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                # removed since the listing
+                continue
+            if os.path.isfile(path):
+                files[path] = (st.st_mtime, st.st_size)
+        return files
+
+    def poll(self, now=None):
+        '''
+        note changed files, queue the ones left alone for debounce_s
+        '''
+        now = clock() if now is None else now
+        files = self.scan()
+        with self.lock:
+            for path, signature in files.items():
+                if self.seen.get(path) != signature:
+                    self.seen[path] = signature
+                    self.pending[path] = now
+            for path in list(self.seen):
+                if path not in files:
+                    del self.seen[path]
+                    self.pending.pop(path, None)
+            for path, changed in sorted(self.pending.items()):
+                if now - changed >= self.debounce_s and \
+                        path not in self.queued:
+                    del self.pending[path]
+                    self.queued.add(path)
+                    self.queue.put(path)
+
+    def work(self):
+        '''
+        process queued files until the program ends, whatever a single
+        file does
+        '''
+        while True:
+            path = self.queue.get()
+            with self.lock:
+                self.queued.discard(path)
+                if path in self.running:
+                    # another worker has it, look again after debounce_s
+                    self.pending[path] = clock()
+                    continue
+                self.running.add(path)
+            try:
+                self.run_once(path)
+            except (Exception, SystemExit) as e:
+                print '{}: {}'.format(os.path.basename(path),
+                                      str(e) or repr(e))
+            finally:
+                with self.lock:
+                    self.running.discard(path)
+
+    def run_once(self, path):
+        try:
+            digest = file_hash(path)
+        except (IOError, OSError):
+            return
+        if self.hashes.get(path) == digest:
+            return
+        start = clock()
+        try:
+            response = self.process(path)
+        except (Exception, SystemExit) as e:
+            # a bad file must never end the worker
+            response = {'status': 'error', 'error': str(e) or repr(e)}
+        if response.get('status') == 'ok':
+            self.hashes[path] = digest
+        else:
+            self.hashes.pop(path, None)
+        print '{}: {} in {:.1f}s{}'.format(
+            os.path.basename(path), response.get('status'), clock() - start,
+            ', ' + response['error'] if response.get('error') else '')
+
+    def run(self):
+        '''
+        watch until interrupted; files already there are processed first
+        '''
+        for n in range(self.workers):
+            t = threading.Thread(target=self.work)
+            t.daemon = True
+            t.start()
+        print 'watching {} for {}'.format(self.directory, self.pattern)
+        try:
+            while True:
+                self.poll()
+                time.sleep(self.interval_s)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,369 @@
+'''
+Synthetic DML workload generator
+
+Usage:
+    help:
+        python dml_workload.py -h
+    10k statement script:
+        python dml_workload.py -n 10000 -out workload_10k.sql
+    100k statements, mostly deletes, companion ddl:
+        python dml_workload.py -n 100000 -mix 2,1,7 -ddl workload.ddl
+            -out workload_100k.sql
+
+Description
+- writes a dml script laid out the way Toad exports it, the same
+  layout as SCRIPTS/dml/215439_03_BW3.sql:
+      Insert into BW3.TABLE
+         (COL, COL, COL, COL, COL,
+          COL, ...)
+       Values
+         ('val', 'val', 'val', 'val', 'val',
+          'val', ...);
+  deletes and updates are written on one or two lines.
+- the kind of every statement is drawn with the -mix weights, so the
+  script has inserts, updates and deletes in that ratio.
+- an insert adds a row to the row group being filled for its table, a
+  group is complete once it has its -rows size. Updates and deletes
+  target a whole complete group, a delete removes it. When a table has
+  no complete group left, a seed group is made for the statement: its
+  rows are inserted by the -ddl file after the create tables, so every
+  statement affects a known number of rows when the script is run
+  against the tables set up by the -ddl file.
+- output is fully determined by the arguments and -seed, so the same
+  command always reproduces the same workload.
+- free text may contain any keyword: ConfigDict.validate_config only
+  matches keywords outside string literals.
+'''
+
+import argparse
+import random
+import string
+import sys
+
+# Column vocabulary taken from the CBR tables in the sample script.
+# None of these start with insert/update/delete, which matters because
+# config_file_to_string counts any line starting with those words as
+# the start of a statement.
+COLUMN_NAMES = [
+    'EFFECTIVE_DATE', 'FX_RATE_CATEGORY', 'BASE_CURRENCY', 'CURRENCY',
+    'MIDDLE_RATE', 'PURCHASE_RATE', 'SALES_RATE', 'AUDIT_TRAIL',
+    'CALCULATION_BASE', 'EFFECTIVE_TIME', 'RECORD_ID_NUMBER',
+    'RATE_FORMULA', 'PERCENT_FX_SPREAD', 'PURCHASE_SPREAD',
+    'SALES_SPREAD', 'PERCENT_PURCHASE_SPREAD', 'PERCENT_SALES_SPREAD',
+    'FLUCTUATION_THRESHOLD', 'SERVICE_CONTRACT_ID', 'CLIENT_NUMBER',
+    'ACCOUNT_TYPE_ID', 'CARD_BRAND', 'TRANSACTION_CATEGORY',
+    'SETTLEMENT_METHOD', 'POSTING_METHOD', 'STATUS_INDICATOR',
+    'LANGUAGE_INDICATOR', 'COUNTRY_CODE', 'REGION_CODE', 'TARIFF_ID',
+    'FEE_AMOUNT', 'FEE_PERCENTAGE', 'MIN_FEE', 'MAX_FEE', 'VALID_FROM',
+    'VALID_UNTIL', 'CHANNEL_ID', 'PROCESSING_CODE', 'REASON_CODE',
+    'DESCRIPTION', 'CLEARING_CHANNEL', 'BATCH_SOURCE', 'PRIORITY_FLAG',
+]
+
+TABLE_WORDS = [
+    'FX_RATE_SPREADS', 'CURRENCY_RATES', 'SERVICE_FEES', 'TARIFF_RULES',
+    'CLIENT_LIMITS', 'ACCOUNT_TYPES', 'POSTING_RULES', 'CARD_BRANDS',
+    'SETTLEMENT_PLANS', 'CHANNEL_RULES', 'REASON_CODES', 'FEE_TIERS',
+]
+
+# Every generated table starts with these two key columns. Updates and
+# deletes select a whole row group through them.
+KEY_COLUMNS = ['INSTITUTION_NUMBER', 'GROUP_ID_NUMBER']
+
+FREE_TEXT_LETTERS = string.ascii_lowercase
+
+COLUMNS_PER_LINE = 5
+
+AUTHORS = ['Deniss', 'Jenkins', 'Release', 'Sysimp']
+
+
+class Table:
+
+    '''
+    Name and column list of one synthetic table
+    '''
+
+    def __init__(self, name, columns):
+        self.name = name
+        self.columns = columns
+
+    def ddl(self, schema):
+        cols = ',\n'.join(
+            '    {} VARCHAR2(40)'.format(col) for col in self.columns)
+        return 'CREATE TABLE {}.{}\n(\n{}\n);\n'.format(
+            schema, self.name, cols)
+
+
+class WorkloadGenerator:
+
+    '''
+    Write a reproducible dml script of a given size
+
+    mix is the (insert, update, delete) weight tuple, applied to every
+    statement written.
+    rows is the (min, max) number of rows an update or delete affects;
+    the inserts that create each row group are written beforehand, or
+    by the -ddl file for a seed group.
+    '''
+
+    def __init__(self, statements, mix=(5, 3, 2), tables=8,
+                 width=(6, 24), rows=(1, 5), comment_ratio=0.1,
+                 qualified_ratio=0.5, multiline_ratio=1.0,
+                 schema='BW3', seed=0):
+        self.statements = statements
+        self.mix = mix
+        self.rows = rows
+        self.comment_ratio = comment_ratio
+        self.qualified_ratio = qualified_ratio
+        self.multiline_ratio = multiline_ratio
+        self.schema = schema
+        self.random = random.Random(seed)
+        self.tables = self.make_tables(tables, width)
+
+        # table name -> list of complete (institution, group id, row count)
+        self.groups = dict((t.name, []) for t in self.tables)
+        # table name -> [institution, group id, size, rows inserted]
+        self.filling = {}
+        # (table, institution, group id, row count) the -ddl file inserts
+        self.seeds = []
+        self.group_seq = 0
+        self.record_seq = 0
+        self.counts = {'insert': 0, 'update': 0, 'delete': 0}
+        self.rows_affected = 0
+
+    def make_tables(self, count, width):
+        tables = []
+        for n in range(count):
+            word = TABLE_WORDS[n % len(TABLE_WORDS)]
+            name = 'CBR_{}_{:03d}'.format(word, n + 1)
+            ncols = self.random.randint(*width)
+            extra = self.random.sample(
+                COLUMN_NAMES, min(ncols, len(COLUMN_NAMES)))
+            tables.append(Table(name, KEY_COLUMNS + extra))
+        return tables
+
+    def value(self, column):
+        r = self.random
+        if column.endswith('_DATE') or column.startswith('VALID_'):
+            return '2017{:02d}{:02d}'.format(r.randint(1, 12),
+                                              r.randint(1, 28))
+        if column.endswith('_TIME'):
+            return '{:02d}:{:02d}:{:02d}'.format(
+                r.randint(0, 23), r.randint(0, 59), r.randint(0, 59))
+        if column.endswith('_RATE') or 'SPREAD' in column \
+                or column.endswith('_FEE') or 'AMOUNT' in column:
+            return '{:.4f}'.format(r.uniform(0, 10))
+        if column == 'AUDIT_TRAIL' or column == 'DESCRIPTION':
+            return ''.join(r.choice(FREE_TEXT_LETTERS)
+                           for _ in range(r.randint(8, 30)))
+        if column == 'RECORD_ID_NUMBER':
+            self.record_seq += 1
+            return '{:010d}'.format(self.record_seq)
+        return '{:03d}'.format(r.randint(0, 999))
+
+    def table_name(self, table):
+        if self.random.random() < self.qualified_ratio:
+            return '{}.{}'.format(self.schema, table.name)
+        return table.name
+
+    def pick_kind(self):
+        total = float(sum(self.mix))
+        x = self.random.random() * total
+        for kind, weight in zip(('insert', 'update', 'delete'), self.mix):
+            if x < weight:
+                return kind
+            x -= weight
+        return 'insert'
+
+    def comment(self):
+        return '-- {} {}\n'.format(self.random.randint(100000, 999999),
+                                   self.random.choice(AUTHORS))
+
+    def insert(self, table, institution, group_id):
+        values = [institution, group_id] + [
+            self.value(col) for col in table.columns[2:]]
+        vals = ["'{}'".format(v) for v in values]
+        name = self.table_name(table)
+        if self.random.random() >= self.multiline_ratio:
+            return 'Insert into {} ({}) Values ({});\n'.format(
+                name, ', '.join(table.columns), ', '.join(vals))
+
+        def block(items):
+            lines = []
+            for i in range(0, len(items), COLUMNS_PER_LINE):
+                lines.append(', '.join(items[i:i + COLUMNS_PER_LINE]))
+            return '   (' + ', \n    '.join(lines) + ')'
+
+        return 'Insert into {}\n{}\n Values\n{};\n'.format(
+            name, block(table.columns), block(vals))
+
+    def where(self, institution, group_id):
+        return "WHERE INSTITUTION_NUMBER = '{}' and GROUP_ID_NUMBER = '{}'" \
+            .format(institution, group_id)
+
+    def update(self, table, institution, group_id):
+        cols = self.random.sample(
+            table.columns[2:], self.random.randint(
+                1, min(3, len(table.columns) - 2)))
+        sets = ', '.join("{} = '{}'".format(c, self.value(c)) for c in cols)
+        name = self.table_name(table)
+        if self.random.random() >= self.multiline_ratio:
+            return 'UPDATE {} SET {} {};\n'.format(
+                name, sets, self.where(institution, group_id))
+        return 'UPDATE {}\nSET    {}\n{};\n'.format(
+            name, sets, self.where(institution, group_id))
+
+    def delete(self, table, institution, group_id):
+        return 'DELETE FROM {} {};\n'.format(
+            self.table_name(table), self.where(institution, group_id))
+
+    def new_group(self):
+        '''
+        (institution, group id, size) of a fresh row group
+        '''
+        self.group_seq += 1
+        return ('{:08d}'.format(self.random.randint(1, 99)),
+                '{:08d}'.format(self.group_seq),
+                self.random.randint(*self.rows))
+
+    def add_row(self, out, table):
+        '''
+        write an insert of the next row of the group being filled for
+        table, the group is complete with its last row
+        '''
+        group = self.filling.get(table.name)
+        if group is None:
+            group = self.filling[table.name] = list(self.new_group()) + [0]
+        institution, group_id, size, written = group
+        self.write(out, self.insert(table, institution, group_id))
+        group[3] += 1
+        if group[3] == size:
+            del self.filling[table.name]
+            self.groups[table.name].append((institution, group_id, size))
+
+    def live_group(self, table):
+        '''
+        index of a complete group of table, seeded when there is none
+        '''
+        groups = self.groups[table.name]
+        if not groups:
+            institution, group_id, size = self.new_group()
+            self.seeds.append((table, institution, group_id, size))
+            groups.append((institution, group_id, size))
+        return self.random.randrange(len(groups))
+
+    def write(self, out, statement):
+        if self.random.random() < self.comment_ratio:
+            out.write(self.comment())
+        out.write(statement)
+        out.write('\n\n')
+
+    def generate(self, out):
+        out.write('\n\n-- synthetic workload: {} statements\n\n\n'.format(
+            self.statements))
+        while sum(self.counts.values()) < self.statements:
+            table = self.random.choice(self.tables)
+            kind = self.pick_kind()
+            if kind == 'insert':
+                self.add_row(out, table)
+                self.counts[kind] += 1
+                continue
+            groups = self.groups[table.name]
+            i = self.live_group(table)
+            institution, group_id, size = groups[i]
+            if kind == 'update':
+                self.write(out, self.update(table, institution, group_id))
+            else:
+                self.write(out, self.delete(table, institution, group_id))
+                groups[i] = groups[-1]
+                groups.pop()
+            self.counts[kind] += 1
+            self.rows_affected += size
+
+    def write_ddl(self, out):
+        '''
+        the create tables, then the seed group inserts and a commit
+        '''
+        for table in self.tables:
+            out.write(table.ddl(self.schema))
+            out.write('\n')
+        if not self.seeds:
+            return
+        for table, institution, group_id, size in self.seeds:
+            for _ in range(size):
+                self.write(out, self.insert(table, institution, group_id))
+        out.write('COMMIT;\n')
+
+
+def ratio_tuple(s):
+    '''
+    "5,3,2" -> (5.0, 3.0, 2.0)
+    '''
+    parts = [float(p) for p in s.split(',')]
+    if len(parts) != 3 or sum(parts) <= 0:
+        raise argparse.ArgumentTypeError(
+            'expected insert,update,delete weights e.g. 5,3,2')
+    return tuple(parts)
+
+
+def int_range(s):
+    '''
+    "1-5" -> (1, 5), "3" -> (3, 3)
+    '''
+    lo, _, hi = s.partition('-')
+    lo = int(lo)
+    hi = int(hi) if hi else lo
+    if lo < 1 or hi < lo:
+        raise argparse.ArgumentTypeError('expected a range such as 1-5')
+    return lo, hi
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='dml_workload',
+        description='generate a synthetic dml script')
+    parser.add_argument('-n', type=int, default=10000,
+                        help='number of statements (default 10000)')
+    parser.add_argument('-out', default=None,
+                        help='output path (default stdout)')
+    parser.add_argument('-ddl', default=None,
+                        help='also write create table statements here')
+    parser.add_argument('-mix', type=ratio_tuple, default=(5, 3, 2),
+                        help='insert,update,delete weights (default 5,3,2)')
+    parser.add_argument('-tables', type=int, default=8,
+                        help='number of distinct tables (default 8)')
+    parser.add_argument('-width', type=int_range, default=(6, 24),
+                        help='non key columns per table (default 6-24)')
+    parser.add_argument('-rows', type=int_range, default=(1, 5),
+                        help='rows per update/delete (default 1-5)')
+    parser.add_argument('-comments', type=float, default=0.1,
+                        help='fraction of statements with a comment')
+    parser.add_argument('-qualified', type=float, default=0.5,
+                        help='fraction of schema qualified table names')
+    parser.add_argument('-multiline', type=float, default=1.0,
+                        help='fraction of statements in Toad layout')
+    parser.add_argument('-schema', default='BW3')
+    parser.add_argument('-seed', type=int, default=0)
+    args = parser.parse_args()
+
+    gen = WorkloadGenerator(args.n, mix=args.mix, tables=args.tables,
+                            width=args.width, rows=args.rows,
+                            comment_ratio=args.comments,
+                            qualified_ratio=args.qualified,
+                            multiline_ratio=args.multiline,
+                            schema=args.schema, seed=args.seed)
+    if args.out:
+        with open(args.out, 'w') as f:
+            gen.generate(f)
+    else:
+        gen.generate(sys.stdout)
+
+    if args.ddl:
+        with open(args.ddl, 'w') as f:
+            gen.write_ddl(f)
+
+    sys.stderr.write('{} inserts, {} updates, {} deletes, '
+                     '{} rows affected by updates/deletes, '
+                     '{} seed groups\n'.format(
+                         gen.counts['insert'], gen.counts['update'],
+                         gen.counts['delete'], gen.rows_affected,
+                         len(gen.seeds)))
@@ -0,0 +1,92 @@
+'''
+Run one dml script against several databases at once
+
+Usage:
+    python sysimp_verify.py fanout -dml <path to dml script>
+                                   -user <db user> -db bw3_qa uat preprod
+
+    prompts:
+        - Password: <database password>
+
+Description
+- every target database gets a thread and its own session pool: the
+  script is captured on a pooled session and rolled back, the backout
+  and validation are written, then the dml / backout / dml
+  verification runs in sqlplus, as a single database run does.
+- a failing target doesn't stop the others.
+- outputs are named <timestamp>_<db>_... per target as in a single
+  run. <timestamp>_fanout_report.json lists every target's status,
+  error, outputs, statement counts and phase timings, and the same
+  summary is printed as a table at the end.
+'''
+
+import json
+import os
+import threading
+
+from timing import clock
+
+REPORT_VERSION = 1
+
+
+def fan_out(targets, run_target):
+    '''
+    run_target(target) for every target on a thread of its own, return
+    {target: result dict}; an exception or exit is an 'error' result
+    '''
+    results = {}
+
+    def run(target):
+        start = clock()
+        try:
+            result = run_target(target)
+        except SystemExit as e:
+            result = {'status': 'error',
+                      'error': 'stopped: {}'.format(e.code or 'exit')}
+        except Exception as e:
+            result = {'status': 'error', 'error': str(e) or repr(e)}
+        result.setdefault('status', 'ok')
+        result['seconds'] = round(clock() - start, 3)
+        results[target] = result
+
+    threads = [threading.Thread(target=run, args=(target,))
+               for target in targets]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def write_report(path, results, info=None):
+    '''
+    the consolidated report of a fan_out, written atomically
+    '''
+    report = {'report_version': REPORT_VERSION,
+              'info': info or {},
+              'ok': sorted(t for t, r in results.items()
+                           if r['status'] == 'ok'),
+              'failed': sorted(t for t, r in results.items()
+                               if r['status'] != 'ok'),
+              'targets': results}
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True, default=str)
+        f.write('\n')
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp, path)
+    return path
+
+
+def print_report(results, targets):
+    template = '{:<20} | {:<6} | {:>10} | {:>9} | {}'
+    print template.format('Target', 'Status', 'Statements', 'Seconds',
+                          'Backout / error')
+    for target in targets:
+        r = results[target]
+        print template.format(
+            target, r['status'],
+            sum(r.get('statements', {}).values()),
+            '{:.1f}'.format(r['seconds']),
+            r.get('error') or r.get('artifacts', {}).get('rollback.sql', ''))
@@ -0,0 +1,80 @@
+'''
+Structured error journal for sysimp_verify runs
+
+Usage:
+    journal = ErrorJournal('run_cx_Oracle.jsonl')
+    journal.error('database', line=12, statement=3, sql=sql, exc=e)
+    ...
+    journal.close()
+    if journal.errors:
+        ...
+
+Description
+- one JSON object per line, so downstream tooling can read the file
+  a line at a time without parsing free text.
+- the file is opened once, on the first event, with a large write
+  buffer. Scripts with thousands of failing statements pay for one
+  open/close instead of one per error.
+- each event carries the statement index, dml line number, SQL, the
+  ORA- code pulled from the driver message and seconds since the
+  journal was created.
+'''
+
+import json
+import re
+
+from timing import clock
+
+ORA_CODE = re.compile(r'\b(ORA-\d{5})\b')
+
+BUFFER_BYTES = 1 << 16
+
+
+class ErrorJournal:
+
+    '''
+    Buffered JSONL event log owned by one run
+    '''
+
+    def __init__(self, path, buffer_bytes=BUFFER_BYTES):
+        self.path = path
+        self.buffer_bytes = buffer_bytes
+        self.start = clock()
+        self.f = None
+        self.errors = 0
+        self.events = 0
+
+    def record(self, event, **fields):
+        fields['event'] = event
+        fields['elapsed'] = round(clock() - self.start, 6)
+        if self.f is None:
+            self.f = open(self.path, 'a', self.buffer_bytes)
+        self.f.write(json.dumps(fields, sort_keys=True, default=str))
+        self.f.write('\n')
+        self.events += 1
+
+    def error(self, kind, line=None, statement=None, sql=None, exc=None,
+              message=None):
+        '''
+        record an error event; exc is the exception being handled
+        '''
+        if message is None and exc is not None:
+            message = str(exc).strip()
+        m = ORA_CODE.search(message or '')
+        self.errors += 1
+        self.record('error',
+                    kind=kind,
+                    line=line,
+                    statement=statement,
+                    sql=sql,
+                    ora_code=m.group(1) if m else None,
+                    message=message)
+
+    def flush(self):
+        if self.f is not None:
+            self.f.flush()
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
@@ -0,0 +1,227 @@
+'''
+Forbidden statement rules for dml scripts
+
+Usage:
+    scanner = KeywordScanner(['commit', 'disable'])
+    for block in blocks:            # whole lines, lower case
+        scanner.feed(block)
+    scanner.finish()
+    scanner.found                   # {rule: line of the first hit}
+
+Description
+- a rule names statements a dml script must not contain:
+    commit         COMMIT, and SQL*Plus SET AUTO[COMMIT] other than OFF
+    rollback       ROLLBACK
+    ddl            CREATE, ALTER, DROP, TRUNCATE, RENAME, GRANT, REVOKE,
+                   COMMENT, ANALYZE, AUDIT, NOAUDIT, FLASHBACK, PURGE
+    alter_trigger  ALTER TRIGGER
+    disable        ALTER ... DISABLE (a trigger, constraint, ...)
+- rules match statement keywords only: the first word of a statement,
+  i.e. at the start of the script, after ';', a '/' line, a SQL*Plus
+  command line or PL/SQL BEGIN, THEN, ELSE and LOOP. Words in string
+  literals, quoted identifiers and comments never match, so an
+  AUDIT_TRAIL value 'commit fix' or a '-- disable' note is allowed.
+- the string literal run by EXECUTE IMMEDIATE is dynamic SQL: it is
+  checked against the commit, rollback, ddl, alter_trigger and disable
+  rules as a statement of its own.
+- literals and comments are removed from a block by one substitution,
+  the first words of every rule are then found with one alternation
+  over what is left, run only when one of them occurs in the block at
+  all. A candidate is checked against the text before it.
+- a block ending inside a literal, a comment or a candidate statement
+  is held back and scanned with the next one.
+'''
+
+import re
+
+RULES = {
+    'commit': (('commit',), None),
+    'rollback': (('rollback',), None),
+    'ddl': (('create', 'alter', 'drop', 'truncate', 'rename', 'grant',
+             'revoke', 'comment', 'analyze', 'audit', 'noaudit',
+             'flashback', 'purge'), None),
+    'alter_trigger': (('alter',), r'^alter\s+trigger(?![\w$#])'),
+    'disable': (('alter',), r'(?<![\w$#])disable(?![\w$#])'),
+}
+
+DEFAULT_RULES = ('commit', 'disable')
+
+# string literals (q-quoted too), quoted identifiers and comments
+LITERALS = re.compile(
+    r"""q'(?:\[.*?\]|\{.*?\}|\(.*?\)|<.*?>|([^\s\[{(<]).*?\1)'"""
+    r"""|'[^']*'|"[^"]*"|--[^\n]*|/\*.*?\*/""", re.S)
+
+# SQL*Plus SET AUTO[COMMIT] with a value other than OFF, on one line
+AUTOCOMMIT = re.compile(
+    r'^[^\S\n]*set[^\S\n][^\n]*?(?<![\w$#])auto(?:c|co|com|comm|commi|commit)?'
+    r'[^\S\n]+(?!off(?![\w$#]))[\w$#]', re.M)
+
+# rules also checked against a SQL*Plus command line: (a word it must
+# contain, pattern)
+SQLPLUS_RULES = {'commit': ('auto', AUTOCOMMIT)}
+
+# the literal run by EXECUTE IMMEDIATE, q-quoted or with '' escapes
+DYNAMIC_SQL = re.compile(
+    r"execute\s+immediate\s*(?:q'(?:\[(.*?)\]|\{(.*?)\}|\((.*?)\)|<(.*?)>"
+    r"|([^\s\[{(<])(.*?)\5)'|'((?:[^']|'')*)')", re.S)
+EXECUTE_IMMEDIATE = re.compile(r'(?<![\w$#])execute\s+immediate(?![\w$#])')
+
+# rules dynamic SQL is checked against
+DYNAMIC_RULES = ('commit', 'rollback', 'ddl', 'alter_trigger', 'disable')
+
+# what is left of a literal or comment a block doesn't close
+OPENING = ("'", '"', '/*')
+
+# words after which a statement starts
+OPENERS = ('begin', 'then', 'else', 'loop')
+
+# SQL*Plus commands, a line starting with one ends at the newline
+SQLPLUS_COMMANDS = ('set', 'prompt', 'pro', 'spool', 'define', 'def',
+                    'undefine', 'whenever', 'rem', 'remark', 'show',
+                    'column', 'col', 'host', 'pause')
+
+
+class KeywordScanner:
+
+    '''
+    Statement level rule checks over a dml script fed a block at a time
+    '''
+
+    def __init__(self, rules=DEFAULT_RULES):
+        unknown = [rule for rule in rules if rule not in RULES]
+        if unknown:
+            raise ValueError('unknown keyword rules: {}'.format(
+                ', '.join(unknown)))
+        self.rules = tuple(rules)
+        self.words = {}
+        self.checks = {}
+        for rule in self.rules:
+            words, check = RULES[rule]
+            for word in words:
+                self.words.setdefault(word, []).append(rule)
+            self.checks[rule] = re.compile(check) if check else None
+        self.candidates = re.compile(r'(?<![\w$#])(?:{})(?![\w$#])'.format(
+            '|'.join(sorted(self.words, key=len, reverse=True))))
+        self.found = {}
+        self.line = 0
+        self.pending = ''
+        self.tail = ''
+
+    def feed(self, block):
+        '''
+        scan block, whole lower case lines following the previous block
+        '''
+        block, self.pending = self.pending + block, ''
+        if len(self.found) == len(self.rules):
+            return
+        text = LITERALS.sub('', block)
+        if any(mark in text for mark in OPENING) or \
+                not self.scan(block, text):
+            self.pending = block
+
+    def finish(self):
+        '''
+        scan what was held back, a literal left open runs to the end
+        '''
+        block, self.pending = self.pending, ''
+        if block and len(self.found) < len(self.rules):
+            text = LITERALS.sub('', block)
+            opened = [text.find(mark) for mark in OPENING if mark in text]
+            self.scan(block, text[:min(opened)] if opened else text,
+                      final=True)
+
+    def scan(self, block, text, final=False):
+        '''
+        record the rules matched in text, block without its literals,
+        False if a candidate statement goes on past the block
+        '''
+        if any(word in text for word in self.words):
+            for m in self.candidates.finditer(text):
+                if not self.statement_start(text, m.start()):
+                    continue
+                rules = self.words[m.group()]
+                statement = ''
+                if any(self.checks[rule] for rule in rules):
+                    end = text.find(';', m.end())
+                    if end == -1 and not final:
+                        return False
+                    statement = text[m.start():end if end != -1 else None]
+                for rule in rules:
+                    check = self.checks[rule]
+                    if rule not in self.found and (
+                            check is None or check.search(statement)):
+                        self.hit(rule, block, m.start())
+        for rule in self.rules:
+            word, pattern = SQLPLUS_RULES.get(rule, (None, None))
+            if rule not in self.found and word is not None and word in text:
+                m = pattern.search(text)
+                if m:
+                    self.hit(rule, block, m.start())
+        if 'immediate' in text:
+            self.dynamic(block, text)
+        self.line += block.count('\n')
+        self.tail = text[-200:]
+        return True
+
+    def hit(self, rule, block, pos):
+        '''
+        record rule as found at pos of block without its literals
+        '''
+        self.found[rule] = self.line + block.count(
+            '\n', 0, raw_position(block, pos)) + 1
+
+    def dynamic(self, block, text):
+        '''
+        check the literals run by EXECUTE IMMEDIATE in block as
+        statements of their own
+        '''
+        rules = [rule for rule in self.rules
+                 if rule in DYNAMIC_RULES and rule not in self.found]
+        if not rules:
+            return
+        for m in EXECUTE_IMMEDIATE.finditer(text):
+            literal = DYNAMIC_SQL.match(block, raw_position(block, m.start()))
+            if literal is None:
+                # a variable or an expression
+                continue
+            groups = literal.groups()
+            sql = next((g for g in groups[:4] + groups[5:6] if g is not None),
+                       None)
+            if sql is None:
+                sql = groups[6].replace("''", "'")
+            inner = KeywordScanner(rules)
+            inner.feed(sql + '\n')
+            inner.finish()
+            for rule in inner.found:
+                if rule not in self.found:
+                    self.hit(rule, block, m.start())
+
+    def statement_start(self, text, pos):
+        '''
+        True if pos in text without literals is the first word of a
+        statement
+        '''
+        window = text[max(0, pos - 4000):pos]
+        if pos <= 4000:
+            window = self.tail + window
+        before = window.rstrip()
+        if not before or before.endswith(';'):
+            return True
+        last_line = before[before.rfind('\n') + 1:].split()
+        if last_line == ['/'] or last_line[-1] in OPENERS:
+            return True
+        # a SQL*Plus command ends at its newline
+        return '\n' in window[len(before):] and (
+            last_line[0] in SQLPLUS_COMMANDS or last_line[0][0] == '@')
+
+
+def raw_position(block, pos):
+    '''
+    position in block of pos in block without its literals
+    '''
+    removed = 0
+    for m in LITERALS.finditer(block):
+        if m.start() - removed > pos:
+            break
+        removed += m.end() - m.start()
+    return pos + removed
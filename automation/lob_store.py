@@ -0,0 +1,207 @@
+'''
+Side file storage for captured CLOB/BLOB values
+
+Usage:
+    lobs = LobStore(os.path.join(this_dir, '<timestamp>_<db>_lobs'))
+    ref = lobs.spill(row[k], 'clob')     # while the row is current
+    ...
+    write_restore(f, tab, insert, [(col, ref)])   # backout blocks
+
+Description
+- a LOB locator is read LOB_READ_CHUNK characters (CLOB) or bytes
+  (BLOB) at a time straight into its own side file, the row image keeps
+  a LobRef. Memory stays bounded by the chunk size however large the
+  values are.
+- the backout restores a LOB by inserting EMPTY_CLOB()/EMPTY_BLOB()
+  returning the locator and appending the side file in LOB_WRITE_CHUNK
+  pieces with dbms_lob.writeappend, streamed from the file as the
+  backout is written:
+    CLOB:  quoted literals, newlines, carriage returns and '&' written
+           as chr() so no sqlplus line gets long or is substituted
+    NCLOB: the same as N'' literals into an nvarchar2 buffer
+    BLOB:  hextoraw literals
+- a PL/SQL block makes at most LOB_BLOCK_CHUNKS writes, so however
+  large the value no block nears the PL/SQL program size limit. The
+  insert keeps the row's rowid in the SQL*Plus variable
+  sysimp_lob_rowid, a block after the first selects its locator again
+  by it FOR UPDATE.
+- CLOB chunks are cut after an ASCII byte (before a UTF-8 lead byte
+  when there is none), so a multibyte character isn't split between
+  two writes.
+- the side files are kept after the run, the backout doesn't need them.
+'''
+
+import binascii
+import os
+import tempfile
+
+LOB_READ_CHUNK = 1 << 16
+LOB_WRITE_CHUNK = 1000
+LOB_BLOCK_CHUNKS = 100
+
+LOB_KINDS = ('clob', 'nclob', 'blob')
+
+# characters a CLOB literal carries as chr(n)
+CLOB_SPECIAL = {'\n': 10, '\r': 13, '&': 38}
+
+# the PL/SQL buffer a chunk of each kind is written through
+BUFFERS = {'clob': ('s', 'varchar2(32767)'),
+           'nclob': ('n', 'nvarchar2(32767)'),
+           'blob': ('r', 'raw(32767)')}
+
+# SQL*Plus variable holding the rowid of the row being restored
+ROWID_VAR = 'sysimp_lob_rowid'
+
+
+def is_lob(val):
+    '''
+    True for a LOB locator as fetched by cx_Oracle
+    '''
+    return hasattr(val, 'read') and hasattr(val, 'size')
+
+
+class LobRef:
+
+    '''
+    A captured LOB value: its side file, kind and length
+    '''
+
+    def __init__(self, path, kind, size):
+        self.path = path
+        self.kind = kind
+        self.size = size
+
+    def __repr__(self):
+        return '<{} {} ({})>'.format(self.kind, self.path, self.size)
+
+    def empty(self):
+        return 'EMPTY_BLOB()' if self.kind == 'blob' else 'EMPTY_CLOB()'
+
+    def chunks(self, size=LOB_WRITE_CHUNK):
+        '''
+        yield the stored value in pieces of at most size bytes
+        '''
+        with open(self.path, 'rb') as f:
+            rest = ''
+            while True:
+                data = f.read(size - len(rest))
+                data = rest + data
+                if not data:
+                    return
+                rest = ''
+                if self.kind != 'blob' and len(data) == size:
+                    cut = len(data)
+                    while cut > 0 and ord(data[cut - 1]) >= 0x80:
+                        cut -= 1
+                    if cut == 0:
+                        # no ASCII at all, cut before the last UTF-8 lead
+                        cut = len(data) - 1
+                        while cut > 0 and 0x80 <= ord(data[cut]) < 0xc0:
+                            cut -= 1
+                    if cut > 0:
+                        data, rest = data[:cut], data[cut:]
+                yield data
+
+    def write_chunk(self, f, var, data):
+        '''
+        write the PL/SQL statements appending data to locator var
+        '''
+        if self.kind == 'blob':
+            f.write("    r := hextoraw('{}');\n"
+                    "    dbms_lob.writeappend({}, utl_raw.length(r), r);\n"
+                    .format(binascii.hexlify(data).upper(), var))
+            return
+        buf = BUFFERS[self.kind][0]
+        quote = "n'" if self.kind == 'nclob' else "'"
+        f.write('    {} := '.format(buf))
+        text = ''
+        for c in data:
+            if c in CLOB_SPECIAL:
+                if text:
+                    f.write("{}{}' || ".format(quote, text.replace("'", "''")))
+                    text = ''
+                f.write('chr({})\n        || '.format(CLOB_SPECIAL[c]))
+            else:
+                text += c
+        f.write("{}{}';\n".format(quote, text.replace("'", "''")))
+        f.write('    dbms_lob.writeappend({0}, length({1}), {1});\n'
+                .format(var, buf))
+
+
+def write_restore(f, tab, insert, lobs, block_chunks=LOB_BLOCK_CHUNKS):
+    '''
+    Write the PL/SQL blocks restoring a row with LOBs. insert inserts
+    the row with empty LOBs returning lobs, [(column, LobRef)], into
+    l1, l2, ... and its rowid into rid. The values are then appended at
+    most block_chunks writes per block, a later block selecting its
+    locator again by the rowid.
+    '''
+    kinds = sorted(set(ref.kind for col, ref in lobs))
+    f.write('variable {} varchar2(30)\ndeclare\n'.format(ROWID_VAR))
+    for n, (col, ref) in enumerate(lobs, 1):
+        f.write('    l{} {};\n'.format(n, ref.kind))
+    f.write('    rid rowid;\n')
+    for kind in kinds:
+        f.write('    {} {};\n'.format(*BUFFERS[kind]))
+    f.write('begin\n')
+    f.write(insert)
+    f.write('    :{} := rowidtochar(rid);\n'.format(ROWID_VAR))
+    writes = 0
+    continued = False
+    for n, (col, ref) in enumerate(lobs, 1):
+        var = 'l{}'.format(n)
+        if continued:
+            # this block only has the previous locator
+            writes = block_chunks
+        for data in ref.chunks():
+            if writes == block_chunks:
+                f.write('end;\n/\ndeclare\n'
+                        '    {} {};\n    {} {};\nbegin\n'
+                        '    select {} into {} from {}\n'
+                        '        where rowid = chartorowid(:{}) '
+                        'for update;\n'.format(
+                            var, ref.kind, BUFFERS[ref.kind][0],
+                            BUFFERS[ref.kind][1], col, var, tab, ROWID_VAR))
+                writes = 0
+                continued = True
+            ref.write_chunk(f, var, data)
+            writes += 1
+    f.write('end;\n/')
+
+
+class LobStore:
+
+    '''
+    Spill LOB values of one run to side files under root
+    '''
+
+    def __init__(self, root=None, chunk=LOB_READ_CHUNK):
+        self.root = root
+        self.chunk = chunk
+        self.count = 0
+        self.bytes = 0
+
+    def spill(self, lob, kind):
+        '''
+        Read lob chunk by chunk into a new side file, return its LobRef.
+        Must be called before the cursor fetches past the lob's row.
+        '''
+        if self.root is None:
+            self.root = tempfile.mkdtemp(prefix='sysimp_lobs_')
+        elif not os.path.exists(self.root):
+            os.makedirs(self.root)
+        self.count += 1
+        path = os.path.join(self.root, '{:06d}.{}'.format(self.count, kind))
+        size = lob.size()
+        offset = 1
+        with open(path, 'wb') as f:
+            while offset <= size:
+                data = lob.read(offset, self.chunk)
+                if not data:
+                    break
+                if isinstance(data, unicode):
+                    data = data.encode('utf-8')
+                f.write(data)
+                self.bytes += len(data)
+                offset += self.chunk
+        return LobRef(path, kind, size)
@@ -0,0 +1,208 @@
+'''
+Preflight cost estimate of a dml script, before its capture
+
+Usage:
+    preflight = Preflight(cursor, cx_Oracle.DatabaseError)
+    preflight.run(config_dict.iter_statements())
+    preflight.totals        # rows, memory_bytes, seconds, full_scans
+    preflight.exceeded({'rows': 10 ** 6, 'memory_mb': 2048})
+
+Description
+- the rows every update and delete touches are selected as its capture
+  selects them, and that select is explained (EXPLAIN PLAN) into
+  PLAN_TABLE: the optimizer's row estimate, its cost and whether a
+  table is read by a full scan. The plan rows are deleted again.
+- a COUNT(*) of the same select replaces the estimate when it is cheap:
+  no full scan of a table with more than big_table_rows rows by its
+  dictionary statistics (NUM_ROWS). A full scan of such a table, or of
+  one without statistics, is a warning.
+- an insert captures one row.
+- capture memory is the rows times their table's average row length
+  (AVG_ROW_LEN) plus PAIR_BYTES per column for the [column, value]
+  pairs of a row image, twice for an update (pre and post images).
+  Capture time is ROUND_TRIP_S per query plus rows at CAPTURE_ROWS_S.
+  Both are estimates from the tables as they are before the script
+  runs: a statement touching rows inserted by an earlier one is
+  counted low.
+- a statement that can't be explained (no PLAN_TABLE, a syntax the
+  optimizer rejects) is reported with its error and not budgeted.
+- budgets: rows, memory_mb, seconds and full_scans; exceeded lists the
+  totals over their budget.
+'''
+
+import re
+
+BIG_TABLE_ROWS = 1000000
+
+# bytes of a [column, value] pair of a captured row image
+PAIR_BYTES = 150
+# row bytes of a table without statistics
+DEFAULT_ROW_BYTES = 4096
+ROUND_TRIP_S = 0.002
+CAPTURE_ROWS_S = 20000
+
+WHERE = re.compile(r'where\s', re.I)
+DELETE_FROM = re.compile(r'^\s*delete\s+(?:[*]\s+)?(?:from\s+)?', re.I)
+
+
+def select_of(kind, statement, tn):
+    '''
+    the select of the rows an update or delete touches, as its capture
+    selects them
+    '''
+    statement = statement.rstrip(';')
+    if kind == 'delete':
+        return 'select * from ' + DELETE_FROM.sub('', statement, 1)
+    where = WHERE.search(statement)
+    return 'select * from {} {}'.format(
+        tn, statement[where.start():] if where else '')
+
+
+class Preflight:
+
+    '''
+    Row, memory and time estimates of capturing a dml script
+
+    cursor: a cursor on the database the script runs on, error: the
+    driver's DatabaseError
+    '''
+
+    def __init__(self, cursor, error, big_table_rows=BIG_TABLE_ROWS):
+        self.cursor = cursor
+        self.error = error
+        self.big_table_rows = big_table_rows
+        self.tables = {}
+        self.statements = []
+        self.totals = {'statements': 0, 'rows': 0, 'memory_bytes': 0,
+                       'seconds': 0.0, 'full_scans': 0, 'unknown': 0}
+
+    def table_stats(self, tn):
+        '''
+        (num_rows, avg_row_len, columns) of tn from the dictionary, None
+        for what isn't known
+        '''
+        if tn not in self.tables:
+            if '.' in tn:
+                owner, name = tn.split('.', 1)
+                query = ("select t.num_rows, t.avg_row_len, "
+                         "(select count(*) from all_tab_columns c "
+                         "where c.owner = t.owner "
+                         "and c.table_name = t.table_name) "
+                         "from all_tables t "
+                         "where t.owner = upper(:o) "
+                         "and t.table_name = upper(:n)")
+                binds = {'o': owner, 'n': name}
+            else:
+                query = ("select t.num_rows, t.avg_row_len, "
+                         "(select count(*) from user_tab_columns c "
+                         "where c.table_name = t.table_name) "
+                         "from user_tables t "
+                         "where t.table_name = upper(:n)")
+                binds = {'n': tn}
+            try:
+                self.cursor.execute(query, **binds)
+                rows = self.cursor.fetchall()
+            except self.error:
+                rows = []
+            self.tables[tn] = tuple(rows[0]) if rows else (None, None, None)
+        return self.tables[tn]
+
+    def explain(self, select, statement_id):
+        '''
+        (estimated rows, cost, tables read by a full scan) of select
+        '''
+        self.cursor.execute(
+            "explain plan set statement_id = '{}' for {}".format(
+                statement_id, select))
+        try:
+            self.cursor.execute(
+                "select operation, options, object_owner, object_name, "
+                "cardinality, cost from plan_table "
+                "where statement_id = :s order by id", s=statement_id)
+            plan = self.cursor.fetchall()
+        finally:
+            self.cursor.execute(
+                "delete from plan_table where statement_id = :s",
+                s=statement_id)
+        if not plan:
+            return None, None, []
+        full = [name.lower() for operation, options, owner, name, rows, cost
+                in plan if operation == 'TABLE ACCESS' and options == 'FULL']
+        return plan[0][4], plan[0][5], full
+
+    def estimate(self, index, kind, g, tn, line):
+        '''
+        the cost of one statement, added to the totals
+        '''
+        num_rows, row_len, columns = self.table_stats(tn)
+        entry = {'statement': index, 'line': line, 'kind': kind,
+                 'table': tn, 'table_rows': num_rows}
+        queries = 1
+        if kind == 'insert':
+            rows = 1
+            queries = 2
+        else:
+            select = select_of(kind, g, tn)
+            try:
+                estimated, cost, full = self.explain(
+                    select, 'sysimp_preflight_{}'.format(index))
+            except self.error as e:
+                entry['error'] = str(e).strip()
+                self.totals['unknown'] += 1
+                self.statements.append(entry)
+                return entry
+            big = num_rows is None or num_rows > self.big_table_rows
+            entry.update(estimated_rows=estimated, cost=cost,
+                         full_scan=bool(full), warning=None)
+            rows = estimated or 0
+            if full and big:
+                entry['warning'] = 'full scan of {} ({})'.format(
+                    tn, 'no statistics' if num_rows is None
+                    else '{} rows'.format(num_rows))
+                self.totals['full_scans'] += 1
+            else:
+                try:
+                    self.cursor.execute(
+                        'select count(*)' + select[len('select *'):])
+                    rows = self.cursor.fetchall()[0][0]
+                    entry['counted_rows'] = rows
+                except self.error:
+                    pass
+        if row_len is None:
+            row_bytes = DEFAULT_ROW_BYTES
+        else:
+            row_bytes = row_len + PAIR_BYTES * (columns or 0)
+        images = 2 if kind == 'update' else 1
+        entry['rows'] = rows
+        entry['memory_bytes'] = rows * row_bytes * images
+        entry['seconds'] = queries * ROUND_TRIP_S + \
+            float(rows) / CAPTURE_ROWS_S
+        self.totals['statements'] += 1
+        for name in ('rows', 'memory_bytes', 'seconds'):
+            self.totals[name] += entry[name]
+        self.statements.append(entry)
+        return entry
+
+    def run(self, statements):
+        '''
+        estimate statements, what ConfigDict.iter_statements yields
+        '''
+        for index, (kind, g, tn, line) in enumerate(statements, 1):
+            self.estimate(index, kind, g, tn, line)
+        return self.totals
+
+    def exceeded(self, budgets):
+        '''
+        [(budget, estimate, limit)] of the budgets the totals are over,
+        budgets: {'rows', 'memory_mb', 'seconds', 'full_scans': limit}
+        '''
+        estimates = dict(self.totals)
+        estimates['memory_mb'] = self.totals['memory_bytes'] / float(1 << 20)
+        return [(name, estimates[name], limit)
+                for name, limit in sorted(budgets.items())
+                if limit is not None and estimates[name] > limit]
+
+    def report(self):
+        return {'totals': self.totals,
+                'big_table_rows': self.big_table_rows,
+                'statements': self.statements}
@@ -0,0 +1,135 @@
+'''
+Local result cache for sysimp_verify runs
+
+Usage:
+    cache = ResultCache(os.path.join(this_dir, '.sysimp_cache'),
+                        salt=tool_source_hash, max_age_s=24 * 3600)
+    key = cache.key(dml_bytes, 'simp_user@bw3_qa', fingerprint)
+    if cache.restore(key, {'backout': backout_path, ...}):
+        ...  # previous outputs copied into place, nothing to run
+    ...
+    cache.store(key, {'backout': backout_path, ...}, meta)
+
+Description
+- an entry is addressed by sha256 of:
+    - the dml script content
+    - the target, user@db (never the password)
+    - the schema/data fingerprint of the tables the script touches,
+      built by ConfigDict.fingerprint from LAST_DDL_TIME and
+      MAX(ORA_ROWSCN), a full scan of each table, which is why the
+      cache is only used with -cache
+    - the salt, a hash of the tool source and its modules, so a new
+      tool version never serves outputs produced by an older one
+- invalidation rules:
+    - any change to one of the key inputs is a miss, the old entry
+      is simply never addressed again
+    - entries older than max_age_s are a miss and are removed
+    - entries with a missing artifact are a miss and are removed
+    - a run without a fingerprint (a table could not be queried)
+      is neither looked up nor stored
+    - only runs without cx_Oracle or sqlplus errors are stored
+    - clear() removes every entry
+- entries are written to a temporary directory and renamed into
+  place, so an interrupted run never leaves a half written entry.
+'''
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+MANIFEST = 'manifest.json'
+
+
+class ResultCache:
+
+    '''
+    Content addressed store of run artifacts
+    '''
+
+    def __init__(self, root, salt='', max_age_s=None):
+        self.root = root
+        self.salt = salt
+        self.max_age_s = max_age_s
+
+    def key(self, script, target, fingerprint):
+        h = hashlib.sha256()
+        h.update(self.salt.encode('utf-8'))
+        h.update(b'\0')
+        h.update(hashlib.sha256(script).hexdigest().encode('utf-8'))
+        h.update(b'\0')
+        h.update(target.lower().encode('utf-8'))
+        h.update(b'\0')
+        h.update(json.dumps(fingerprint, sort_keys=True,
+                            default=str).encode('utf-8'))
+        return h.hexdigest()
+
+    def entry_dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def lookup(self, key):
+        '''
+        return the manifest of a valid entry or None
+        '''
+        d = self.entry_dir(key)
+        path = os.path.join(d, MANIFEST)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            manifest = json.load(f)
+        if self.max_age_s is not None and \
+                time.time() - manifest['stored'] > self.max_age_s:
+            self.remove(key)
+            return None
+        for name in manifest['artifacts']:
+            if not os.path.exists(os.path.join(d, name)):
+                self.remove(key)
+                return None
+        return manifest
+
+    def restore(self, key, dest):
+        '''
+        copy cached artifacts to dest {artifact: path}, return manifest
+        '''
+        manifest = self.lookup(key)
+        if manifest is None:
+            return None
+        d = self.entry_dir(key)
+        for name, path in dest.items():
+            if name in manifest['artifacts']:
+                shutil.copyfile(os.path.join(d, name), path)
+        return manifest
+
+    def store(self, key, artifacts, meta=None):
+        '''
+        save {artifact: path} under key, skipping paths that don't exist
+        '''
+        d = self.entry_dir(key)
+        tmp = '{}.tmp{}'.format(d, os.getpid())
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        stored = []
+        for name, path in artifacts.items():
+            if os.path.exists(path):
+                shutil.copyfile(path, os.path.join(tmp, name))
+                stored.append(name)
+        manifest = {'key': key,
+                    'stored': time.time(),
+                    'artifacts': sorted(stored),
+                    'meta': meta or {}}
+        with open(os.path.join(tmp, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True, default=str)
+        self.remove(key)
+        os.rename(tmp, d)
+        return manifest
+
+    def remove(self, key):
+        d = self.entry_dir(key)
+        if os.path.exists(d):
+            shutil.rmtree(d)
+
+    def clear(self):
+        if os.path.exists(self.root):
+            shutil.rmtree(self.root)
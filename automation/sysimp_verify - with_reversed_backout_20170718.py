@@ -8,6 +8,22 @@ Usage:
         python sysimp_verify.py -h
     verfify & backout:
         python sysimp_verify.py -dml <path to dml script>
+    scripts again from a saved capture, no database:
+        python sysimp_verify.py regenerate -capture_file <capture file>
+                                [-binds] [-bind_chunk N] [-validation set]
+    service for a release pipeline (see backout_service.py):
+        python sysimp_verify.py serve -user <db user> -db <SID> [<SID> ...]
+                                [-port 8765 | -socket <path>]
+    one script on several databases at once (see fanout.py):
+        python sysimp_verify.py fanout -dml <path to dml script>
+                                -user <db user> -db <SID> <SID> [...]
+    reprocess scripts as they are edited (see dml_watch.py):
+        python sysimp_verify.py watch -dir SCRIPTS/dml -user <db user>
+                                -db <SID> [-debounce_s 2]
+    library:
+        capture = sysimp_verify.capture('release.sql', connection)
+        sysimp_verify.generate(capture, {'rollback.sql': path,
+                                         'validation.sql': path})
 
     prompts:
         - db username: e.g. simp_<windows id>
@@ -25,20 +41,156 @@ Description
 - if verify step ok, create the backout script using the data
   created by ConfigDict
 - verify the backout script by running dml, backout, dml.
+- with -conflicts warn|abort the statements are checked, before any
+  database work, for pairs that may touch the same rows. The first
+  CONFLICT_JOURNAL_LIMIT pairs are journaled.
+- with -capture flashback the script is run at full speed and the
+  pre-images are read afterwards AS OF the starting SCN, one query per
+  table. Scripts whose statements see each other's changes fall back
+  to the per statement capture.
+- CLOB/BLOB values are streamed to side files in <timestamp>_<db>_lobs
+  while captured, and restored in the backout by chunked dbms_lob
+  writes, so memory use doesn't depend on LOB sizes.
+- with -binds every backout block is written as PL/SQL blocks with
+  the rows in collections bound by one forall statement per table and
+  column list, so Oracle parses one text per shape instead of one per
+  row.
+- with -validation set the validation script has one query per insert
+  and delete statement, printing PASS or FAIL with the number of
+  captured rows found. With -validation gtt the expected rows are
+  staged as literal rows in the query, GTT_STAGE_ROWS at a time, and
+  compared with one MINUS/INTERSECT per table and direction, listing
+  the mismatching rows. No DDL, so it never commits the session.
+- with -bulk_rows N a second backout in <timestamp>_<db>_rollback_bulk/
+  loads every group of N or more re-inserted rows with SQL*Loader
+  direct path from a delimited data file. It commits before each
+  load, so it is only for backing out a deployed change, and SQL*Loader
+  prompts for the username and password of each load.
+- with -plan the backout is also split into parts touching unrelated
+  tables (no foreign key or subquery between them), written to
+  <timestamp>_<db>_rollback_plan/ with plan.json. Run the parts in
+  parallel sessions with backout_runner.py.
+- the captured statements and row images are saved to
+  <timestamp>_<db>_capture.sysimp, a compressed columnar snapshot
+  (capture_store.py). The regenerate subcommand writes the scripts
+  again from it with other options (-binds, -bind_chunk, -validation,
+  -plan, -bulk_rows) without cx_Oracle or a connection.
+- -resume_capture <capture file> of an earlier run of an edited
+  script replays the updates and deletes before the first changed
+  statement, the deletes in PL/SQL blocks, and reuses their captured
+  rows. Inserts and everything from the first changed statement on are
+  captured. The tables must be as they were before that run.
+- -preflight explains and, where cheap, counts the rows of every
+  update and delete before the capture (preflight.py) and reports the
+  rows, memory and time the capture would take and the full scans of
+  big tables, to <timestamp>_<db>_preflight.json. -max_rows,
+  -max_memory_mb, -max_capture_s and -max_full_scans stop the run
+  there when an estimate is over budget.
+- capture(script, conn) runs a dml script on a connection or connect
+  string and returns a Capture, generate(capture, sinks) writes any
+  of the scripts and the capture file from it. The serve subcommand
+  answers backout requests with both, keeping session pools and the
+  foreign key metadata warm between requests. The watch subcommand
+  does the same for every dml script of a directory that is added or
+  saved, keeping the latest outputs and a report per script. The
+  fanout subcommand runs capture, generation and the sqlplus
+  verification for a list of databases concurrently, a thread and
+  session pool each, with a consolidated report.
+- per-phase timings (parse, capture by statement kind and table,
+  generation, sqlplus steps, file i/o) are written to
+  <timestamp>_<db>_timings.json at the end of every run.
 '''
 
 import argparse
-import cx_Oracle
+import binascii
 import datetime
+import decimal
 import getpass
+import hashlib
+import json
+import mmap
 import os
+import pipes
 import re
+import shutil
 import subprocess
 import sys
-import time
+import textwrap
+import threading
+
+from backout_service import METADATA_TTL_S, BackoutService, MetadataCache
+from backout_service import release_session
+from backout_service import serve as serve_requests
+from capture_store import (CaptureReader, add_statement, capture_of,
+                           load_capture, native, statement_fingerprint,
+                           write_capture)
+from dependency import DependencyGraph, table_key
+from dml_watch import DEBOUNCE_S, INTERVAL_S, DmlWatcher
+from fanout import fan_out
+from fanout import print_report as print_fanout_report
+from fanout import write_report as write_fanout_report
+from journal import ErrorJournal
+from keyword_rules import DEFAULT_RULES, RULES, KeywordScanner
+from lob_store import LOB_KINDS, LobRef, LobStore, write_restore
+from preflight import BIG_TABLE_ROWS, Preflight
+from result_cache import ResultCache
+from timing import Timings, clock
 
 this_dir = os.path.dirname(__file__)
 
+# the modules of this directory the script imports, part of tool_hash
+TOOL_MODULES = ('backout_service', 'capture_store', 'dependency',
+                'dml_watch', 'fanout', 'journal', 'keyword_rules',
+                'lob_store', 'preflight', 'result_cache', 'timing')
+
+# conflicting statement pairs written to the journal, the total is
+# always journaled
+CONFLICT_JOURNAL_LIMIT = 1000
+
+# default rows per fetch round trip for capture queries
+ARRAYSIZE = 1000
+
+# bytes of the mapped dml script handled per step of scan_dml
+SCAN_BLOCK = 1 << 20
+
+# the start of a line starting a statement, in lower case text
+STATEMENT_START = re.compile(r'\n[^\S\n]*(?:insert|update|delete)')
+
+# the values and the columns of an update's set clause
+SET_VALUE = re.compile("\'(.*?)\'")
+SET_COLUMN = re.compile("(\w+)\s*=")
+
+
+def strip_comments(block):
+    '''
+    block without its '--' comments: a line with only a comment goes
+    with its newline, code before a comment stays without it
+    '''
+    pieces = []
+    start = 0
+    pos = block.find('--')
+    while pos != -1:
+        bol = max(block.rfind('\n', start, pos) + 1, start)
+        eol = block.find('\n', pos)
+        pieces.append(block[start:bol])
+        if block[bol:pos].strip():
+            pieces.append(block[bol:pos])
+        start = len(block) if eol == -1 else eol + 1
+        pos = block.find('--', start)
+    pieces.append(block[start:])
+    return ''.join(pieces)
+
+# imported on the first database use, so regenerate runs where the
+# Oracle client isn't installed
+cx_Oracle = None
+
+
+def load_driver():
+    global cx_Oracle
+    if cx_Oracle is None:
+        import cx_Oracle
+    return cx_Oracle
+
 
 class ConfigDict:
 
@@ -48,17 +200,74 @@ class ConfigDict:
     for each insert and update in configuation.sql
     '''
 
-    def __init__(self, conn_str, dmlpath, cx_Oracle_logfile):
-        self.db_conn = cx_Oracle.Connection(conn_str)
+    def __init__(self, conn_str, dmlpath, journal, timings=None,
+                 progress_ms=250, progress_log_s=10,
+                 capture_mode='statement', lob_dir=None,
+                 arraysize=ARRAYSIZE, prefetchrows=None, metadata=None,
+                 progress_label=None):
+        self.timings = timings if timings is not None else Timings()
+        self.progress_ms = progress_ms
+        self.progress_log_s = progress_log_s
+        # jobs run side by side log labelled progress lines (ConsoleOut)
+        self.progress_label = progress_label
+        self.capture_mode = capture_mode
+        # a connect string, or a connection the caller keeps and closes
+        self.own_conn = isinstance(conn_str, basestring)
+        if self.own_conn:
+            with self.timings.phase('connect'):
+                self.db_conn = load_driver().Connection(conn_str)
+        else:
+            load_driver()
+            self.db_conn = conn_str
+        # get(key) / put(key, value) store kept across runs, or None
+        self.metadata = metadata
         self.dmlpath = dmlpath
-        self.cx_Oracle_logfile = os.path.join(this_dir, cx_Oracle_logfile)
+        self.journal = journal
+        self.graph = None
+        self.foreign_key_pairs = None
+        # table fingerprint taken before the run, stored with the capture
+        self.table_fingerprint = None
+        # CaptureReader of an earlier capture to replay a prefix from
+        self.resume = None
+        self.replayed = 0
+        self.lobs = LobStore(lob_dir)
+        self.scans = {}
 
         cursor = self.db_conn.cursor()
+        cursor.arraysize = arraysize
+        if hasattr(cursor, 'prefetchrows'):
+            # cx_Oracle 8+, one round trip for queries up to arraysize rows
+            cursor.prefetchrows = (prefetchrows if prefetchrows is not None
+                                   else arraysize + 1)
         self.cursor = cursor
+        self.reset_capture()
+        self.insert = '''(insert\s+into\s+
+                         (?P<INSERT_TABLE>[^(]*)
+                         .*?;)\s*([\n]|$)'''
+        self.update = '''(update\s+
+                        (?P<UPDATE_TABLE>[^\s]*)
+                        .*?where
+                        .*?;)\s*([\n]|$)'''
+        self.delete = '''(delete\s+
+                         (?P<DELETE_1>[*]\s+)?
+                         (?P<DELETE_2>from\s+)
+                         (?P<DELETE_TABLE>[^\s]*)
+                         .*?;)\s*([\n]|$)'''
+
+    def reset_capture(self):
+        '''
+        empty everything collected by process_config
+        '''
         self.actual_tables = []
         self.column_dict = {}
+        self.column_types = {}
+        # {table: (columns, {column: index})}, see column_positions
+        self.column_index = {}
+        self.rows_fetched = 0
         self.line_list = []
+        self.statement_fingerprints = []
         self.current_line_num = None
+        self.statement_index = 0
         self.updates = []
         self.update_line_nums = []
         self.update_tables = []
@@ -73,81 +282,150 @@ class ConfigDict:
         self.delete_line_nums = []
         self.delete_tables = []
         self.del_or_up = []
-        self.insert = '''(insert\s+into\s+
-                         (?P<INSERT_TABLE>[^(]*)
-                         .*?;)\s*([\n]|$)'''
-        self.update = '''(update\s+
-                        (?P<UPDATE_TABLE>[^\s]*)
-                        .*?where
-                        .*?;)\s*([\n]|$)'''
-        self.delete = '''(delete\s+
-                         (?P<DELETE_1>[*]\s+)?
-                         (?P<DELETE_2>from\s+)
-                         (?P<DELETE_TABLE>[^\s]*)
-                         .*?;)\s*([\n]|$)'''
 
     def config_file_to_string(self, infile=None):
         '''
         turn configuration.sql into list of sql statements
         '''
-        if infile is None:
-            c = self.dmlpath
-        else:
-            c = infile
-        s = ''
-        with open(c, 'r') as f:
-            statement = re.compile('(insert|update|delete)',
-                                   re.I | re.S)
-            line_number = 0
-            for line_number, line in enumerate(f, start=1):
-                # Does this line contain start of statement
-                if statement.match(line.lstrip()):
-                    self.line_list.append(line_number)
-                # Handle comments
-                if '--' in line:
-                    pos = line.index('--')
-                    if pos == 0:
-                        continue
-                    elif line[:pos].strip() == '':
-                        continue
-                    else:
-                        s += line[:pos]
-                else:
-                    s += line
+        s, line_list, found = self.scan_dml(infile)
+        self.line_list.extend(line_list)
         return s
 
-    def validate_config(self, keyword_list):
+    def scan_dml(self, infile=None, rules=()):
+        '''
+        Return (statement text without comments, statement start lines,
+        {keyword rule: line} found) in one pass over the memory mapped
+        dml script, SCAN_BLOCK bytes at a time.
+        The result is kept, so the file is read once however often the
+        statements are parsed; a scan checks keyword rules only when asked.
+        '''
+        c = self.dmlpath if infile is None else infile
+        rules = tuple(rules)
+        scan = self.scans.get(c)
+        if scan is not None and set(rules) <= set(scan[3]):
+            return scan[:3]
+
+        scanner = KeywordScanner(rules)
+        pieces = []
+        line_list = []
+        with open(c, 'rb') as f:
+            try:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # an empty file can't be mapped
+                buf = None
+            try:
+                line_number = 0
+                while buf is not None:
+                    # SCAN_BLOCK bytes and the rest of the last line
+                    block = buf.read(SCAN_BLOCK)
+                    if not block:
+                        break
+                    block += buf.readline()
+                    if os.name == 'nt':
+                        # as a text mode read gives it
+                        block = block.replace('\r\n', '\n')
+                    # one lower case copy serves every search, a newline
+                    # in front so the first line starts like the others
+                    text = '\n' + block.lower()
+                    if rules:
+                        scanner.feed(text[1:])
+                    last = 0
+                    for m in STATEMENT_START.finditer(text):
+                        line_number += text.count('\n', last, m.start() + 1)
+                        last = m.start() + 1
+                        line_list.append(line_number)
+                    line_number += text.count('\n', last) - 1
+                    pieces.append(strip_comments(block))
+            finally:
+                if buf is not None:
+                    buf.close()
+        scanner.finish()
+        scan = self.scans[c] = (''.join(pieces), line_list, scanner.found,
+                                rules)
+        return scan[:3]
+
+    def validate_config(self, rules=DEFAULT_RULES):
         """
-        Ensure no 'commit' or 'trigger' filename
+        Ensure no statement the keyword rules forbid, e.g. commit
         """
-        with open(self.dmlpath, 'r') as f:
-            f = f.read()
-            for word in keyword_list:
-                if re.search(word, f, re.I):
-                    c = os.path.basename(self.dmlpath)
-                    print "'{}' found in {}, exiting".format(word, c)
-                    s = ("{} {} {}".format(
-                        c,
-                        "contains one of the keywords:",
-                        keyword_list))
-                    with open(self.cx_Oracle_logfile, 'a') as l:
-                        l.write('{}'.format(s))
-                    exit()
-
-    def process_config(self, infile=None):
+        s, line_list, found = self.scan_dml(rules=rules)
+        for rule in rules:
+            if rule in found:
+                c = os.path.basename(self.dmlpath)
+                print "'{}' found in {} line {}, exiting".format(
+                    rule, c, found[rule])
+                s = ("{} {} {}".format(
+                    c,
+                    "contains one of the keywords:",
+                    list(rules)))
+                self.journal.error('keyword', message=s, line=found[rule])
+                exit()
 
+    def touched_tables(self, infile=None):
         '''
-        Return a dictionary.
-        key = table name
-
-        value = tuple. index 0: list of sublists. Each sublist is the
-                                (column-name,value) of each affected row
-                                (insert, delete, update)
-
-                       index 1: line number of statement in configuration.sql
+        return the sorted table names the dml script writes to,
+        without executing anything
         '''
+        line_list = self.line_list
+        self.line_list = []
+        try:
+            s = self.config_file_to_string(infile)
+        finally:
+            self.line_list = line_list
+        STATEMENT = '({})|({})|({})'.format(
+            self.insert,
+            self.update,
+            self.delete)
+        tables = set()
+        for m in re.finditer(STATEMENT, s, re.I | re.S | re.X):
+            d = m.groupdict()
+            tn = d['INSERT_TABLE'] or d['UPDATE_TABLE'] or d['DELETE_TABLE']
+            tables.add(tn.strip().lower())
+        return sorted(tables)
 
-        s = self.config_file_to_string(infile)
+    def fingerprint(self, tables):
+        '''
+        Return [table, last ddl time, max ora_rowscn] for each table,
+        or None if any table can't be queried.
+        Any committed change to the table data or definition changes
+        the fingerprint. MAX(ORA_ROWSCN) reads every row of the table,
+        which is why the result cache is only used with -cache.
+        '''
+        result = []
+        try:
+            for tn in tables:
+                if '.' in tn:
+                    owner, name = tn.split('.', 1)
+                    self.cursor.execute(
+                        "select max(last_ddl_time) from all_objects "
+                        "where owner = upper(:o) and object_name = upper(:n) "
+                        "and object_type = 'TABLE'", o=owner, n=name)
+                else:
+                    self.cursor.execute(
+                        "select max(last_ddl_time) from user_objects "
+                        "where object_name = upper(:n) "
+                        "and object_type = 'TABLE'", n=tn)
+                ddl_time = self.cursor.fetchall()[0][0]
+                self.cursor.execute(
+                    "select max(ora_rowscn) from {}".format(tn))
+                scn = self.cursor.fetchall()[0][0]
+                if ddl_time is None:
+                    return None
+                result.append([tn, ddl_time, scn])
+        except cx_Oracle.DatabaseError:
+            return None
+        return result
+
+    def iter_statements(self, infile=None):
+        '''
+        yield (kind, statement, table name, line number) for each
+        statement in configuration.sql, in file order
+        '''
+        self.line_list = []
+        self.statement_fingerprints = []
+        with self.timings.phase('io.read_dml'):
+            s = self.config_file_to_string(infile)
 
         STATEMENT = '({})|({})|({})'.format(
             self.insert,
@@ -159,71 +437,475 @@ class ConfigDict:
         pattern_delete = re.compile(self.delete, re.I | re.S | re.X)
         pattern_update = re.compile(self.update, re.I | re.S | re.X)
 
-        results = {}
         line_list = list(self.line_list)
         statement_matches = match_statement.finditer(s)
-        console = ConsoleOut()
 
-        for count, m in enumerate(statement_matches, start=1):
-            self.current_line_num = line_list[0]
-            d = m.groupdict()
+        parse_start = clock()
+        for m in statement_matches:
             match_str = m.group()
-            
-            if sys.platform == 'linux2':
-                start_time = time.time()
-            else:
-                start_time = time.clock()
 
             match_insert = pattern_insert.match(match_str)
             match_update = pattern_update.match(match_str)
             match_delete = pattern_delete.match(match_str)
 
             if match_insert:
+                kind = 'insert'
                 d = match_insert.groupdict()
                 tn = d['INSERT_TABLE'].strip().lower()
                 g = match_insert.group(1)
-                g = g.replace('\n', ' ')
-                processed_statement = self.process_insert(g, tn)
 
             elif match_update:
+                kind = 'update'
                 d = match_update.groupdict()
                 g = match_update.group(1)
-                g = g.replace('\n', ' ')
                 tn = d['UPDATE_TABLE'].strip().lower()
-                processed_statement = self.process_update(g, tn)
 
             elif match_delete:
+                kind = 'delete'
                 d = match_delete.groupdict()
                 g = match_delete.group(1)
-                g = g.replace('\n', ' ')
                 tn = d['DELETE_TABLE'].strip().lower()
-                processed_statement = self.process_delete(g, tn)
             else:
-                print 'unexpected statement: {}'.format(match_str)
-                exit()
+                self.cursor.execute('rollback')
+                raise CaptureError('unexpected statement: {}'.format(
+                    match_str))
+
+            g = g.replace('\n', ' ')
+            line_num = line_list.pop(0)
+            self.statement_fingerprints.append(
+                [line_num, statement_fingerprint(g)])
+            self.timings.add('parse', clock() - parse_start)
+            yield kind, g, tn, line_num
+            parse_start = clock()
 
-            if tn not in results:
-                results[tn] = []
-                self.actual_tables.append(tn)
+    def process_config(self, infile=None):
 
-            results[tn].append((processed_statement, line_list.pop(0)))
+        '''
+        Return a dictionary.
+        key = table name
 
-            console.write(tn, self.current_line_num,
-                          count, len(line_list), start_time)
+        value = tuple. index 0: list of sublists. Each sublist is the
+                                (column-name,value) of each affected row
+                                (insert, delete, update)
+
+                       index 1: line number of statement in configuration.sql
+        '''
+
+        results = None
+        if self.capture_mode == 'flashback':
+            results = self.process_config_flashback(infile)
+        if results is None:
+            results = self.process_config_statement(infile)
 
         print '\nExecuting rollback'
         sys.stdout.flush()
-        self.cursor.execute("rollback")
+        with self.timings.phase('rollback'):
+            self.cursor.execute("rollback")
         print '\nrollback complete'
         sys.stdout.flush()
 
-        self.db_conn.close()
+        with self.timings.phase('foreign_keys'):
+            self.foreign_key_pairs = self.foreign_keys(self.actual_tables)
+
+        if self.own_conn:
+            self.db_conn.close()
 
         print '\nstatement list created'
         sys.stdout.flush()
 
         return results
 
+    def foreign_keys(self, tables):
+        '''
+        Return (child table, parent table) pairs of the foreign keys
+        between tables and any other table, or None if the dictionary
+        can't be read.
+        With a metadata store the pairs of each table are kept in it
+        and only tables it doesn't know are queried.
+        '''
+        names = sorted(set(table_key(tn).upper() for tn in tables))
+        pairs = []
+        if self.metadata is not None:
+            unknown = []
+            for name in names:
+                known = self.metadata.get(('foreign_keys', name))
+                if known is None:
+                    unknown.append(name)
+                else:
+                    pairs.extend(known)
+            names = unknown
+        try:
+            for n in range(0, len(names), 500):
+                chunk = names[n:n + 500]
+                binds = ', '.join(':{}'.format(k + 1)
+                                  for k in range(len(chunk)))
+                self.cursor.execute(
+                    "select lower(c.table_name), lower(p.table_name) "
+                    "from all_constraints c join all_constraints p "
+                    "on p.owner = c.r_owner "
+                    "and p.constraint_name = c.r_constraint_name "
+                    "where c.constraint_type = 'R' "
+                    "and (c.table_name in ({0}) "
+                    "or p.table_name in ({0}))".format(binds), chunk)
+                found = [tuple(row) for row in self.cursor.fetchall()]
+                pairs.extend(found)
+                if self.metadata is not None:
+                    for name in chunk:
+                        self.metadata.put(('foreign_keys', name), [
+                            p for p in found
+                            if name in (p[0].upper(), p[1].upper())])
+        except cx_Oracle.DatabaseError:
+            return None
+        return sorted(set(pairs))
+
+    def resume_from(self, path):
+        '''
+        Replay the statements of the dml script matching a prefix of the
+        ones captured in capture file path, instead of capturing them.
+        Only when the tables are as they were before that capture.
+        Return what is reused, or why nothing can be.
+        '''
+        reader = CaptureReader(path)
+        fingerprints = reader.index.get('fingerprints')
+        stored = reader.index.get('table_fingerprint')
+        if not fingerprints:
+            reason = 'it has no statement fingerprints'
+        elif not stored:
+            reason = 'it has no table fingerprint (a run without -cache)'
+        else:
+            with self.timings.phase('resume.fingerprint'):
+                current = self.fingerprint([t[0] for t in stored])
+            if current is None or \
+                    json.loads(json.dumps(current, default=str)) != stored:
+                reason = 'its tables changed since'
+            else:
+                self.resume = reader
+                return 'resuming from {}: {} statements fingerprinted'.format(
+                    path, len(fingerprints))
+        reader.close()
+        return 'not resuming from {}: {}, capturing every statement'.format(
+            path, reason)
+
+    def process_config_statement(self, infile=None):
+        '''
+        capture each statement's rows with a select around the statement.
+        Resuming, the statements matching the earlier capture up to the
+        first one that doesn't are replayed (see replay) instead.
+        '''
+        process = {'insert': self.process_insert,
+                   'update': self.process_update,
+                   'delete': self.process_delete}
+        results = {}
+        console = ConsoleOut(self.progress_ms, self.progress_log_s,
+                             label=self.progress_label)
+        fingerprints = self.resume.index['fingerprints'] if self.resume \
+            else []
+        prefix = []
+
+        for kind, g, tn, line_num in self.iter_statements(infile):
+            self.current_line_num = line_num
+            self.statement_index += 1
+
+            if fingerprints is not None:
+                n = self.statement_index - 1
+                if n < len(fingerprints) and fingerprints[n][1] == \
+                        self.statement_fingerprints[-1][1]:
+                    prefix.append((self.statement_index, kind, g, tn,
+                                   line_num, fingerprints[n][0]))
+                    continue
+                fingerprints = None
+                self.replay(prefix, results, console)
+
+            capture_start = clock()
+            processed_statement = process[kind](g, tn)
+
+            if processed_statement is None:
+                rows = 0
+            elif kind == 'insert':
+                rows = 1
+            else:
+                rows = len(processed_statement)
+            self.timings.record_capture(kind, tn, clock() - capture_start,
+                                        rows)
+
+            if tn not in results:
+                results[tn] = []
+                self.actual_tables.append(tn)
+
+            results[tn].append((processed_statement, line_num))
+
+            console.write(tn, line_num,
+                          len(self.line_list) - self.statement_index, rows)
+
+        if fingerprints is not None:
+            self.replay(prefix, results, console)
+        console.finish()
+        return results
+
+    def replay(self, statements, results, console):
+        '''
+        Run statements, (index, kind, statement, table, line, line in the
+        resumed capture) of an unchanged prefix of the script, in order.
+        Deletes run up to REPLAY_BATCH in one PL/SQL block and take their
+        rows from the resumed capture, updates only have their rows
+        selected by a statement capture so they take them from it
+        without running. Inserts are captured again: sequence, sysdate
+        and default values differ from the ones of the earlier run.
+        '''
+        if not statements:
+            return
+        start = clock()
+        current = self.statement_index, self.current_line_num
+        tables = self.resume.index['tables']
+        batch = []
+        size = 0
+        replayed = 0
+        for index, kind, g, tn, line_num, old in statements:
+            if kind == 'insert' or len(batch) == REPLAY_BATCH or \
+                    size + len(g) > REPLAY_BLOCK_CHARS:
+                self.replay_batch(batch)
+                batch = []
+                size = 0
+            if kind == 'insert':
+                self.statement_index = index
+                self.current_line_num = line_num
+                capture_start = clock()
+                processed_statement = self.process_insert(g, tn)
+                rows = 0 if processed_statement is None else 1
+                self.timings.record_capture(kind, tn,
+                                            clock() - capture_start, rows)
+            else:
+                if kind == 'delete':
+                    batch.append((index, g, line_num))
+                    size += len(g)
+                try:
+                    kind, old_tn, sql, images = self.resume.statement(old)
+                except KeyError:
+                    # nothing was captured for it
+                    continue
+                add_statement(self, line_num, kind, tn, sql, images)
+                if tn not in self.column_types and old_tn in tables:
+                    self.column_dict[tn] = tuple(
+                        native(col) for col in tables[old_tn]['columns'])
+                    self.column_types[tn] = dict(
+                        (native(col), native(k))
+                        for col, k in tables[old_tn]['types'].items())
+                processed_statement = images['post' if kind == 'update'
+                                             else 'rows']
+                rows = len(processed_statement)
+                replayed += 1
+            if tn not in results:
+                results[tn] = []
+                self.actual_tables.append(tn)
+            results[tn].append((processed_statement, line_num))
+            console.write(tn, line_num, len(self.line_list) - index, rows)
+        self.replay_batch(batch)
+        self.statement_index, self.current_line_num = current
+        self.replayed += replayed
+        self.timings.add('replay', clock() - start, replayed)
+
+    def replay_batch(self, batch):
+        '''
+        run the (index, statement, line) of a replay in one PL/SQL block
+        '''
+        if not batch:
+            return
+        start = clock()
+        try:
+            self.cursor.execute('begin\n{}\nend;'.format(
+                '\n'.join(g for index, g, line_num in batch)))
+        except cx_Oracle.DatabaseError:
+            # the block is rolled back as a whole, one at a time
+            # finds the failing statement
+            for index, g, line_num in batch:
+                self.statement_index = index
+                self.current_line_num = line_num
+                try:
+                    self.cursor.execute(g.rstrip(';'))
+                except cx_Oracle.DatabaseError as e:
+                    self.log_error('database', g, e)
+        self.timings.add('replay.execute', clock() - start, len(batch))
+
+    def process_config_flashback(self, infile=None):
+        '''
+        Run the whole script with no per statement capture, then derive
+        the rows of each table with one AS OF SCN query per table.
+
+        Only possible when the statements on a table don't see each
+        other's changes. Returns None, with everything rolled back, when
+        the script can't be captured this way.
+        '''
+        statements = list(self.iter_statements(infile))
+        graph = self.graph
+        if graph is None:
+            with self.timings.phase('analysis'):
+                graph = DependencyGraph(statements)
+        conflicts = graph.conflicting_tables()
+        if conflicts:
+            print ('\nflashback capture not possible for {}, '
+                   'using statement capture'.format(', '.join(conflicts)))
+            self.reset_capture()
+            return None
+
+        try:
+            self.cursor.execute(
+                'select dbms_flashback.get_system_change_number from dual')
+            scn = self.cursor.fetchall()[0][0]
+        except cx_Oracle.DatabaseError as e:
+            print ('\nflashback capture not possible ({}), '
+                   'using statement capture'.format(str(e).strip()))
+            self.reset_capture()
+            return None
+
+        console = ConsoleOut(self.progress_ms, self.progress_log_s,
+                             label=self.progress_label)
+        rowids = {}
+        for index, (kind, g, tn, line_num) in enumerate(statements, 1):
+            self.current_line_num = line_num
+            self.statement_index = index
+            statement = g.rstrip(';')
+            capture_start = clock()
+            try:
+                if kind == 'insert':
+                    var = self.cursor.var(cx_Oracle.ROWID)
+                    self.cursor.execute(
+                        statement + ' returning rowid INTO :v ', v=var)
+                    rowid = var.getvalue()
+                    if isinstance(rowid, list):
+                        rowid = rowid[0]
+                    rowids[index] = rowid
+                else:
+                    self.cursor.execute(statement)
+                rows = self.cursor.rowcount
+            except cx_Oracle.DatabaseError as e:
+                self.log_error('database', statement, e)
+                rows = 0
+            self.timings.record_capture(kind, tn, clock() - capture_start,
+                                        rows)
+            console.write(tn, line_num, len(statements) - index, rows)
+        console.finish()
+
+        try:
+            with self.timings.phase('capture.flashback'):
+                images = self.flashback_images(statements, scn, rowids)
+        except cx_Oracle.DatabaseError as e:
+            print ('\nflashback capture not possible ({}), '
+                   'using statement capture'.format(str(e).strip()))
+            self.cursor.execute("rollback")
+            self.reset_capture()
+            return None
+        if images is None:
+            print ('\nrows changed by more than one statement, '
+                   'using statement capture')
+            self.cursor.execute("rollback")
+            self.reset_capture()
+            return None
+
+        results = {}
+        for index, (kind, g, tn, line_num) in enumerate(statements, 1):
+            if index not in images:
+                continue
+            cols, rows = images[index]
+            self.column_dict[tn] = cols
+            statement = g.rstrip(';')
+            if kind == 'insert':
+                processed_statement = zip(cols, rows[0])
+                self.insert_statements.append(statement)
+                self.inserts.append(processed_statement)
+                self.insert_line_nums.append(line_num)
+                self.insert_tables.append(tn)
+            elif kind == 'delete':
+                processed_statement = [zip(cols, v) for v in rows]
+                self.delete_statements.append(g)
+                self.deletes.append(processed_statement)
+                self.delete_line_nums.append(line_num)
+                self.delete_tables.append(tn)
+            else:
+                pre_update_values = [[list(z) for z in zip(cols, v)]
+                                     for v in rows]
+                self.updates.append(statement)
+                self.pre_update.append(pre_update_values)
+                processed_statement = self.post_update_values(
+                    pre_update_values, self.update_set_values(statement), tn)
+                self.post_update.append(processed_statement)
+                self.update_line_nums.append(line_num)
+                self.update_tables.append(tn)
+
+            if tn not in results:
+                results[tn] = []
+                self.actual_tables.append(tn)
+            results[tn].append((processed_statement, line_num))
+        return results
+
+    def flashback_images(self, statements, scn, rowids):
+        '''
+        Return {statement index: (column names, rows)}.
+        Inserted rows are read back by rowid, updated and deleted rows
+        as they were at scn, one query per table and alias the
+        statements give it (per FLASHBACK_CHUNK statements on very busy
+        tables).
+        Return None if a row was changed by more than one statement.
+        '''
+        by_table = {}
+        for index, (kind, g, tn, line_num) in enumerate(statements, 1):
+            by_table.setdefault(tn, []).append((index, kind, g))
+
+        images = {}
+        for tn, table_statements in by_table.items():
+            inserted = [(i, rowids[i]) for i, kind, g in table_statements
+                        if kind == 'insert' and i in rowids]
+            by_alias = {}
+            for i, kind, g in table_statements:
+                if kind != 'insert':
+                    by_alias.setdefault(table_alias(g) or FLASHBACK_ALIAS,
+                                        []).append((i, g))
+
+            for n in range(0, len(inserted), FLASHBACK_CHUNK):
+                chunk = inserted[n:n + FLASHBACK_CHUNK]
+                binds = ', '.join(':{}'.format(k + 1)
+                                  for k in range(len(chunk)))
+                self.cursor.execute(
+                    'select rowidtochar({a}.rowid), {a}.* from {} {a} '
+                    'where {a}.rowid in ({})'.format(
+                        tn, binds, a=FLASHBACK_ALIAS),
+                    [rowid for i, rowid in chunk])
+                cols = self.remember_columns(
+                    tn, self.cursor.description[1:])
+                found = dict((row[0], row[1:])
+                             for row in self.fetch_rows(tn, 1))
+                for i, rowid in chunk:
+                    if rowid in found:
+                        images[i] = (cols, [found[rowid]])
+
+            seen = set()
+            chunks = [(alias, changed[n:n + FLASHBACK_CHUNK])
+                      for alias, changed in sorted(by_alias.items())
+                      for n in range(0, len(changed), FLASHBACK_CHUNK)]
+            for alias, chunk in chunks:
+                preds = [where_clause(g) for i, g in chunk]
+                flags = ', '.join(
+                    'case when {} then 1 else 0 end'.format(p)
+                    for p in preds)
+                self.cursor.execute(
+                    'select rowidtochar({a}.rowid), {}, {a}.* '
+                    'from {} as of scn :scn {a} where {}'.format(
+                        flags, tn, ' or '.join(
+                            '({})'.format(p) for p in preds), a=alias),
+                    scn=scn)
+                width = len(chunk) + 1
+                cols = self.remember_columns(
+                    tn, self.cursor.description[width:])
+                for i, g in chunk:
+                    images[i] = (cols, [])
+                for row in self.fetch_rows(tn, width):
+                    hits = [chunk[k][0] for k, flag
+                            in enumerate(row[1:width]) if flag]
+                    if len(hits) > 1 or row[0] in seen:
+                        return None
+                    seen.add(row[0])
+                    images[hits[0]][1].append(row[width:])
+        return images
+
     def process_insert(self, statement, tn):
         '''
         return list of columns and values of statement
@@ -239,10 +921,8 @@ class ConfigDict:
             query = "select * from {table_n} where rowid =: v".format(
                 table_n=tn)
             self.cursor.execute(query, v=var)
-            values = self.cursor.fetchall()[0]
-            column_names = tuple(i[0].lower()
-                                 for i in self.cursor.description)
-            self.column_dict[tn] = column_names
+            column_names = self.remember_columns(tn, self.cursor.description)
+            values = self.fetch_rows(tn)[0]
             z = zip(column_names, values)
             self.inserts.append(z)
             self.insert_line_nums.append(self.current_line_num)
@@ -251,16 +931,10 @@ class ConfigDict:
             return z
 
         except cx_Oracle.DatabaseError as e:
-            with open(self.cx_Oracle_logfile, 'a') as f:
-                f.write('''Database exception: {} Line number:
-                          {}\nSQL: {}\n\n'''.format(
-                              str(e).strip(), str(
-                                  self.current_line_num), query))
-        except:
+            self.log_error('database', query, e)
+        except Exception as e:
             print 'unknown exception'
-            with open(self.cx_Oracle_logfile, 'a') as f:
-                f.write('Unknown exception. Line number: {}\n'.format(
-                    str(self.current_line_num)))
+            self.log_error('unknown', query, e)
             raise
 
     def process_delete(self, delete_statement, tn):
@@ -281,33 +955,25 @@ class ConfigDict:
 
         try:
             select_statement = select_statement.rstrip(';')
+            query = select_statement
             self.cursor.execute(select_statement)
-            values = self.cursor.fetchall()
-            column_names = tuple([i[0].lower()
-                                  for i in self.cursor.description])
-            self.column_dict[tn] = column_names
-
-            z = [zip(column_names, v) for v in values]
+            column_names = self.remember_columns(tn, self.cursor.description)
+            z = self.fetch_rows(
+                tn, image=lambda row: zip(column_names, row))
             self.deletes.append(z)
             self.delete_line_nums.append(self.current_line_num)
             self.delete_tables.append(tn)
             '''Execute delete statement'''
             delete_statement = delete_statement.rstrip(';')
+            query = delete_statement
             self.cursor.execute(delete_statement)
-            print z
             return z
 
         except cx_Oracle.DatabaseError as e:
-            with open(self.cx_Oracle_logfile, 'a') as f:
-                f.write(
-                    'Database exception: {} Line number: {}\n'.format(
-                        str(e).strip(), str(self.current_line_num)))
-        except:
+            self.log_error('database', query, e)
+        except Exception as e:
             print 'unknown exception'
-            with open(self.cx_Oracle_logfile, 'a') as f:
-                f.write(
-                    'Unknown exception. Line number: {}\n'.format(
-                        str(self.current_line_num)))
+            self.log_error('unknown', query, e)
             raise
 
     def process_update(self, update, tn):
@@ -324,17 +990,15 @@ class ConfigDict:
         if where:
             update_where_index = int(update.index(where.group()))
         else:
-            print "\n\n'where' statement not found in {}\n".format(update)
             self.cursor.execute("rollback")
-            print "\nexiting"
-            exit()
+            raise CaptureError(
+                "'where' statement not found in {}".format(update))
         if set_:
             update_set_index = int(update.index(set_.group()))
         else:
-            print "\n\n'set' statement not found in: {}\n".format(update)
-            print "\nexiting"
             self.cursor.execute("rollback")
-            exit()
+            raise CaptureError(
+                "'set' statement not found in: {}".format(update))
 
         '''
         select_pre. Select statement to get the rows that would be updated
@@ -351,114 +1015,652 @@ class ConfigDict:
             Execute select_pre and return a
             list of rows as a col val dictionary
             '''
+            query = select_pre
             self.cursor.execute(select_pre)
-            result = self.cursor.fetchall()
-            cols = [i[0].lower() for i in self.cursor.description]
-            vals = [list(v) for v in result]
-            pre_update_values = [zip(cols, v) for v in vals]
-            self.pre_update.append([[list(z) for z in l]
-                                    for l in pre_update_values])
+            cols = self.remember_columns(tn, self.cursor.description)
+            pre_update_values = self.fetch_rows(
+                tn, image=lambda row: [[c, v] for c, v in zip(cols, row)])
+            self.pre_update.append(pre_update_values)
 
             ''' set_values. The updated columns and their values. '''
-            update_values_list = update[
-                update_set_index + 4:update_where_index]
-
-            value_pattern = re.compile("\'(.*?)\'")
-            value_list = value_pattern.findall(update_values_list)
-
-            column_pattern = re.compile("(\w+)\s*=")
-            column_list = column_pattern.findall(update_values_list)
+            set_values = self.update_set_values(
+                update, update_set_index, update_where_index)
 
-            set_values = dict(zip(column_list, value_list))
-
-            '''
-            update self.pre_update_dict with set_values
-            to form post_update selects
-            '''
-            post_up_vals = []
-            for pre_d in pre_update_values:
-                post_d = list(pre_d)
-                for col, val in set_values.items():
-                    for ind, value in enumerate(post_d):
-                        post_d[ind] = list(value)
-                        if col.lower() in value:
-                            val = [col, val]
-                            post_d[ind] = val
-                post_up_vals.append(post_d)
+            post_up_vals = self.post_update_values(pre_update_values,
+                                                   set_values, tn)
             self.post_update.append(post_up_vals)
             self.update_line_nums.append(self.current_line_num)
             self.update_tables.append(tn)
             return post_up_vals
         except cx_Oracle.DatabaseError as e:
-            with open(self.cx_Oracle_logfile, 'a') as f:
-                f.write(
-                    'Database exception: {} Line number: {}\n'.format(
-                        str(e).strip(), str(self.current_line_num)))
-        except:
+            self.log_error('database', query, e)
+        except Exception as e:
             print 'unknown exception'
-            with open(self.cx_Oracle_logfile, 'a') as f:
-                f.write('Unknown exception. Line number: {}\n'.format(
-                    str(self.current_line_num)))
+            self.log_error('unknown', query, e)
             raise
 
+    def remember_columns(self, tn, description):
+        '''
+        return the lower case column names of a cursor description,
+        cache them and their kinds (see column_kind) for table tn
+        '''
+        names = tuple(c[0].lower() for c in description)
+        self.column_dict[tn] = names
+        if tn not in self.column_types:
+            self.column_types[tn] = dict(
+                (c[0].lower(), column_kind(c[1])) for c in description)
+        return names
+
+    def fetch_rows(self, tn, start=0, image=None):
+        '''
+        Return the rows of the current query on tn, fetched arraysize
+        rows per round trip, each turned into image(row) as its batch
+        arrives, so no intermediate list of all rows is built.
+        LOB columns, from column start on, are spilled to side files
+        while their batch is current and come back as LobRefs.
+        '''
+        kinds = self.column_types.get(tn, {})
+        lob_cols = [(k, kinds[c[0].lower()])
+                    for k, c in enumerate(self.cursor.description)
+                    if k >= start and kinds.get(c[0].lower()) in LOB_KINDS]
+        rows = []
+        fetched = 0
+        while True:
+            batch = self.cursor.fetchmany()
+            if not batch:
+                break
+            fetched += len(batch)
+            if lob_cols:
+                batch = [list(row) for row in batch]
+                for row in batch:
+                    for k, kind in lob_cols:
+                        if row[k] is not None:
+                            row[k] = self.lobs.spill(row[k], kind)
+            if image is None:
+                rows.extend(batch)
+            else:
+                rows.extend(image(row) for row in batch)
+        self.rows_fetched += fetched
+        return rows
 
-class ConsoleOut:
-    def __init__(self):
+    def update_set_values(self, update, set_index=None, where_index=None):
+        '''
+        return {column: value} of the set clause of update
+        '''
+        if set_index is None:
+            set_index = update.index(
+                re.search('set(\n|\s+)', update, re.I).group())
+        if where_index is None:
+            where_index = update.index(
+                re.search('where(\s+)', update, re.I).group())
+        update_values_list = update[set_index + 4:where_index]
 
-        self.o = sys.stdout
-        self.current_table = 'None'
-        self.statement_count = 0
-        self.time_taken = 0
+        value_list = SET_VALUE.findall(update_values_list)
+        column_list = SET_COLUMN.findall(update_values_list)
 
-        self.template = "{:<40} | {:<17} | {:<14} | {:<16} | {:<11} | {:<11}"
+        return dict(zip(column_list, value_list))
 
-        self.o.write(
-            self.template.format('Table',
-                                 'Statement count',
-                                 'Current line',
-                                 'Statement total',
-                                 'Remaining',
-                                 'Time taken'))
+    def column_positions(self, tn):
+        '''
+        {column: index} of the columns of tn in its captured rows, kept
+        per table while its columns stay the same
+        '''
+        cols = self.column_dict[tn]
+        known = self.column_index.get(tn)
+        if known is None or known[0] != cols:
+            known = self.column_index[tn] = (
+                cols, dict((c, i) for i, c in enumerate(cols)))
+        return known[1]
+
+    def post_update_values(self, pre_update_values, set_values, tn):
+        '''
+        the pre update rows of tn with the set_values columns replaced,
+        to form post_update selects. A post update row shares the
+        unchanged [column, value] pairs of its pre update row, each set
+        column is then replaced in every row at its position.
+        '''
+        positions = self.column_positions(tn)
+        changes = [(positions[col.lower()], col, val)
+                   for col, val in set_values.items()
+                   if col.lower() in positions]
+        post_up_vals = map(list, pre_update_values)
+        for ind, col, val in changes:
+            for post_d in post_up_vals:
+                post_d[ind] = [col, val]
+        return post_up_vals
+
+    def log_error(self, kind, sql, exc):
+        '''
+        record a failed statement in the run's error journal
+        '''
+        self.journal.error(kind,
+                           line=self.current_line_num,
+                           statement=self.statement_index,
+                           sql=sql,
+                           exc=exc)
+
+
+# unchanged statements replayed per PL/SQL block when resuming a
+# capture, and the most statement text in one block
+REPLAY_BATCH = 100
+REPLAY_BLOCK_CHARS = 32000
+
+# statements per AS OF SCN query, keeps the select list and
+# in-list well below Oracle's 1000 item limits
+FLASHBACK_CHUNK = 200
+
+# the table alias of AS OF SCN and rowid queries for statements that
+# give their table none
+FLASHBACK_ALIAS = 'sysimp_t'
+
+# the alias after the table of an update or delete
+TABLE_ALIAS = re.compile(
+    r'\s*(?:update|delete(?:\s+[*])?(?:\s+from)?)\s+(?!from\s)[^\s*]+\s+'
+    r'(?!(?:from|set|where|returning|log)(?![\w$#]))([a-z_][\w$#]*)', re.I)
+
+# row tuples per IN-list in a set validation query, Oracle's limit
+VALIDATION_IN_CHUNK = 1000
+
+# staged rows per -validation gtt query
+GTT_STAGE_ROWS = 500
+# characters of a column list line in a -validation gtt query
+COLUMN_LINE_CHARS = 200
+
+# sqlplus settings so a set validation prints one line per statement
+SET_VALIDATION_HEADER = '''set heading off
+set feedback off
+set pagesize 0
+set linesize 400
+set define off
 
-    def write(self, table, current_line,
-              total, remaining, start_time):
-        if sys.platform == 'linux2':
-            time_delta = time.time() - start_time
+'''
+
+# rows per PL/SQL block in a -binds backout, keeps each block well
+# below the PL/SQL program size limit
+BIND_CHUNK = 500
+
+# characters of a string value per line of a -binds collection: quotes
+# doubled, a line stays below SQL*Plus' 2499 character limit
+BIND_LINE_CHARS = 1000
+
+# PL/SQL collection type name and element type per column kind
+COLLECTIONS = {
+    'number': ('nums', 'number'),
+    'date': ('dates', 'date'),
+    'timestamp': ('stamps', 'timestamp'),
+    'clob': ('clobs', 'clob'),
+    'nclob': ('nclobs', 'nclob'),
+    'blob': ('blobs', 'blob'),
+    'string': ('vals', 'varchar2(4000)')}
+
+
+# fixed masks, so literals never depend on the session's NLS settings
+DATE_MASK = 'YYYY-MM-DD HH24:MI:SS'
+TIMESTAMP_MASK = 'YYYY-MM-DD HH24:MI:SS.FF6'
+NUMERIC = re.compile(r'\s*[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?\s*$')
+
+# SQL*Loader data file separators, values containing them are inserted
+BULK_FIELD = '\x1f'
+BULK_RECORD = '\x1e\n'
+# data files are UTF-8: unicode values encoded, str values (client
+# character set) that aren't valid UTF-8 are inserted
+BULK_ENCODING = 'utf-8'
+
+# SQL*Loader field types per column kind, masks as in sql_literal
+LOADER_TYPES = {
+    'number': 'DECIMAL EXTERNAL',
+    'date': 'DATE "{}"'.format(DATE_MASK),
+    'timestamp': 'TIMESTAMP "{}"'.format(TIMESTAMP_MASK),
+    'clob': 'CHAR(32767)',
+    'nclob': 'CHAR(32767)',
+    'blob': 'CHAR(32767)',
+    'string': 'CHAR(4000)'}
+
+BULK_HEADER = '''-- backout with SQL*Loader direct path loads for large row groups
+-- the script commits before every load: run it to back out the
+-- deployed change, never inside a dml / backout / dml verification
+-- every load prompts for the SQL*Loader username and password, so
+-- they never appear on a command line
+set define off
+
+'''
+
+# artifacts generate writes, as named in the result cache
+SINKS = ('rollback.sql', 'validation.sql', 'capture.sysimp',
+         'rollback_plan', 'rollback_bulk')
+
+# checked in order: cx_Oracle.DATETIME also matches timestamp columns
+# in newer versions of cx_Oracle
+COLUMN_KINDS = [
+    ('timestamp', ('TIMESTAMP',)),
+    ('date', ('DATETIME',)),
+    ('number', ('NUMBER', 'NATIVE_FLOAT', 'NATIVE_INT')),
+    ('nclob', ('NCLOB',)),
+    ('clob', ('CLOB',)),
+    ('blob', ('BLOB',))]
+
+
+def column_kind(type_code):
+    '''
+    'number', 'date', 'timestamp', 'clob', 'nclob', 'blob' or 'string'
+    for a description type
+    '''
+    for kind, names in COLUMN_KINDS:
+        for name in names:
+            if hasattr(cx_Oracle, name) and \
+                    type_code == getattr(cx_Oracle, name):
+                return kind
+    return 'string'
+
+
+def value_kind(val):
+    '''
+    the kind of a fetched value, None when it doesn't tell
+    '''
+    if isinstance(val, datetime.datetime):
+        return 'timestamp' if val.microsecond else 'date'
+    if isinstance(val, datetime.date):
+        return 'date'
+    if isinstance(val, (int, long, float, decimal.Decimal)):
+        return 'number'
+    return None
+
+
+def sql_literal(val, kind=None):
+    '''
+    Render val as an Oracle literal for a column of kind (column_kind).
+    Numbers unquoted, dates and timestamps through TO_DATE/TO_TIMESTAMP
+    with explicit masks, strings quoted with embedded quotes doubled.
+    Values parsed from the script (update set values) are strings: they
+    are left unquoted for number columns when they read as a number.
+    '''
+    if val is None:
+        return 'NULL'
+    if isinstance(val, LobRef):
+        return val.empty()
+    if isinstance(val, datetime.date):
+        text = '{:04d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}'.format(
+            val.year, val.month, val.day, getattr(val, 'hour', 0),
+            getattr(val, 'minute', 0), getattr(val, 'second', 0))
+        microsecond = getattr(val, 'microsecond', 0)
+        if kind == 'timestamp' or microsecond:
+            return "TO_TIMESTAMP('{}.{:06d}', '{}')".format(
+                text, microsecond, TIMESTAMP_MASK)
+        return "TO_DATE('{}', '{}')".format(text, DATE_MASK)
+    if isinstance(val, float):
+        return repr(val)
+    if isinstance(val, (int, long, decimal.Decimal)):
+        return str(val)
+    text = val if isinstance(val, basestring) else str(val)
+    if kind == 'number' and NUMERIC.match(text):
+        return text.strip()
+    return "'" + text.replace("'", "''") + "'"
+
+
+def has_lobs(row):
+    return any(isinstance(val, LobRef) for col, val in row)
+
+
+def without_lobs(row, kinds):
+    '''
+    row without its LOB columns, which can't be compared with =
+    '''
+    return [(col, val) for col, val in row
+            if not isinstance(val, LobRef) and kinds.get(col) not in LOB_KINDS]
+
+
+def join_pieces(pieces, sep=''):
+    '''
+    join pieces with sep, merging neighbouring text into one string
+    '''
+    out = []
+    text = []
+    for n, piece in enumerate(pieces):
+        if n:
+            text.append(sep)
+        if isinstance(piece, basestring):
+            text.append(piece)
         else:
-            time_delta = time.clock() - start_time
-        self.time_taken += time_delta
-
-        def out(statement_count):
-            return self.template.format(
-                table,
-                statement_count,
-                current_line,
-                total,
-                remaining,
-                self.time_taken)
-
-        if table == self.current_table:
-            self.statement_count += 1
-
-            if sys.platform == 'linux2':
-                pass
-            else:
-                self.o.write('\r' + out(self.statement_count))
+            out.append(''.join(text))
+            out.append(piece)
+            text = []
+    out.append(''.join(text))
+    return [piece for piece in out if piece]
+
 
+def write_pieces(f, pieces):
+    '''
+    write text pieces, writer pieces (LOB inserts) stream themselves
+    '''
+    for piece in pieces:
+        if isinstance(piece, basestring):
+            f.write(piece)
         else:
-            self.time_taken = 0
-            self.statement_count = 1
-            self.o.write('\n' + out(self.statement_count))
+            piece(f)
+
+
+def rows_predicate(rows, kinds):
+    '''
+    Predicate matching any of rows (lists of (column, value)): rows
+    are grouped by their NULL columns, each group is a multi column
+    IN-list of VALIDATION_IN_CHUNK tuples at most plus 'is NULL' terms.
+    LOB columns are left out.
+    '''
+    groups = []
+    values = {}
+    for row in rows:
+        row = without_lobs(row, kinds)
+        mask = tuple((col, val is None) for col, val in row)
+        if mask not in values:
+            groups.append(mask)
+            values[mask] = []
+        values[mask].append('(' + ', '.join(
+            sql_literal(val, kinds.get(col))
+            for col, val in row if val is not None) + ')')
+
+    terms = []
+    for mask in groups:
+        cols = [col for col, null in mask if not null]
+        nulls = ['{} is NULL'.format(col) for col, null in mask if null]
+        tuples = values[mask]
+        for start in range(0, len(tuples), VALIDATION_IN_CHUNK):
+            parts = list(nulls)
+            if cols:
+                parts.insert(0, '({}) in (\n        {})'.format(
+                    ', '.join(cols), ',\n        '.join(
+                        tuples[start:start + VALIDATION_IN_CHUNK])))
+            terms.append('(' + '\n    and '.join(parts or ['1 = 1']) + ')')
+    return '\n   or '.join(terms) or '1 = 0'
+
+
+def bind_kinds(cols, bound, data, known):
+    '''
+    {k: kind} for the bound columns k of data rows: the column's kind
+    when known, else the kind of its first value, else 'string'
+    '''
+    kinds = {}
+    for k in bound:
+        kinds[k] = known.get(cols[k]) or next(
+            (value_kind(r[k]) for r in data if r[k] is not None),
+            None) or 'string'
+    return kinds
 
-        self.current_table = table
-        self.o.flush()
+
+def bind_literal(val, kind):
+    '''
+    sql_literal of val, a long string as a concatenation of literals of
+    BIND_LINE_CHARS characters, one per line
+    '''
+    if kind != 'string' or not isinstance(val, basestring) or \
+            len(val) <= BIND_LINE_CHARS:
+        return sql_literal(val, kind)
+    return ' ||\n        '.join(
+        sql_literal(val[start:start + BIND_LINE_CHARS], kind)
+        for start in range(0, len(val), BIND_LINE_CHARS))
+
+
+def forall_blocks(sql, bound, kinds, data, chunk_rows=BIND_CHUNK):
+    '''
+    PL/SQL blocks running sql for each row of data, chunk_rows rows per
+    block. Values of column bound[n] are in collection c<n + 1>, typed
+    by kinds, and sql refers to them as c1(i), c2(i), ...
+    The collections have one value per line, SQL*Plus rejects lines of
+    more than 2499 characters.
+    '''
+    types = ''.join(
+        '    type {} is table of {};\n'.format(*COLLECTIONS[kind])
+        for kind in sorted(set(kinds.values())))
+    blocks = []
+    for start in range(0, len(data), chunk_rows):
+        chunk = data[start:start + chunk_rows]
+        declare = ''.join(
+            '    c{0} {1} := {1}(\n        {2});\n'.format(
+                n + 1, COLLECTIONS[kinds[k]][0], ',\n        '.join(
+                    bind_literal(r[k], kinds[k]) for r in chunk))
+            for n, k in enumerate(bound))
+        blocks.append(
+            'declare\n'
+            + types + declare +
+            'begin\n'
+            '    forall i in 1 .. {}\n'
+            '        {};\n'
+            'end;\n'
+            '/'.format(len(chunk), sql))
+    return blocks
+
+
+def bulk_field(val, kind=None):
+    '''
+    a value for a column of kind as written to a SQL*Loader data file,
+    see LOADER_TYPES
+    '''
+    if val is None:
+        return ''
+    if isinstance(val, unicode):
+        return val.encode(BULK_ENCODING)
+    if isinstance(val, str):
+        return val
+    literal = sql_literal(val, kind)
+    if isinstance(val, datetime.date):
+        # TO_DATE('<text>', '<mask>')
+        return literal.split("'")[1]
+    return literal
+
+
+def bulk_loadable(val):
+    '''
+    True if val can be written to a SQL*Loader data file: no separator
+    in it, and valid UTF-8 if it's a str
+    '''
+    if isinstance(val, LobRef):
+        return False
+    if not isinstance(val, basestring):
+        return True
+    if BULK_FIELD in val or BULK_RECORD in val:
+        return False
+    if isinstance(val, str):
+        try:
+            val.decode(BULK_ENCODING)
+        except UnicodeDecodeError:
+            return False
+    return True
+
+
+def table_alias(statement):
+    '''
+    the alias an update or delete statement gives its table, or None
+    '''
+    m = TABLE_ALIAS.match(statement)
+    return m.group(1) if m else None
+
+
+def where_clause(statement):
+    '''
+    return the predicate after 'where' in statement, or a predicate
+    matching every row when there is no where clause
+    '''
+    statement = statement.rstrip().rstrip(';')
+    where = re.search(r'\bwhere\s', statement, re.I)
+    if where is None:
+        return '1 = 1'
+    return statement[where.end():].strip()
+
+
+def tool_hash():
+    '''
+    sha256 of this script and the modules it imports from this
+    directory, so a change to any of them is a new tool version
+    '''
+    h = hashlib.sha256()
+    paths = [__file__] + [os.path.join(this_dir, name + '.py')
+                          for name in TOOL_MODULES]
+    for path in paths:
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def report_conflicts(graph, journal, limit=20,
+                     journal_limit=CONFLICT_JOURNAL_LIMIT):
+    '''
+    print the first limit conflicting statement pairs, journal the first
+    journal_limit and the total
+    '''
+    if not graph.conflicts:
+        print 'No conflicting statements found'
+        return
+    print '{} statement pairs may touch the same rows:'.format(
+        len(graph.conflicts))
+    journal.record('conflicts', total=len(graph.conflicts),
+                   journaled=min(len(graph.conflicts), journal_limit))
+    for n, (i, j, reason) in enumerate(graph.conflicts):
+        if n >= max(limit, journal_limit):
+            break
+        first = graph.statements[i - 1]
+        second = graph.statements[j - 1]
+        if n < journal_limit:
+            journal.record('conflict',
+                           statements=[i, j],
+                           lines=[first.line, second.line],
+                           reason=reason)
+        if n < limit:
+            print '    line {} and line {}: {}'.format(
+                first.line, second.line, reason)
+    if len(graph.conflicts) > limit:
+        print '    ... see {}'.format(journal.path)
+
+
+def report_preflight(preflight, path, limit=20):
+    '''
+    print the preflight totals and its first warnings, write the full
+    report to path
+    '''
+    totals = preflight.totals
+    print ('Preflight: {} statements, about {} rows, {:.1f} MB and {:.0f}s '
+           'to capture').format(totals['statements'], totals['rows'],
+                                totals['memory_bytes'] / float(1 << 20),
+                                totals['seconds'])
+    warnings = [e for e in preflight.statements if e.get('warning')]
+    for entry in warnings[:limit]:
+        print '    line {}: {}'.format(entry['line'], entry['warning'])
+    if len(warnings) > limit:
+        print '    ... {} full scans in all'.format(len(warnings))
+    if totals['unknown']:
+        print '    {} statements could not be explained'.format(
+            totals['unknown'])
+    with open(path, 'w') as f:
+        json.dump(preflight.report(), f, indent=2, sort_keys=True,
+                  default=str)
+        f.write('\n')
+    print '    see {}'.format(path)
+
+
+class ConsoleOut:
+
+    '''
+    Rate limited progress line for process_config
+
+    On a terminal the line is redrawn in place with '\r' at most once
+    every interval_ms. When stdout is not a terminal (Jenkins, output
+    piped to a file) a plain log line is written every log_interval_s
+    instead, so CI logs show progress without a line per statement.
+    With a label (a job of serve, watch or fanout, run next to others
+    on the same stdout) the lines are always logged, each prefixed with
+    the label and written whole, never redrawn.
+    '''
+
+    # one line at a time across the threads sharing stdout
+    lock = threading.Lock()
+
+    def __init__(self, interval_ms=250, log_interval_s=10, stream=None,
+                 label=None):
+
+        self.o = stream if stream is not None else sys.stdout
+        self.prefix = '{}: '.format(label) if label else ''
+        self.tty = (not label and hasattr(self.o, 'isatty')
+                    and self.o.isatty())
+        if self.tty:
+            self.interval = interval_ms / 1000.0
+        else:
+            self.interval = float(log_interval_s)
+        self.start = clock()
+        self.last_draw = None
+        self.last_len = 0
+        self.statement_count = 0
+        self.row_count = 0
+        self.status = None
+
+        self.template = ("{:<40} | {:<10} | {:<12} | {:<10} | "
+                         "{:<10} | {:<10} | {:<9}")
+
+        self.put(self.prefix +
+                 self.template.format('Table',
+                                      'Statements',
+                                      'Current line',
+                                      'Remaining',
+                                      'Stmts/sec',
+                                      'Rows/sec',
+                                      'ETA') + '\n')
+
+    def write(self, table, current_line, remaining, rows=0):
+        '''
+        count one processed statement, redraw if the interval has passed
+        '''
+        self.statement_count += 1
+        self.row_count += rows
+        self.status = (table, current_line, remaining)
+        now = clock()
+        if self.last_draw is None or now - self.last_draw >= self.interval:
+            self.draw(now)
+
+    def finish(self):
+        if self.status is not None:
+            self.draw(clock())
+        if self.tty:
+            self.put('\n')
+
+    def put(self, text):
+        with self.lock:
+            self.o.write(text)
+            self.o.flush()
+
+    def draw(self, now):
+        table, current_line, remaining = self.status
+        elapsed = now - self.start
+        if elapsed > 0:
+            stmt_rate = self.statement_count / elapsed
+            row_rate = self.row_count / elapsed
+        else:
+            stmt_rate = row_rate = 0.0
+        if stmt_rate > 0:
+            eta = str(datetime.timedelta(seconds=int(remaining / stmt_rate)))
+        else:
+            eta = '-'
+        line = self.template.format(table[:40],
+                                    self.statement_count,
+                                    current_line,
+                                    remaining,
+                                    '{:.1f}'.format(stmt_rate),
+                                    '{:.1f}'.format(row_rate),
+                                    eta)
+        if self.tty:
+            pad = ' ' * max(0, self.last_len - len(line))
+            self.put('\r' + line + pad)
+            self.last_len = len(line)
+        else:
+            self.put(self.prefix + line + '\n')
+        self.last_draw = now
 
 
 class Db:
     CONFIG_OUT = os.path.join(this_dir, 'out.sql')
 
     def __init__(self, dmlpath, backout_path, results, sqlplus_logfile,
-                 db_connection_string,validation_path):
+                 db_connection_string,validation_path, timings=None,
+                 plan_dir=None, binds=False, validation_mode='rows',
+                 bulk_dir=None, bulk_rows=0, bind_chunk=BIND_CHUNK):
+
+        self.timings = timings if timings is not None else Timings()
 
         self.sqlplus_verify_logfile = os.path.join(this_dir, sqlplus_logfile
                                                    + '_verify.log')
@@ -486,6 +1688,12 @@ class Db:
         self.dmlpath = dmlpath
         self.backout_path = backout_path
         self.validation_path = validation_path
+        self.plan_dir = plan_dir
+        self.binds = binds
+        self.validation_mode = validation_mode
+        self.bulk_dir = bulk_dir
+        self.bulk_rows = bulk_rows
+        self.bind_chunk = bind_chunk
 
         self.CONFIG_ARGLIST = [
             'set echo on\n',
@@ -502,7 +1710,7 @@ class Db:
         self.timestamp = 'todo'
 
     def cursor(self):
-        db_conn = cx_Oracle.Connection(self.db_conn_str)
+        db_conn = load_driver().Connection(self.db_conn_str)
         return db_conn.cursor()
 
     def add_rollback(self):
@@ -535,7 +1743,7 @@ class Db:
                 self.sql_error = True
         return s
 
-    def run(self, arglist, logfile):
+    def run(self, arglist, logfile, phase='sqlplus'):
         '''
         Return log string
         Execute sql file, update sql_error status and generate log
@@ -547,14 +1755,16 @@ class Db:
         print border
         print status
         print border + '\n'
-        return self.sqlplus_comm(arglist, logfile)
+        with self.timings.phase(phase):
+            return self.sqlplus_comm(arglist, logfile)
 
     def run_sql(self):
         """
         Execute config_file
         If no errors create backout
         """
-        self.run(self.CONFIG_ARGLIST, self.sqlplus_verify_logfile)
+        self.run(self.CONFIG_ARGLIST, self.sqlplus_verify_logfile,
+                 'sqlplus.verify')
 
         '''If problem with dml: stop'''
         if self.sql_error:
@@ -570,25 +1780,18 @@ class Db:
             '''
             print 'no errors found in configuration.sql'
             print 'creating backout and validation'
-            cd = self.results
-            
-            #Need to create a copy of the dictionary here before backout class masses it up
-            cdv = ShadowCopyOfConfigDict(cd)
-            
-            Backout(self.backout_path, cd).create_backout()
-            print 'backout created'
-            
-            #Passing shadow copy of the ConfigDict
-            ValidationScript(self.validation_path, cdv).create_validation()
-            print 'validation script created'
+            generate_scripts(self.results, self.backout_path,
+                             self.validation_path, self.timings,
+                             self.plan_dir, self.binds, self.validation_mode,
+                             self.bulk_dir, self.bulk_rows, self.bind_chunk)
             '''validate backout'''
             print 'validating backout'
 
             self.run(self.BACKOUT_ARGLIST,
-                     self.sqlplus_backout_logfile)
+                     self.sqlplus_backout_logfile, 'sqlplus.backout')
 
             if self.sql_error:
-                f = os.path.basename(dmlpath)
+                f = os.path.basename(self.dmlpath)
                 s = '{}\n{}\n{}\n{}\n{}\n{}'.format(
                     'Conflict exists in {}'.format(f),
                     '(backout.sql can not successfully revert it',
@@ -611,7 +1814,7 @@ class Db:
         if 'ORA-' in sql:
             s = "Oracle Error in file: {} Line: {}".format(
                 os.path.basename(self.dmlpath),
-                self.results.current_line_num)
+                getattr(self.results, 'current_line_num', None))
             self.errors = True
             self.error_report += s + '\n'
         if '\n0 rows updated' in sql:
@@ -632,10 +1835,19 @@ class Db:
 class ValidationScript():
     """
     Create Validation Script for production verifications
+
+    mode 'rows': one select per inserted and deleted row
+    mode 'set': one aggregate query per insert and delete statement,
+    printing a single PASS/FAIL line
+    mode 'gtt': expected rows staged in the query per table, compared
+    with one set query in each direction
     """
-    def __init__(self, validation_path, configdict):
+    def __init__(self, validation_path, configdict, timings=None,
+                 mode='rows'):
         self.cd = configdict
         self.validation_path = validation_path
+        self.timings = timings if timings is not None else Timings()
+        self.mode = mode
         self.update_deletes = {}
         self.update_inserts = {}
         self.inserts = {}
@@ -646,6 +1858,12 @@ class ValidationScript():
         """
         Turn inserts or updates etc. into select & delete statements
         """
+        if self.mode == 'set':
+            return self.create_set_validation()
+        if self.mode == 'gtt':
+            return self.create_gtt_validation()
+
+        start = clock()
 
         '''
         handle updates
@@ -662,9 +1880,11 @@ class ValidationScript():
 
                 delete_root = 'SELECT * FROM' + ' ' + tab + ' ' + 'WHERE' + ' '
                 self.update_deletes[line_nums[0]] = []
+                kinds = self.cd.column_types.get(tab, {})
                 for row in table:
                     str_ = ' AND '.join(
-                        self.delete_vals(col, val) for col, val in row)
+                        self.delete_vals(col, val, kinds.get(col))
+                        for col, val in without_lobs(row, kinds))
                     self.update_deletes[l].append(delete_root + str_ + ';')
                 line_nums = line_nums[1:]
                 tabs = tabs[1:]
@@ -681,10 +1901,12 @@ class ValidationScript():
                 u = updates[0]
                 insert_root = 'insert into' + ' ' + tab + ' '
                 self.update_inserts[line_nums[0]] = []
+                kinds = self.cd.column_types.get(tab, {})
                 for row in table:
                     cols = '(' + ', '.join(col[0] for col in row) + ')'
                     vals = '(' + ', '.join(
-                        self.insert_vals(val) for row, val in row) + ')'
+                        self.insert_vals(val, kinds.get(col))
+                        for col, val in row) + ')'
                     self.update_inserts[l].append(
                         insert_root
                         + cols
@@ -708,9 +1930,10 @@ class ValidationScript():
                 l = line_nums[0]
                 self.deletes[l] = []
                 t = tables[0]
+                kinds = self.cd.column_types.get(t, {})
                 result = ' and '.join(
-                    self.delete_vals(col, val)
-                    for col, val in table)
+                    self.delete_vals(col, val, kinds.get(col))
+                    for col, val in without_lobs(table, kinds))
                 delete = 'SELECT * FROM {} WHERE {};'.format(
                     t, result)
                 self.deletes[l].append(delete)
@@ -726,22 +1949,23 @@ class ValidationScript():
                 t = tables[0]
                 l = line_nums[0]
                 self.inserts[l] = []
+                kinds = self.cd.column_types.get(t, {})
                 for row in table:
                     t = tables[0]
                     
                     cols = '(' + ', '.join(col[0] for col in row) + ')'
-                    vals = '(' + ', '.join(self.insert_vals(val) for col, val in row) + ')'
+                    vals = '(' + ', '.join(self.insert_vals(val, kinds.get(col)) for col, val in row) + ')'
                     insert = 'insert into {} {} values {};'.format(t, cols, vals)
                 
 
                 
                     select = 'SELECT * FROM {} WHERE '.format(t)
                 
-                    for col, val in row:
+                    for col, val in without_lobs(row, kinds):
                         if val == None:
                             statement = col +' = '+ "'"+""+"'"+" AND "
                         else:
-                            statement = col +' = '+ "'"+val+"'"+" AND "
+                            statement = col +' = '+ sql_literal(val, kinds.get(col))+" AND "
                         
                         select += statement
                     
@@ -754,8 +1978,10 @@ class ValidationScript():
                 tables = tables[1:]
                 line_nums = line_nums[1:]
         deletes()
+        self.timings.add('generate.validation', clock() - start)
 
-        with open(self.validation_path, 'w') as b:
+        with self.timings.phase('io.write_validation'), \
+                open(self.validation_path, 'w') as b:
             
             for line_num in self.cd.line_list: # Core modification
                 if line_num in self.cd.update_line_nums:
@@ -793,13 +2019,184 @@ class ValidationScript():
                 
             b.write(self.delete_trailer_string)
 
-    def delete_vals(self, col, val):
+    def create_set_validation(self):
+        """
+        One query per insert and delete statement counting the captured
+        rows still in the table: every inserted row must be present,
+        every deleted row gone. Statements are checked in script order.
+        """
+        start = clock()
+        checks = {}
+        for l, t, statement, row in zip(self.cd.insert_line_nums,
+                                        self.cd.insert_tables,
+                                        self.cd.insert_statements,
+                                        self.cd.inserts):
+            checks[l] = (t, statement, [row], 'inserted', 1)
+        for l, t, statement, rows in zip(self.cd.delete_line_nums,
+                                         self.cd.delete_tables,
+                                         self.cd.delete_statements,
+                                         self.cd.deletes):
+            checks[l] = (t, statement, rows, 'deleted', 0)
+
+        blocks = [self.set_check(line_num, *checks[line_num])
+                  for line_num in self.cd.line_list if line_num in checks]
+        self.timings.add('generate.validation', clock() - start)
+
+        with self.timings.phase('io.write_validation'), \
+                open(self.validation_path, 'w') as b:
+            b.write(SET_VALIDATION_HEADER)
+            for block in blocks:
+                b.write(block)
+
+    def create_gtt_validation(self):
+        """
+        Stage the expected final image of every inserted and deleted row
+        per table, as literal rows selected from dual in the query, then
+        compare each table once per direction:
+            inserted rows: staged MINUS table, the rows missing
+            deleted rows: staged INTERSECT table, the rows still there
+        The mismatching rows are listed, then one PASS/FAIL line per
+        GTT_STAGE_ROWS rows of a table. Statements apply in script
+        order, so a row inserted and deleted again is expected gone.
+        The script runs queries only: no temporary table DDL, whose
+        implicit commit would commit a deploy validated before its
+        commit.
+        """
+        start = clock()
+        changes = {}
+        for l, t, row in zip(self.cd.insert_line_nums,
+                             self.cd.insert_tables,
+                             self.cd.inserts):
+            changes[l] = (t, [row], 'present')
+        for l, t, rows in zip(self.cd.delete_line_nums,
+                              self.cd.delete_tables,
+                              self.cd.deletes):
+            changes[l] = (t, rows, 'absent')
+
+        tables = []
+        expected = {}
+        for line_num in self.cd.line_list:
+            if line_num not in changes:
+                continue
+            t, rows, state = changes[line_num]
+            key = table_key(t)
+            if key not in expected:
+                tables.append(key)
+                expected[key] = (t, [], {})
+            kinds = self.cd.column_types.get(t, {})
+            order, images = expected[key][1:]
+            for row in rows:
+                image = tuple(without_lobs(row, kinds))
+                if image not in images:
+                    order.append(image)
+                images[image] = state
+
+        blocks = []
+        for key in tables:
+            t, order, images = expected[key]
+            blocks.append(self.gtt_check(
+                t, [(image, images[image]) for image in order]))
+        self.timings.add('generate.validation', clock() - start)
+
+        with self.timings.phase('io.write_validation'), \
+                open(self.validation_path, 'w') as b:
+            b.write(SET_VALIDATION_HEADER)
+            for block in blocks:
+                b.write(block)
+
+    def gtt_check(self, t, staged):
+        '''
+        comparison of one table, staged is [(image, state)]
+        '''
+        cols = [col for col, val in staged[0][0]]
+        present = sum(1 for image, state in staged if state == 'present')
+        header = '-- {}: {} inserted rows expected present, {} deleted ' \
+                 'rows expected gone\n'.format(t, present,
+                                               len(staged) - present)
+        if not cols:
+            return header + '-- only LOB columns, not validated\n\n'
+        # column lists wrapped, a wide table stays below SQL*Plus' line
+        # limit
+        lines = textwrap.wrap(', '.join(cols), COLUMN_LINE_CHARS)
+        columns = '\n        '.join(lines)
+        data = [[dict(image).get(col) for col in cols]
+                for image, state in staged]
+        bound = range(len(cols))
+        kinds = bind_kinds(cols, bound, data,
+                           self.cd.column_types.get(t, {}))
+        checks = [header]
+        for start in range(0, len(staged), GTT_STAGE_ROWS):
+            chunk = zip(staged[start:start + GTT_STAGE_ROWS],
+                        data[start:start + GTT_STAGE_ROWS])
+            parts = []
+            for state, label, op in (('present', 'MISSING', 'minus'),
+                                     ('absent', 'NOT DELETED', 'intersect')):
+                rows = [values for (image, row_state), values in chunk
+                        if row_state == state]
+                if rows:
+                    parts.append(
+                        "    select {columns}, '{label}' sysimp_state "
+                        'from (\n'
+                        '        {rows}\n'
+                        '        {op}\n'
+                        '        select {columns} from {t})'.format(
+                            columns=columns, label=label, op=op, t=t,
+                            rows=self.staged_rows(cols, kinds, rows)))
+            mismatches = '\n    union all\n'.join(parts)
+            checks.append(
+                'prompt {t} mismatches, sysimp_state and\n'
+                '{prompt}\n'
+                'select sysimp_state, {columns} from (\n'
+                '{mismatches});\n'
+                "select case when count(*) = 0 then 'PASS' else 'FAIL' end\n"
+                "    || ' {t}: ' || count(*) || ' of {rows} rows mismatching'"
+                '\nfrom (\n'
+                '{mismatches});\n\n'.format(
+                    t=t, columns=columns, mismatches=mismatches,
+                    rows=len(chunk), prompt='\n'.join(
+                        'prompt     ' + line for line in lines)))
+        return ''.join(checks)
+
+    def staged_rows(self, cols, kinds, rows):
+        '''
+        rows as selects from dual joined by union all, a value per line
+        '''
+        return '\n        union all\n        '.join(
+            'select\n            {}\n        from dual'.format(
+                ',\n            '.join(
+                    '{} {}'.format(bind_literal(val, kinds[k]), cols[k])
+                    for k, val in enumerate(values)))
+            for values in rows)
+
+    def set_check(self, line_num, t, statement, rows, label, each):
+        '''
+        PASS when count(*) of the rows matching rows is each * len(rows)
+        '''
+        expected = each * len(rows)
+        predicate = rows_predicate(rows, self.cd.column_types.get(t, {}))
+        return ("--Line number: {line}\n"
+                "-- {statement}\n"
+                "select case when count(*) = {expected} "
+                "then 'PASS' else 'FAIL' end\n"
+                "    || ' line {line}: ' || count(*) "
+                "|| ' of {rows} {label} rows present, expected {expected}'\n"
+                "from {table}\n"
+                "where {predicate};\n\n").format(
+                    line=line_num,
+                    statement=str(statement).rstrip(';'),
+                    expected=expected,
+                    rows=len(rows),
+                    label=label,
+                    table=t,
+                    predicate=predicate)
+
+    def delete_vals(self, col, val, kind=None):
         return ("{column} is NULL".format(column=col)
-                if val is None else "{column} = '{value}'".format(
-                    column=col, value=val))
+                if val is None else "{column} = {value}".format(
+                    column=col, value=sql_literal(val, kind)))
 
-    def insert_vals(self, val):
-        return "{}".format('NULL') if val is None else "'{}'".format(val)
+    def insert_vals(self, val, kind=None):
+        return sql_literal(val, kind)
 
     def main(self):
         self.create_validation()
@@ -822,162 +2219,879 @@ class ShadowCopyOfConfigDict():
         self.insert_line_nums = list(configdict.insert_line_nums)
         self.delete_line_nums = list(configdict.delete_line_nums)
         self.del_or_up = list(configdict.del_or_up)
+        self.column_types = dict(configdict.column_types)
 
 
 
 class Backout():
     """
     Create 'delete.txt' & 'select.txt' scripts
+
+    binds: instead of one statement text per row, write a PL/SQL block
+    per statement shape (table, operation, columns) with the rows in
+    collections, so the backout parses O(shapes) statements, not O(rows)
+
+    A block is a list of pieces: text, or for rows with captured LOBs a
+    function streaming the PL/SQL that restores them (write_pieces).
+    LOB columns are left out of delete predicates.
     """
-    def __init__(self, backout_path, configdict):
+    def __init__(self, backout_path, configdict, timings=None, binds=False,
+                 bind_chunk=BIND_CHUNK):
         self.cd = configdict
         self.backout_path = backout_path
-        self.update_deletes = {}
-        self.update_inserts = {}
-        self.inserts = {}
-        self.deletes = {}
+        self.timings = timings if timings is not None else Timings()
+        self.binds = binds
+        self.bind_chunk = bind_chunk
+        self.groups = {}
+        self.shapes = set()
+        self.column_types = getattr(configdict, 'column_types', {})
 
     def create_backout(self):
         """
         Turn inserts or updates etc. into select & delete statements
         """
+        start = clock()
 
         '''
         handle updates
         '''
-        
-        def update_backout_deletes():
-            line_nums = list(self.cd.update_line_nums)
-            tabs = self.cd.update_tables
-            updates = self.cd.updates
-            # Create deletes
-            for table in self.cd.post_update:
-                tab = tabs[0]
-                l = line_nums[0]
-                u = updates[0]
+        # delete the post update rows, insert the pre update rows
+        for l, tab, post, pre in zip(self.cd.update_line_nums,
+                                     self.cd.update_tables,
+                                     self.cd.post_update,
+                                     self.cd.pre_update):
+            self.groups[l] = [[('delete', tab, row) for row in post],
+                              [('insert', tab, row) for row in pre]]
+
+        # 2 inserts makes 2 deletes
+        for l, tab, row in zip(self.cd.insert_line_nums,
+                               self.cd.insert_tables,
+                               self.cd.inserts):
+            self.groups[l] = [[('delete', tab, row)]]
+
+        # 1 delete makes many inserts
+        for l, tab, rows in zip(self.cd.delete_line_nums,
+                                self.cd.delete_tables,
+                                self.cd.deletes):
+            self.groups[l] = [[('insert', tab, row) for row in rows]]
+
+        self.blocks = self.backout_blocks()
+        self.timings.add('generate.backout', clock() - start)
+
+        with self.timings.phase('io.write_backout'), \
+                open(self.backout_path, 'w') as b:
+            for line_num, tn, pieces in self.blocks:
+                write_pieces(b, pieces)
+
+    def backout_blocks(self, render=None):
+        '''
+        Return (line number, table, backout pieces) for each statement,
+        last statement first
+        '''
+        statements = {}
+        tables = {}
+        for line_nums, stmts, tabs in (
+                (self.cd.update_line_nums, self.cd.updates,
+                 self.cd.update_tables),
+                (self.cd.insert_line_nums, self.cd.insert_statements,
+                 self.cd.insert_tables),
+                (self.cd.delete_line_nums, self.cd.delete_statements,
+                 self.cd.delete_tables)):
+            statements.update(zip(line_nums, stmts))
+            tables.update(zip(line_nums, tabs))
+
+        if render is None:
+            render = self.bind_group if self.binds else self.literal_group
+        blocks = []
+        for line_num in reversed(self.cd.line_list):
+            if line_num not in statements:
+                continue
+            pieces = ["{} {}\n{} {}\n".format(
+                '--Line number:',
+                str(line_num),
+                '--',
+                str(statements[line_num]))]
+            for group in self.groups.get(line_num, ()):
+                pieces.extend(render(group))
+                pieces.append('\n\n')
+            blocks.append((line_num, tables[line_num], join_pieces(pieces)))
+        return blocks
+
+    def literal_group(self, group):
+        '''
+        one statement per row, values as literals
+        '''
+        lines = []
+        for op, tab, row in group:
+            kinds = self.column_types.get(tab, {})
+            if op == 'delete':
+                lines.append('delete from {} where {};'.format(
+                    tab, ' and '.join(
+                        self.delete_vals(col, val, kinds.get(col))
+                        for col, val in without_lobs(row, kinds))))
+            elif has_lobs(row):
+                lines.append(self.lob_insert(tab, row, kinds))
+            else:
+                lines.append('insert into {} {} values {};'.format(
+                    tab,
+                    '(' + ', '.join(col for col, val in row) + ')',
+                    '(' + ', '.join(self.insert_vals(val, kinds.get(col))
+                                    for col, val in row) + ')'))
+        return join_pieces(lines, '\n')
+
+    def lob_insert(self, tab, row, kinds):
+        '''
+        piece writing a PL/SQL block that inserts row with empty LOBs
+        and appends the captured LOB values to them chunk by chunk
+        '''
+        lobs = [(col, val) for col, val in row if isinstance(val, LobRef)]
+        names = ['l{}'.format(n + 1) for n in range(len(lobs))]
+
+        def write(f):
+            write_restore(f, tab, '    insert into {} ({}) values ({})\n'
+                          '        returning {}, rowid into {}, rid;\n'.format(
+                              tab,
+                              ', '.join(col for col, val in row),
+                              ', '.join(self.insert_vals(val, kinds.get(col))
+                                        for col, val in row),
+                              ', '.join(col for col, val in lobs),
+                              ', '.join(names)), lobs)
+        return write
+
+    def bind_group(self, group):
+        '''
+        one PL/SQL block per shape and bind_chunk rows, the statement
+        binds the collections so its text is the same for every row.
+        A delete's shape includes which columns are NULL. Collections
+        are typed by column kind, so binds compare without conversions.
+        '''
+        shapes = []
+        rows = {}
+        lob_inserts = []
+        for op, tab, row in group:
+            if op == 'delete':
+                row = without_lobs(row, self.column_types.get(tab, {}))
+            elif has_lobs(row):
+                lob_inserts.append(self.lob_insert(
+                    tab, row, self.column_types.get(tab, {})))
+                continue
+            cols = tuple(col for col, val in row)
+            if op == 'delete':
+                shape = (op, tab, cols, tuple(val is None for col, val in row))
+            else:
+                shape = (op, tab, cols, ())
+            if shape not in rows:
+                shapes.append(shape)
+                rows[shape] = []
+            rows[shape].append([val for col, val in row])
+        self.shapes.update(shapes)
+
+        blocks = []
+        for shape in shapes:
+            op, tab, cols, nulls = shape
+            if op == 'delete':
+                bound = [k for k, null in enumerate(nulls) if not null]
+                terms = ['{} is NULL'.format(col)
+                         for col, null in zip(cols, nulls) if null]
+                terms[:0] = ['{} = c{}(i)'.format(cols[k], n + 1)
+                             for n, k in enumerate(bound)]
+                sql = 'delete from {} where {}'.format(tab, ' and '.join(terms))
+            else:
+                bound = range(len(cols))
+                sql = 'insert into {} ({}) values ({})'.format(
+                    tab, ', '.join(cols), ', '.join(
+                        'c{}(i)'.format(n + 1) for n in bound))
+            data = rows[shape]
+            kinds = bind_kinds(cols, bound, data,
+                               self.column_types.get(tab, {}))
+            blocks.extend(forall_blocks(sql, bound, kinds, data,
+                                        self.bind_chunk))
+        return join_pieces(blocks + lob_inserts, '\n')
+
+    def create_bulk(self, bulk_dir, min_rows):
+        """
+        Write a copy of the backout to bulk_dir where every group of at
+        least min_rows inserts into a table is loaded by SQL*Loader, direct
+        path, from a delimited data file and a generated control file.
+        Rows with LOB values, a separator character in a value or a str
+        value that isn't UTF-8 stay inserts (see bulk_loadable).
+        SQL*Loader runs in its own session and a direct path load locks
+        the table, so the script commits before every load: it backs out
+        a deployed change, it can't be part of the verification run.
+        Returns the script path.
+        """
+        if not os.path.exists(bulk_dir):
+            os.makedirs(bulk_dir)
+        self.bulk_dir = bulk_dir
+        self.bulk_rows = max(1, min_rows)
+        self.loads = 0
+        with self.timings.phase('generate.bulk'):
+            blocks = self.backout_blocks(self.bulk_group)
+        path = os.path.join(bulk_dir, 'rollback_bulk.sql')
+        with self.timings.phase('io.write_bulk'), open(path, 'w') as f:
+            f.write(BULK_HEADER)
+            for line_num, tn, pieces in blocks:
+                write_pieces(f, pieces)
+        return path
+
+    def bulk_group(self, group):
+        '''
+        a SQL*Loader step for the loadable inserts of a large insert
+        group, literal statements for everything else
+        '''
+        tables = set(tab for op, tab, row in group)
+        loadable = [row for op, tab, row in group
+                    if op == 'insert' and
+                    all(bulk_loadable(val) for col, val in row)]
+        if len(tables) != 1 or len(loadable) < self.bulk_rows:
+            return self.literal_group(group)
+        loaded = set(id(row) for row in loadable)
+        rest = [entry for entry in group if id(entry[2]) not in loaded]
+        pieces = [self.bulk_load(tables.pop(), loadable)]
+        if rest:
+            pieces.append('\n')
+            pieces.extend(self.literal_group(rest))
+        return join_pieces(pieces)
+
+    def bulk_load(self, tab, rows):
+        '''
+        write the data and control files for rows, return the load step
+        '''
+        self.loads += 1
+        base = os.path.abspath(os.path.join(
+            self.bulk_dir, 'load_{:04d}'.format(self.loads)))
+        cols = [col for col, val in rows[0]]
+        data = [[dict(row).get(col) for col in cols] for row in rows]
+        kinds = bind_kinds(cols, range(len(cols)), data,
+                           self.column_types.get(tab, {}))
+
+        with open(base + '.dat', 'wb') as f:
+            for values in data:
+                f.write(BULK_FIELD.join(bulk_field(val, kinds[k])
+                                        for k, val in enumerate(values)))
+                f.write(BULK_RECORD)
+        with open(base + '.ctl', 'w') as f:
+            f.write("OPTIONS (DIRECT=TRUE)\n"
+                    "LOAD DATA\n"
+                    "CHARACTERSET AL32UTF8 LENGTH SEMANTICS CHAR\n"
+                    "INFILE '{}.dat' \"str X'{}'\"\n"
+                    "APPEND\n"
+                    "PRESERVE BLANKS\n"
+                    "INTO TABLE {}\n"
+                    "FIELDS TERMINATED BY X'{}'\n"
+                    "TRAILING NULLCOLS\n"
+                    "(\n    {}\n)\n".format(
+                        base, binascii.hexlify(BULK_RECORD), tab,
+                        binascii.hexlify(BULK_FIELD), ',\n    '.join(
+                            '{} {}'.format(col, LOADER_TYPES[kinds[k]])
+                            for k, col in enumerate(cols))))
+        # run in the load directory, so no path on the command line
+        # needs quoting for sqlldr
+        return ('-- {rows} rows loaded by SQL*Loader from {name}.dat\n'
+                'commit;\n'
+                'host cd {dir} && sqlldr control={name}.ctl '
+                'log={name}.log bad={name}.bad').format(
+                    rows=len(rows), name=os.path.basename(base),
+                    dir=pipes.quote(os.path.dirname(base)))
+
+    def create_plan(self, plan_dir, foreign_keys=None):
+        """
+        Split the backout into parts that can run in parallel sessions.
+
+        Tables joined by a foreign key (foreign_keys is a list of
+        (child, parent) pairs) or by a statement reading one table while
+        writing another end up in the same part. Each part keeps the
+        backout order, last statement first, so all ordering constraints
+        are inside a part and the parts can run in any order. Without
+        foreign key metadata (None) everything is one part.
+        Writes one script per part and plan.json, returns the plan.
+        """
+        parent = {}
+
+        def find(t):
+            while parent.setdefault(t, t) != t:
+                parent[t] = parent[parent[t]]
+                t = parent[t]
+            return t
+
+        def union(a, b):
+            parent[find(a)] = find(b)
+
+        keys = [table_key(tn) for line_num, tn, pieces in self.blocks]
+        for k in keys:
+            find(k)
+        if foreign_keys is None:
+            for k in keys[1:]:
+                union(keys[0], k)
+        else:
+            for child, par in foreign_keys:
+                union(table_key(child), table_key(par))
+        graph = getattr(self.cd, 'graph', None)
+        if graph is not None:
+            for st in graph.statements:
+                for t in st.reads:
+                    union(st.table, t)
+
+        parts = {}
+        for k, (line_num, tn, pieces) in zip(keys, self.blocks):
+            part = parts.setdefault(find(k), {'tables': set(), 'blocks': []})
+            part['tables'].add(k)
+            part['blocks'].append((line_num, pieces))
+
+        if not os.path.exists(plan_dir):
+            os.makedirs(plan_dir)
+        plan = {'plan_version': 1,
+                'backout': os.path.basename(self.backout_path),
+                'parallel_safe': foreign_keys is not None,
+                'parts': []}
+        ordered = sorted(parts.values(),
+                         key=lambda p: (-len(p['blocks']), sorted(p['tables'])))
+        with self.timings.phase('io.write_plan'):
+            for n, part in enumerate(ordered, start=1):
+                script = 'part_{:03d}.sql'.format(n)
+                with open(os.path.join(plan_dir, script), 'w') as f:
+                    f.write('-- backout part {} of {}: {}\n\n'.format(
+                        n, len(ordered), ', '.join(sorted(part['tables']))))
+                    for line_num, pieces in part['blocks']:
+                        write_pieces(f, pieces)
+                plan['parts'].append({
+                    'script': script,
+                    'tables': sorted(part['tables']),
+                    'statements': len(part['blocks']),
+                    'lines': [line_num for line_num, pieces
+                              in part['blocks']]})
+            with open(os.path.join(plan_dir, 'plan.json'), 'w') as f:
+                json.dump(plan, f, indent=2, sort_keys=True)
+        return plan
+
+    def delete_vals(self, col, val, kind=None):
+        return ("{column} is NULL".format(column=col)
+                if val is None else "{column} = {value}".format(
+                    column=col, value=sql_literal(val, kind)))
 
-                delete_root = 'delete from' + ' ' + tab + ' ' + 'where' + ' '
-                self.update_deletes[line_nums[0]] = []
-                for row in table:
-                    str_ = ' and '.join(
-                        self.delete_vals(col, val) for col, val in row)
-                    self.update_deletes[l].append(delete_root + str_ + ';')
-                line_nums = line_nums[1:]
-                tabs = tabs[1:]
-                u = u[1:]
+    def insert_vals(self, val, kind=None):
+        return sql_literal(val, kind)
 
-        def update_backout_inserts():
-            # Create inserts
-            line_nums = list(self.cd.update_line_nums)
-            tabs = self.cd.update_tables
-            updates = self.cd.updates
-            for table in self.cd.pre_update:
-                tab = tabs[0]
-                l = line_nums[0]
-                u = updates[0]
-                insert_root = 'insert into' + ' ' + tab + ' '
-                self.update_inserts[line_nums[0]] = []
-                for row in table:
-                    cols = '(' + ', '.join(col[0] for col in row) + ')'
-                    vals = '(' + ', '.join(
-                        self.insert_vals(val) for row, val in row) + ')'
-                    self.update_inserts[l].append(
-                        insert_root
-                        + cols
-                        + ' '
-                        + 'values'
-                        + ' '
-                        + vals
-                        + ';')
-                tabs = tabs[1:]
-                line_nums = line_nums[1:]
-                u = u[1:]
+    def main(self):
+        self.create_backout()
 
-        update_backout_deletes()
-        update_backout_inserts()
 
-        def inserts():
-            # 2 inserts makes 2 deletes
-            tables = self.cd.insert_tables
-            line_nums = list(self.cd.insert_line_nums)
-            for table in self.cd.inserts:
-                l = line_nums[0]
-                self.deletes[l] = []
-                t = tables[0]
-                result = ' and '.join(
-                    self.delete_vals(col, val)
-                    for col, val in table)
-                delete = 'delete from {} where {};'.format(
-                    t, result)
-                self.deletes[l].append(delete)
-                tables = tables[1:]
-                line_nums = line_nums[1:]
-        inserts()
+class CaptureError(Exception):
 
-        def deletes():
-            # 1 delete makes many inserts
-            tables = self.cd.delete_tables
-            line_nums = list(self.cd.delete_line_nums)
-            for table in self.cd.deletes:
-                t = tables[0]
-                l = line_nums[0]
-                self.inserts[l] = []
-                for row in table:
-                    t = tables[0]
-                    cols = '(' + ', '.join(col[0] for col in row) + ')'
-                    vals = '(' + ', '.join(self.insert_vals(val)
-                                           for col, val in row) + ')'
-                    insert = 'insert into {} {} values {};'.format(
-                        t, cols, vals)
-                    self.inserts[l].append(insert)
-                tables = tables[1:]
-                line_nums = line_nums[1:]
-        deletes()
+    '''
+    a dml script that can't be captured: the keyword rules forbid one
+    of its statements, a statement can't be parsed, or statements
+    failed on the database
+    '''
 
-        with open(self.backout_path, 'w') as b:
-            for line_num in reversed(self.cd.line_list):
-                if line_num in self.cd.update_line_nums:
-                    line_num_format = "{} {}\n{} {}\n".format(
-                        '--Line number:',
-                        str(line_num),
-                        '--',
-                        str(self.cd.updates.pop(0)))
-                    b.write(line_num_format)
-                    b.write("\n".join([
-                        delete for delete in
-                        self.update_deletes[line_num]])
-                        + '\n\n')
-                    b.write("\n".join([
-                        insert for insert in
-                        self.update_inserts[line_num]]) + '\n\n')
-                elif line_num in self.cd.insert_line_nums:
-                    line_num_format = "{} {}\n{} {}\n".format(
-                        '--Line number:',
-                        str(line_num),
-                        '--',
-                        str(self.cd.insert_statements.pop(0)))
-                    b.write(line_num_format)
-                    b.write("\n".join([
-                        delete for delete in
-                        self.deletes[line_num]]) + '\n\n')
-                elif line_num in self.cd.delete_line_nums:
-                    line_num_format = "{} {}\n{} {}\n".format(
-                        '--Line number:', str(line_num),
-                        '--', str(self.cd.delete_statements.pop(0)))
-                    b.write(line_num_format)
-                    b.write("\n".join([
-                        insert for insert in self.inserts[line_num]]) + '\n\n')
 
-    def delete_vals(self, col, val):
-        return ("{column} is NULL".format(column=col)
-                if val is None else "{column} = '{value}'".format(
-                    column=col, value=val))
+def capture(script, conn, journal=None, timings=None,
+            capture_mode='statement', lob_dir=None, arraysize=ARRAYSIZE,
+            prefetchrows=None, rules=DEFAULT_RULES, metadata=None,
+            meta=None, progress_ms=250, progress_log_s=10,
+            progress_label=None):
+    '''
+    Run the dml script on conn, a connection or connect string, roll it
+    back and return the rows it changed as a Capture.
+    A connection is left open for the caller. metadata: store kept
+    across calls for the dictionary lookups (see ConfigDict).
+    progress_label: prefix of the logged progress lines of a capture
+    run next to others (see ConsoleOut).
+    CaptureError if the keyword rules forbid one of its statements, a
+    statement can't be parsed or any statement failed (see journal),
+    with everything rolled back.
+    '''
+    if journal is None:
+        journal = ErrorJournal(os.devnull)
+    errors = journal.errors
+    cd = ConfigDict(conn, script, journal, timings, progress_ms,
+                    progress_log_s, capture_mode, lob_dir, arraysize,
+                    prefetchrows, metadata, progress_label)
+    with cd.timings.phase('validate_config'):
+        found = cd.scan_dml(rules=rules)[2]
+    if found:
+        if cd.own_conn:
+            cd.db_conn.close()
+        rule = min(found, key=found.get)
+        raise CaptureError("'{}' found in {} line {}".format(
+            rule, os.path.basename(script), found[rule]))
+    try:
+        cd.process_config()
+    except CaptureError:
+        cd.db_conn.rollback()
+        if cd.own_conn:
+            cd.db_conn.close()
+        raise
+    journal.flush()
+    if journal.errors > errors:
+        raise CaptureError('{} Oracle errors in {}'.format(
+            journal.errors - errors, journal.path))
+    return capture_of(cd, dict({'dml': os.path.basename(script),
+                                'capture': capture_mode}, **(meta or {})))
+
+
+def generate(capture, sinks, timings=None, binds=False,
+             validation_mode='rows', bulk_rows=0, bind_chunk=BIND_CHUNK):
+    '''
+    Write the scripts of a capture, a ConfigDict or Capture, to sinks:
+    {artifact: path} with any of 'rollback.sql', 'validation.sql',
+    'capture.sysimp' and the directories 'rollback_plan' and
+    'rollback_bulk' (with bulk_rows), which need 'rollback.sql'.
+    Return the Backout, or None if no backout was asked for.
+    '''
+    timings = timings if timings is not None else Timings()
+    unknown = set(sinks) - set(SINKS)
+    if unknown:
+        raise ValueError('unknown sinks: {}'.format(', '.join(unknown)))
+    if 'rollback.sql' not in sinks and (
+            'rollback_plan' in sinks or 'rollback_bulk' in sinks):
+        raise ValueError('rollback_plan and rollback_bulk need rollback.sql')
+
+    if 'capture.sysimp' in sinks:
+        with timings.phase('io.write_capture'):
+            write_capture(sinks['capture.sysimp'], capture,
+                          getattr(capture, 'meta', None))
+        print 'capture saved: {}'.format(sinks['capture.sysimp'])
+
+    #Need to create a copy of the dictionary here before backout class masses it up
+    cdv = ShadowCopyOfConfigDict(capture)
+
+    backout = None
+    if 'rollback.sql' in sinks:
+        backout = Backout(sinks['rollback.sql'], capture, timings, binds,
+                          bind_chunk)
+        backout.create_backout()
+        print 'backout created'
+        if binds:
+            print '{} statement shapes bound'.format(len(backout.shapes))
+    if 'rollback_plan' in sinks:
+        plan_dir = sinks['rollback_plan']
+        plan = backout.create_plan(plan_dir, capture.foreign_key_pairs)
+        print 'backout plan created: {} parts in {}'.format(
+            len(plan['parts']), plan_dir)
+        if not plan['parallel_safe']:
+            print 'no foreign key metadata, plan has a single part'
+    if 'rollback_bulk' in sinks:
+        path = backout.create_bulk(sinks['rollback_bulk'], bulk_rows)
+        print 'bulk backout created: {} SQL*Loader loads, {}'.format(
+            backout.loads, path)
+
+    if 'validation.sql' in sinks:
+        #Passing shadow copy of the ConfigDict
+        ValidationScript(sinks['validation.sql'], cdv, timings,
+                         validation_mode).create_validation()
+        print 'validation script created'
+    return backout
+
+
+def generate_scripts(cd, backout_path, validation_path, timings=None,
+                     plan_dir=None, binds=False, validation_mode='rows',
+                     bulk_dir=None, bulk_rows=0, bind_chunk=BIND_CHUNK):
+    '''
+    write the backout, validation and optional plan and bulk backout
+    for a capture: a ConfigDict, or a Capture loaded from a file
+    '''
+    sinks = {'rollback.sql': backout_path, 'validation.sql': validation_path}
+    if plan_dir is not None:
+        sinks['rollback_plan'] = plan_dir
+    if bulk_dir is not None:
+        sinks['rollback_bulk'] = bulk_dir
+    return generate(cd, sinks, timings, binds, validation_mode, bulk_rows,
+                    bind_chunk)
 
-    def insert_vals(self, val):
-        return "{}".format('NULL') if val is None else "'{}'".format(val)
 
-    def main(self):
-        self.create_backout()
+def add_output_args(parser):
+    '''
+    options of the generated scripts, shared by a run and regenerate
+    '''
+    parser.add_argument('-binds',
+                        action='store_true',
+                        help='write the backout as PL/SQL blocks binding '
+                             'the rows, one statement text per table shape')
+    parser.add_argument('-bind_chunk',
+                        type=int,
+                        default=BIND_CHUNK,
+                        help='rows per PL/SQL block with -binds '
+                             '(default {})'.format(BIND_CHUNK))
+    parser.add_argument('-validation',
+                        choices=['rows', 'set', 'gtt'],
+                        default='rows',
+                        help='rows: one select per inserted or deleted row. '
+                             'set: one PASS/FAIL query per statement. '
+                             'gtt: rows staged in the query, one '
+                             'MINUS/INTERSECT per table and direction')
+    parser.add_argument('-bulk_rows',
+                        type=int,
+                        default=0,
+                        help='also write a backout loading every group of at '
+                             'least this many inserted rows with SQL*Loader '
+                             '(not cached, default 0: off)')
+    parser.add_argument('-plan',
+                        action='store_true',
+                        help='also split the backout into parts that can '
+                             'run in parallel sessions (not cached)')
+
+
+def regenerate(argv):
+    '''
+    regenerate subcommand: write the scripts again from a saved capture,
+    with other output options, without the driver or a database
+    '''
+    parser = argparse.ArgumentParser(
+        prog='PROG regenerate',
+        description='write the backout and validation scripts from a '
+                    'capture file')
+    parser.add_argument('-capture_file',
+                        required=True,
+                        help='<timestamp>_<db>_capture.sysimp of an '
+                             'earlier run')
+    parser.add_argument('-out_dir',
+                        default=this_dir,
+                        help='directory for the scripts (default: the '
+                             'script directory)')
+    add_output_args(parser)
+    args = parser.parse_args(argv)
+    if args.bind_chunk < 1:
+        parser.error('-bind_chunk must be at least 1')
+
+    timings = Timings()
+    with timings.phase('io.read_capture'):
+        capture = load_capture(args.capture_file)
+    print 'capture loaded: {} inserts, {} updates, {} deletes from {}'.format(
+        len(capture.inserts), len(capture.updates), len(capture.deletes),
+        capture.meta.get('dml'))
+
+    timestamp = datetime.datetime.utcnow().strftime('%H%M%S_%Y_%d%B')
+    prefix = os.path.join(args.out_dir, '{}_{}'.format(
+        timestamp, capture.meta.get('db', 'capture')))
+    generate_scripts(
+        capture, prefix + '_rollback.sql', prefix + '_validation.sql',
+        timings,
+        prefix + '_rollback_plan' if args.plan else None,
+        args.binds, args.validation,
+        prefix + '_rollback_bulk' if args.bulk_rows > 0 else None,
+        args.bulk_rows, args.bind_chunk)
+    print '\n{}_rollback.sql and {}_validation.sql written in {:.1f}s'.format(
+        prefix, prefix, timings.elapsed())
+
+
+def backout_request(request, conn, metadata, prefix, db, timings=None):
+    '''
+    capture request['dml'] on conn and write prefix_rollback.sql,
+    _validation.sql, _capture.sysimp, _timings.json and what the
+    request's options ask for; return the response fields.
+    Options as in the serve protocol (backout_service.py). Requests may
+    run concurrently, so progress is logged labelled with the prefix's
+    name rather than redrawn.
+    '''
+    dmlpath = request['dml']
+    if not os.path.exists(dmlpath):
+        raise ValueError('Path, {}, does not exist'.format(dmlpath))
+    bind_chunk = int(request.get('bind_chunk', BIND_CHUNK))
+    bulk_rows = int(request.get('bulk_rows', 0))
+    validation = request.get('validation', 'rows')
+    capture_mode = request.get('capture', 'statement')
+    rules = request.get('keyword_rules', DEFAULT_RULES)
+    if bind_chunk < 1:
+        raise ValueError('bind_chunk must be at least 1')
+    if validation not in ('rows', 'set', 'gtt'):
+        raise ValueError('unknown validation {}'.format(validation))
+    if capture_mode not in ('statement', 'flashback'):
+        raise ValueError('unknown capture {}'.format(capture_mode))
+
+    out_dir = os.path.dirname(prefix)
+    if out_dir and not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    # watch reuses a script's prefix: nothing of an earlier run may end
+    # up in this one's journal or side directories
+    if os.path.exists(prefix + '_cx_Oracle.jsonl'):
+        os.remove(prefix + '_cx_Oracle.jsonl')
+    for name in ('_lobs', '_rollback_plan', '_rollback_bulk'):
+        if os.path.isdir(prefix + name):
+            shutil.rmtree(prefix + name)
+    timestamp = datetime.datetime.utcnow().strftime('%H%M%S_%Y_%d%B')
+    journal = ErrorJournal(prefix + '_cx_Oracle.jsonl')
+    timings = timings if timings is not None else Timings()
+    timings.info['dml'] = os.path.basename(dmlpath)
+    timings.info['db'] = db
+    try:
+        result = capture(dmlpath, conn, journal, timings, capture_mode,
+                         prefix + '_lobs', rules=rules, metadata=metadata,
+                         meta={'db': db, 'timestamp': timestamp},
+                         progress_label=os.path.basename(prefix))
+    finally:
+        journal.close()
+    sinks = {'rollback.sql': prefix + '_rollback.sql',
+             'validation.sql': prefix + '_validation.sql',
+             'capture.sysimp': prefix + '_capture.sysimp'}
+    if request.get('plan'):
+        sinks['rollback_plan'] = prefix + '_rollback_plan'
+    if bulk_rows > 0:
+        sinks['rollback_bulk'] = prefix + '_rollback_bulk'
+    generate(result, sinks, timings, bool(request.get('binds')),
+             validation, bulk_rows, bind_chunk)
+    sinks['timings.json'] = timings.write_report(prefix + '_timings.json')
+    return {'artifacts': sinks,
+            'statements': {'insert': len(result.inserts),
+                           'update': len(result.updates),
+                           'delete': len(result.deletes)}}
+
+
+def add_pool_args(parser):
+    '''
+    session pool options, shared by serve and watch
+    '''
+    parser.add_argument('-user',
+                        required=True,
+                        help='database user of the pooled sessions')
+    parser.add_argument('-pool_min',
+                        type=int,
+                        default=1,
+                        help='sessions opened per database at start '
+                             '(default 1)')
+    parser.add_argument('-pool_max',
+                        type=int,
+                        default=4,
+                        help='sessions per database, so requests served at '
+                             'once (default 4)')
+    parser.add_argument('-metadata_ttl_s',
+                        type=float,
+                        default=METADATA_TTL_S,
+                        help='seconds dictionary metadata is reused '
+                             '(default {})'.format(METADATA_TTL_S))
+
+
+def session_pools(parser, args, dbs, pw):
+    '''
+    {db: session pool} for the add_pool_args options
+    '''
+    if not 1 <= args.pool_min <= args.pool_max:
+        parser.error('need 1 <= -pool_min <= -pool_max')
+    driver = load_driver()
+    pools = {}
+    for db in dbs:
+        pools[db] = driver.SessionPool(
+            args.user, pw, db, args.pool_min, args.pool_max, 1,
+            threaded=True, getmode=driver.SPOOL_ATTRVAL_WAIT)
+    return pools
+
+
+def serve(argv):
+    '''
+    serve subcommand: capture and generate for requests over localhost
+    HTTP or a Unix socket, from warm session pools (backout_service.py)
+    '''
+    parser = argparse.ArgumentParser(
+        prog='PROG serve',
+        description='serve backout requests from session pools')
+    add_pool_args(parser)
+    parser.add_argument('-db',
+                        nargs='+',
+                        required=True,
+                        help='databases to pool sessions for, the first '
+                             'serves requests naming none')
+    parser.add_argument('-port',
+                        type=int,
+                        default=8765,
+                        help='localhost HTTP port (default 8765)')
+    parser.add_argument('-socket',
+                        help='serve on this Unix socket instead of HTTP')
+    parser.add_argument('-out_dir',
+                        default=this_dir,
+                        help='directory for the scripts of requests naming '
+                             'none (default: the script directory)')
+    args = parser.parse_args(argv)
+    pools = session_pools(parser, args, args.db, getpw())
+
+    def backout(request, conn, metadata):
+        db = request.get('db') or args.db[0]
+        timestamp = datetime.datetime.utcnow().strftime('%H%M%S_%Y_%d%B')
+        prefix = os.path.join(request.get('out_dir') or args.out_dir,
+                              '{}_{}'.format(timestamp, db))
+        return backout_request(request, conn, metadata, prefix, db)
+
+    service = BackoutService(pools, backout, args.metadata_ttl_s, args.db[0])
+    serve_requests(service, args.port, args.socket)
+
+
+def watch(argv):
+    '''
+    watch subcommand: reprocess the dml scripts of a directory when they
+    change, keeping the latest outputs per script (dml_watch.py)
+    '''
+    parser = argparse.ArgumentParser(
+        prog='PROG watch',
+        description='capture and generate again for every changed dml '
+                    'script of a directory')
+    parser.add_argument('-dir',
+                        required=True,
+                        help='directory of dml scripts, e.g. SCRIPTS/dml')
+    add_pool_args(parser)
+    parser.add_argument('-db',
+                        required=True,
+                        help='database the scripts are captured on')
+    parser.add_argument('-out_dir',
+                        help='directory for the latest outputs per script '
+                             '(default <dir>/sysimp_watch)')
+    parser.add_argument('-debounce_s',
+                        type=float,
+                        default=DEBOUNCE_S,
+                        help='seconds a file must be left alone before it '
+                             'is processed (default {})'.format(DEBOUNCE_S))
+    parser.add_argument('-interval_s',
+                        type=float,
+                        default=INTERVAL_S,
+                        help='seconds between directory polls '
+                             '(default {})'.format(INTERVAL_S))
+    parser.add_argument('-workers',
+                        type=int,
+                        default=1,
+                        help='scripts processed at once (default 1)')
+    parser.add_argument('-capture',
+                        choices=['statement', 'flashback'],
+                        default='statement',
+                        help='as for a run (default statement)')
+    parser.add_argument('-keyword_rules',
+                        nargs='+',
+                        choices=sorted(RULES),
+                        default=list(DEFAULT_RULES),
+                        help='as for a run (default commit disable)')
+    add_output_args(parser)
+    args = parser.parse_args(argv)
+    if args.bind_chunk < 1:
+        parser.error('-bind_chunk must be at least 1')
+    if not os.path.isdir(args.dir):
+        parser.error('{} is not a directory'.format(args.dir))
+    out_dir = args.out_dir or os.path.join(args.dir, 'sysimp_watch')
+    args.pool_max = max(args.pool_max, args.workers)
+    pool = session_pools(parser, args, [args.db], getpw())[args.db]
+    metadata = MetadataCache(args.metadata_ttl_s)
+
+    def process(dmlpath):
+        request = {'dml': dmlpath, 'capture': args.capture,
+                   'keyword_rules': args.keyword_rules, 'binds': args.binds,
+                   'bind_chunk': args.bind_chunk,
+                   'validation': args.validation, 'plan': args.plan,
+                   'bulk_rows': args.bulk_rows}
+        prefix = os.path.join(
+            out_dir, os.path.splitext(os.path.basename(dmlpath))[0])
+        start = clock()
+        conn = pool.acquire()
+        try:
+            response = backout_request(request, conn, metadata, prefix,
+                                       args.db)
+            response['status'] = 'ok'
+        except (Exception, SystemExit) as e:
+            response = {'status': 'error', 'error': str(e) or repr(e)}
+        finally:
+            release_session(pool, conn)
+        response.update(dml=dmlpath, db=args.db,
+                        seconds=round(clock() - start, 3),
+                        finished=datetime.datetime.utcnow().isoformat())
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        report = prefix + '_report.json'
+        with open(report + '.tmp', 'w') as f:
+            json.dump(response, f, indent=2, sort_keys=True, default=str)
+            f.write('\n')
+        if os.path.exists(report):
+            os.remove(report)
+        os.rename(report + '.tmp', report)
+        return response
+
+    DmlWatcher(args.dir, process, args.debounce_s, args.interval_s,
+               args.workers).run()
+
+
+def fanout_command(argv):
+    '''
+    fanout subcommand: capture, generate and verify one dml script on
+    several databases at once, with a consolidated report (fanout.py)
+    '''
+    parser = argparse.ArgumentParser(
+        prog='PROG fanout',
+        description='verify and back out a dml script on several '
+                    'databases concurrently')
+    parser.add_argument('-dml',
+                        required=True,
+                        help='path to dml script')
+    add_pool_args(parser)
+    parser.add_argument('-db',
+                        nargs='+',
+                        required=True,
+                        help='target databases, e.g. bw3_qa uat preprod')
+    parser.add_argument('-out_dir',
+                        default=this_dir,
+                        help='directory for the outputs (default: the '
+                             'script directory)')
+    parser.add_argument('-capture',
+                        choices=['statement', 'flashback'],
+                        default='statement',
+                        help='as for a run (default statement)')
+    parser.add_argument('-keyword_rules',
+                        nargs='+',
+                        choices=sorted(RULES),
+                        default=list(DEFAULT_RULES),
+                        help='as for a run (default commit disable)')
+    add_output_args(parser)
+    args = parser.parse_args(argv)
+    if args.bind_chunk < 1:
+        parser.error('-bind_chunk must be at least 1')
+    if not os.path.exists(args.dml):
+        parser.error('Path, {}, does not exist'.format(args.dml))
+    targets = sorted(set(args.db), key=args.db.index)
+    pw = getpw()
+    pools = session_pools(parser, args, targets, pw)
+    timestamp = datetime.datetime.utcnow().strftime('%H%M%S_%Y_%d%B')
+    request = {'dml': args.dml, 'capture': args.capture,
+               'keyword_rules': args.keyword_rules, 'binds': args.binds,
+               'bind_chunk': args.bind_chunk, 'validation': args.validation,
+               'plan': args.plan, 'bulk_rows': args.bulk_rows}
+
+    def run_target(db):
+        prefix = os.path.join(args.out_dir, '{}_{}'.format(timestamp, db))
+        timings = Timings()
+        pool = pools[db]
+        conn = pool.acquire()
+        try:
+            result = backout_request(request, conn, None, prefix, db,
+                                     timings)
+        finally:
+            release_session(pool, conn)
+        artifacts = result['artifacts']
+        verify = Db(args.dml, artifacts['rollback.sql'], None,
+                    prefix + '_sqlplus', '{}/{}@{}'.format(args.user, pw, db),
+                    artifacts['validation.sql'], timings)
+        verify.run(verify.CONFIG_ARGLIST, verify.sqlplus_verify_logfile,
+                   'sqlplus.verify')
+        artifacts['sqlplus_verify.log'] = verify.sqlplus_verify_logfile
+        if verify.sql_error:
+            result.update(status='error', error='the dml script failed in '
+                          'sqlplus, see ' + verify.sqlplus_verify_logfile)
+        else:
+            verify.run(verify.BACKOUT_ARGLIST,
+                       verify.sqlplus_backout_logfile, 'sqlplus.backout')
+            artifacts['sqlplus_verify_rollback.log'] = \
+                verify.sqlplus_backout_logfile
+            if verify.sql_error:
+                result.update(status='error', error='the backout failed '
+                              'in sqlplus, see ' +
+                              verify.sqlplus_backout_logfile)
+        timings.write_report(artifacts['timings.json'])
+        result['phases'] = timings.phases
+        return result
+
+    start = clock()
+    results = fan_out(targets, run_target)
+    path = write_fanout_report(
+        os.path.join(args.out_dir, '{}_fanout_report.json'.format(timestamp)),
+        results, {'dml': os.path.basename(args.dml), 'timestamp': timestamp,
+                  'seconds': round(clock() - start, 3)})
+    print
+    print_fanout_report(results, targets)
+    print '\nreport written to {}'.format(path)
+    if any(r['status'] != 'ok' for r in results.values()):
+        sys.exit(1)
 
 
 def get_db_user():
@@ -996,13 +3110,120 @@ def getpw():
 
 
 if __name__ == '__main__':
+    if sys.argv[1:2] == ['regenerate']:
+        regenerate(sys.argv[2:])
+        sys.exit()
+    if sys.argv[1:2] == ['serve']:
+        serve(sys.argv[2:])
+        sys.exit()
+    if sys.argv[1:2] == ['watch']:
+        watch(sys.argv[2:])
+        sys.exit()
+    if sys.argv[1:2] == ['fanout']:
+        fanout_command(sys.argv[2:])
+        sys.exit()
+
     parser = argparse.ArgumentParser(
         prog='PROG',
         description='')
     parser.add_argument('-dml',
                         nargs=1,
                         help='path to the dml script')
+    parser.add_argument('-progress_ms',
+                        type=int,
+                        default=250,
+                        help='minimum ms between progress redraws (default 250)')
+    parser.add_argument('-progress_log_s',
+                        type=int,
+                        default=10,
+                        help='seconds between progress lines when stdout '
+                             'is not a terminal (default 10)')
+    parser.add_argument('-arraysize',
+                        type=int,
+                        default=ARRAYSIZE,
+                        help='rows per fetch round trip for capture '
+                             'queries (default {})'.format(ARRAYSIZE))
+    parser.add_argument('-prefetchrows',
+                        type=int,
+                        help='rows prefetched with a query\'s execute, '
+                             'cx_Oracle 8+ (default arraysize + 1)')
+    parser.add_argument('-capture',
+                        choices=['statement', 'flashback'],
+                        default='statement',
+                        help='statement: select before every update/delete. '
+                             'flashback: run the script at full speed and '
+                             'read pre-images AS OF the starting SCN, one '
+                             'query per table (default statement)')
+    parser.add_argument('-conflicts',
+                        choices=['warn', 'abort', 'off'],
+                        default='off',
+                        help='check for statements touching the same rows '
+                             'before any database work: report them (warn), '
+                             'stop (abort) or skip the check (default off)')
+    parser.add_argument('-keyword_rules',
+                        nargs='+',
+                        choices=sorted(RULES),
+                        default=list(DEFAULT_RULES),
+                        help='statements the dml script must not contain, '
+                             'matched outside literals and comments '
+                             '(default commit disable)')
+    add_output_args(parser)
+    parser.add_argument('-cache',
+                        action='store_true',
+                        help='reuse the outputs of an earlier run of the same '
+                             'script on unchanged tables, and store them. '
+                             'The table fingerprint reads every row of the '
+                             'tables the script touches')
+    parser.add_argument('-no_cache',
+                        action='store_true',
+                        help='never use or fill the result cache, the '
+                             'default, overrides -cache')
+    parser.add_argument('-clear_cache',
+                        action='store_true',
+                        help='remove every cached result before running')
+    parser.add_argument('-cache_ttl_h',
+                        type=float,
+                        default=24,
+                        help='cached results older than this many hours '
+                             'are ignored (default 24)')
+    parser.add_argument('-preflight',
+                        action='store_true',
+                        help='before the capture, explain and count the '
+                             'rows of every update and delete and report '
+                             'the rows, memory and time it would take')
+    parser.add_argument('-max_rows',
+                        type=int,
+                        help='preflight budget: stop if the capture would '
+                             'fetch more rows (implies -preflight)')
+    parser.add_argument('-max_memory_mb',
+                        type=float,
+                        help='preflight budget: stop if the captured rows '
+                             'would take more memory (implies -preflight)')
+    parser.add_argument('-max_capture_s',
+                        type=float,
+                        help='preflight budget: stop if the capture would '
+                             'take longer (implies -preflight)')
+    parser.add_argument('-max_full_scans',
+                        type=int,
+                        help='preflight budget: stop on more full scans of '
+                             'big tables (implies -preflight)')
+    parser.add_argument('-big_table_rows',
+                        type=int,
+                        default=BIG_TABLE_ROWS,
+                        help='preflight warns of full scans of tables with '
+                             'more rows (default {})'.format(BIG_TABLE_ROWS))
+    parser.add_argument('-resume_capture',
+                        help='capture file of an earlier run of this '
+                             'script: the updates and deletes up to the '
+                             'first changed statement are replayed without '
+                             'capture and take their rows from it, if its '
+                             'tables haven\'t changed since (statement '
+                             'capture)')
     args = parser.parse_args()
+    if args.bind_chunk < 1:
+        parser.error('-bind_chunk must be at least 1')
+    if args.resume_capture and args.capture != 'statement':
+        parser.error('-resume_capture needs -capture statement')
     dmlpath = args.dml[0]
     if not os.path.exists(dmlpath):
         print 'Path, {}, does not exist'.format(dmlpath)
@@ -1019,25 +3240,151 @@ if __name__ == '__main__':
     db_connection_string = '{}/{}@{}'.format(dbuser, pw, db)
 
     timestamp = datetime.datetime.utcnow().strftime('%H%M%S_%Y_%d%B')
-    cx_Oracle_logfile = '{}_{}_cx_Oracle'.format(timestamp, db)
+    cx_Oracle_logfile = os.path.join(
+        this_dir, '{}_{}_cx_Oracle.jsonl'.format(timestamp, db))
     sqlplus_logfile = '{}_{}_sqlplus'.format(timestamp, db)
 
-    config_dict = ConfigDict(db_connection_string, dmlpath, cx_Oracle_logfile)
-
-
-    config_dict.validate_config(['commit', 'disable'])
-    config_dict.process_config()
-    
-    
+    lob_dir = os.path.join(this_dir, '{}_{}_lobs'.format(timestamp, db))
+    timings_path = os.path.join(this_dir,
+                                '{}_{}_timings.json'.format(timestamp, db))
+    timings = Timings()
+    timings.info['dml'] = os.path.basename(dmlpath)
+    timings.info['db'] = db
+    journal = ErrorJournal(cx_Oracle_logfile)
 
     backout_path = os.path.join(this_dir, timestamp + '_' + db + '_rollback.sql')
     validation_path = os.path.join(this_dir, timestamp + '_' + db + '_validation.sql')
+    capture_path = os.path.join(this_dir, timestamp + '_' + db + '_capture.sysimp')
+    preflight_path = os.path.join(
+        this_dir, timestamp + '_' + db + '_preflight.json')
+    plan_dir = os.path.join(
+        this_dir, timestamp + '_' + db + '_rollback_plan') if args.plan else None
+    bulk_dir = os.path.join(
+        this_dir, timestamp + '_' + db + '_rollback_bulk') \
+        if args.bulk_rows > 0 else None
+    artifacts = {
+        'rollback.sql': backout_path,
+        'validation.sql': validation_path,
+        'capture.sysimp': capture_path,
+        'sqlplus_verify.log': os.path.join(
+            this_dir, sqlplus_logfile + '_verify.log'),
+        'sqlplus_verify_rollback.log': os.path.join(
+            this_dir, sqlplus_logfile + '_verify_rollback.log')}
+
+    cache = ResultCache(os.path.join(this_dir, '.sysimp_cache'),
+                        salt=tool_hash() + ('binds{}'.format(args.bind_chunk)
+                                          if args.binds else '')
+                        + args.validation,
+                        max_age_s=args.cache_ttl_h * 3600)
+    if args.clear_cache:
+        cache.clear()
+
+    try:
+        config_dict = ConfigDict(db_connection_string, dmlpath,
+                                 journal, timings,
+                                 args.progress_ms, args.progress_log_s,
+                                 args.capture, lob_dir,
+                                 args.arraysize, args.prefetchrows)
+
+        with timings.phase('validate_config'):
+            config_dict.validate_config(args.keyword_rules)
+
+        if args.conflicts != 'off':
+            with timings.phase('analysis'):
+                config_dict.graph = DependencyGraph(
+                    config_dict.iter_statements())
+            report_conflicts(config_dict.graph, journal)
+            if config_dict.graph.conflicts and args.conflicts == 'abort':
+                config_dict.db_conn.close()
+                print 'Conflicting statements found, exiting'
+                exit()
+        elif args.plan:
+            with timings.phase('analysis'):
+                config_dict.graph = DependencyGraph(
+                    config_dict.iter_statements())
+
+        cache_key = None
+        if args.cache and not (args.no_cache or args.plan or bulk_dir):
+            with timings.phase('cache.lookup'):
+                fingerprint = config_dict.fingerprint(
+                    config_dict.touched_tables())
+                config_dict.table_fingerprint = fingerprint
+                if fingerprint is not None:
+                    with open(dmlpath, 'rb') as f:
+                        cache_key = cache.key(
+                            f.read(), '{}@{}'.format(dbuser, db), fingerprint)
+                    hit = cache.restore(cache_key, artifacts)
+                else:
+                    hit = None
+            if hit:
+                config_dict.db_conn.close()
+                timings.info['cache'] = 'hit'
+                print 'Unchanged script and tables, reusing cached results'
+                for name in hit['artifacts']:
+                    print '    {}'.format(artifacts[name])
+                exit()
+            timings.info['cache'] = 'miss'
+
+        budgets = {'rows': args.max_rows, 'memory_mb': args.max_memory_mb,
+                   'seconds': args.max_capture_s,
+                   'full_scans': args.max_full_scans}
+        if args.preflight or any(v is not None for v in budgets.values()):
+            preflight = Preflight(config_dict.cursor, cx_Oracle.DatabaseError,
+                                  args.big_table_rows)
+            with timings.phase('preflight'):
+                preflight.run(config_dict.iter_statements())
+            report_preflight(preflight, preflight_path)
+            exceeded = preflight.exceeded(budgets)
+            if exceeded:
+                config_dict.db_conn.close()
+                for name, estimate, limit in exceeded:
+                    print '    {} {:.0f} over the budget of {}'.format(
+                        name, estimate, limit)
+                print 'Preflight budgets exceeded, exiting'
+                exit()
 
-    if os.path.exists(config_dict.cx_Oracle_logfile):
-        print 'Oracle errors in cx_Oracle log'
-    else:
-        print 'No Oracle database errors'
-        print '\nRunning configuration into sqlplus'
-        db = Db(dmlpath, backout_path, config_dict, sqlplus_logfile,
-                db_connection_string,validation_path)
-        db.main()
+        if args.resume_capture:
+            print config_dict.resume_from(args.resume_capture)
+
+        config_dict.process_config()
+        timings.info['rows_fetched'] = config_dict.rows_fetched
+        if config_dict.resume:
+            print '{} statements replayed from {}, {} captured'.format(
+                config_dict.replayed, args.resume_capture,
+                config_dict.statement_index - config_dict.replayed)
+            timings.info['replayed'] = config_dict.replayed
+        if config_dict.lobs.count:
+            print '{} LOB values ({} bytes) captured to {}'.format(
+                config_dict.lobs.count, config_dict.lobs.bytes,
+                config_dict.lobs.root)
+
+        journal.flush()
+        if journal.errors:
+            print '{} Oracle errors in {}'.format(journal.errors,
+                                                 journal.path)
+        else:
+            print 'No Oracle database errors'
+            with timings.phase('io.write_capture'):
+                statements, rows, size = write_capture(
+                    capture_path, config_dict,
+                    {'dml': os.path.basename(dmlpath), 'db': db,
+                     'capture': args.capture, 'timestamp': timestamp})
+            print 'capture saved: {} statements, {} rows, {} bytes, {}'.format(
+                statements, rows, size, capture_path)
+            print '\nRunning configuration into sqlplus'
+            db = Db(dmlpath, backout_path, config_dict, sqlplus_logfile,
+                    db_connection_string,validation_path, timings,
+                    plan_dir, args.binds, args.validation,
+                    bulk_dir, args.bulk_rows, args.bind_chunk)
+            db.main()
+            if cache_key is not None and not db.sql_error:
+                cache.store(cache_key, artifacts,
+                            {'dml': os.path.basename(dmlpath),
+                             'db': db.db_name})
+    except CaptureError as e:
+        print '\n\n{}\n\nexiting'.format(e)
+        exit()
+    finally:
+        journal.close()
+        print '\ntimings written to {}'.format(
+            timings.write_report(timings_path))
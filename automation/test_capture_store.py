@@ -0,0 +1,125 @@
+'''
+Tests of capture_store, no database needed
+
+Usage:
+    cd automation && python -m unittest discover -p 'test_*.py'
+'''
+
+import datetime
+import decimal
+import os
+import shutil
+import tempfile
+import unittest
+
+from capture_store import (decode_value, encode_value, load_capture,
+                           write_capture, CaptureReader)
+from lob_store import LobRef
+
+
+class Cd:
+
+    '''
+    the ConfigDict attributes write_capture reads
+    '''
+
+    def __init__(self):
+        self.line_list = [1, 2, 3]
+        self.actual_tables = ['t']
+        self.column_dict = {'t': ('a', 'b')}
+        self.column_types = {'t': {'a': 'number', 'b': 'date'}}
+        self.foreign_key_pairs = None
+        self.statement_fingerprints = None
+        self.table_fingerprint = None
+        self.inserts = [[('a', 1), ('b', datetime.datetime(1, 1, 1))]]
+        self.insert_statements = ['insert into t (a) values (1)']
+        self.insert_line_nums = [1]
+        self.insert_tables = ['t']
+        self.deletes = [[[('a', 2), ('b', datetime.date(1899, 12, 31))]]]
+        self.delete_statements = ['delete from t where a = 2']
+        self.delete_line_nums = [2]
+        self.delete_tables = ['t']
+        self.updates = ['update t set a = 4 where a = 3']
+        self.update_line_nums = [3]
+        self.update_tables = ['t']
+        self.pre_update = [[[['a', 3], ['b', None]]]]
+        self.post_update = [[[['a', 4], ['b', None]]]]
+
+
+class TestValues(unittest.TestCase):
+
+    def round_trip(self, val):
+        self.assertEqual(decode_value(encode_value(val)), val)
+
+    def test_scalars(self):
+        for val in (None, 'abc', u'\xe9t\xe9', 0, -12, 10 ** 30, 1.5,
+                    decimal.Decimal('12.340'),
+                    datetime.timedelta(2, 3, 4)):
+            self.round_trip(val)
+
+    def test_dates(self):
+        for val in (datetime.date(2017, 7, 18),
+                    datetime.datetime(2017, 7, 18, 13, 5, 59, 123456),
+                    datetime.datetime(2017, 7, 18)):
+            self.round_trip(val)
+
+    def test_dates_before_1900(self):
+        for val in (datetime.date(1, 1, 1), datetime.date(1899, 12, 31),
+                    datetime.datetime(1, 1, 1),
+                    datetime.datetime(1899, 12, 31, 23, 59, 59, 1)):
+            self.round_trip(val)
+
+    def test_types_kept(self):
+        self.assertIs(type(decode_value(encode_value(
+            datetime.date(1, 1, 1)))), datetime.date)
+        self.assertIs(type(decode_value(encode_value('x'))), str)
+
+    def test_lob_path_relative(self):
+        ref = decode_value(encode_value(
+            LobRef(os.path.join('base', 'lobs', 'l1.clob'), 'clob', 7),
+            'base'), 'other')
+        self.assertEqual(ref.path, os.path.join('other', 'lobs', 'l1.clob'))
+        self.assertEqual((ref.kind, ref.size), ('clob', 7))
+
+    def test_unsupported(self):
+        self.assertRaises(TypeError, encode_value, True)
+        self.assertRaises(TypeError, encode_value, object())
+
+
+class TestCaptureFile(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'x_capture.sysimp')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        cd = Cd()
+        statements, rows, size = write_capture(self.path, cd, {'dml': 'x'})
+        self.assertEqual((statements, rows), (3, 4))
+        capture = load_capture(self.path)
+        self.assertEqual(capture.meta, {'dml': 'x'})
+        self.assertEqual(capture.inserts, cd.inserts)
+        self.assertEqual(capture.deletes, cd.deletes)
+        self.assertEqual(capture.pre_update, cd.pre_update)
+        self.assertEqual(capture.post_update, cd.post_update)
+        self.assertEqual(capture.column_types, cd.column_types)
+
+    def test_reader_by_line(self):
+        write_capture(self.path, Cd())
+        reader = CaptureReader(self.path)
+        try:
+            kind, tn, sql, images = reader.statement(2)
+            self.assertEqual((kind, tn, sql), ('delete', 't',
+                                               'delete from t where a = 2'))
+            self.assertEqual(images['rows'][0][1][1],
+                             datetime.date(1899, 12, 31))
+            self.assertRaises(KeyError, reader.statement, 4)
+        finally:
+            reader.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
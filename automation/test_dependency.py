@@ -0,0 +1,112 @@
+'''
+Tests of dependency, no database needed
+
+Usage:
+    cd automation && python -m unittest discover -p 'test_*.py'
+'''
+
+import unittest
+
+from dependency import DependencyGraph, predicate_constraints
+
+
+def graph(*statements):
+    '''
+    DependencyGraph of (kind, sql, table) statements on lines 1, 2, ...
+    '''
+    return DependencyGraph((kind, sql, tn, line)
+                           for line, (kind, sql, tn)
+                           in enumerate(statements, 1))
+
+
+def pairs(g):
+    return [(i, j) for i, j, reason in g.conflicts]
+
+
+class TestPredicates(unittest.TestCase):
+
+    def test_terms(self):
+        self.assertEqual(
+            predicate_constraints("a = 1 and b in ('x', 'y') and c is null"),
+            {'a': frozenset(['1.0']), 'b': frozenset(['x', 'y']),
+             'c': frozenset([None])})
+
+    def test_unreadable_terms_dropped(self):
+        self.assertEqual(predicate_constraints('a = 1 or b = 2'), {})
+        self.assertEqual(predicate_constraints('a > 1 and b = 2'),
+                         {'b': frozenset(['2.0'])})
+
+
+class TestConflicts(unittest.TestCase):
+
+    def test_same_key(self):
+        g = graph(('delete', "delete from t where k = 1", 't'),
+                  ('delete', "delete from t where k = 2", 't'),
+                  ('update', "update t set a = 3 where k = '1.0'", 't'))
+        self.assertEqual(pairs(g), [(1, 3)])
+        self.assertTrue(g.independent(1, 2))
+        self.assertFalse(g.independent(1, 3))
+
+    def test_update_moves_rows(self):
+        g = graph(('update', "update t set k = 2 where k = 1", 't'),
+                  ('delete', "delete from t where k = 2", 't'))
+        self.assertEqual(pairs(g), [(1, 2)])
+
+    def test_inserts(self):
+        g = graph(('insert', "insert into t (k, a) values (1, 'x')", 't'),
+                  ('insert', "insert into t (k, a) values (1, 'y')", 't'),
+                  ('delete', "delete from t where k = 2", 't'),
+                  ('delete', "delete from t where k = 1", 't'))
+        # inserts depend on each other but don't conflict
+        self.assertEqual(pairs(g), [(1, 4), (2, 4)])
+        self.assertFalse(g.independent(1, 2))
+
+    def test_unkeyed_statement(self):
+        g = graph(('delete', "delete from t where k = 1", 't'),
+                  ('delete', "delete from t where a > 5", 't'),
+                  ('delete', "delete from t where k = 2", 't'))
+        self.assertEqual(pairs(g), [(1, 2), (2, 3)])
+
+    def test_tables(self):
+        g = graph(('delete', "delete from bw3.t where k = 1", 'bw3.t'),
+                  ('delete', "delete from T where k = 1", 'T'),
+                  ('delete', "delete from u where k = 1", 'u'))
+        self.assertEqual(pairs(g), [(1, 2)])
+        self.assertEqual(g.conflicting_tables(), ['t'])
+
+    def test_reads(self):
+        g = graph(('delete', "delete from t where k = 1", 't'),
+                  ('delete', "delete from u where k in "
+                             "(select k from t)", 'u'))
+        self.assertEqual(pairs(g), [])
+        self.assertFalse(g.independent(1, 2))
+        self.assertEqual(g.conflicting_tables(), ['u'])
+
+    def test_batches(self):
+        g = graph(('delete', "delete from t where k = 1", 't'),
+                  ('delete', "delete from t where k = 2", 't'),
+                  ('update', "update t set a = 1 where k = 1", 't'),
+                  ('delete', "delete from u where k = 1", 'u'))
+        self.assertEqual(g.batches(), [[1, 2, 4], [3]])
+
+
+class TestBuckets(unittest.TestCase):
+
+    def test_many_keyed_statements(self):
+        statements = [('delete', 'delete from t where k = {}'.format(n), 't')
+                      for n in range(2000)]
+        statements.append(('update', 'update t set a = 1 where k = 7', 't'))
+        g = graph(*statements)
+        self.assertEqual(pairs(g), [(8, 2001)])
+        self.assertEqual(g.pivot_columns(), {'t': 'k'})
+
+    def test_pivot_most_pinned(self):
+        g = graph(('delete', "delete from t where a = 1 and k = 1", 't'),
+                  ('delete', "delete from t where k = 2", 't'),
+                  ('delete', "delete from t where a = 1 and k = 3", 't'))
+        self.assertEqual(g.pivot_columns(), {'t': 'k'})
+        self.assertEqual(pairs(g), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+'''
+Tests of dml_watch, no database needed
+
+Usage:
+    cd automation && python -m unittest discover -p 'test_*.py'
+'''
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from dml_watch import DmlWatcher
+
+
+class TestDmlWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'a.sql')
+        with open(self.path, 'w') as f:
+            f.write('delete from t;\n')
+        self.calls = []
+        self.outcomes = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def process(self, path):
+        self.calls.append(path)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return {'status': outcome}
+
+    def test_same_content_skipped_after_ok(self):
+        self.outcomes = ['ok']
+        watcher = DmlWatcher(self.dir, self.process)
+        watcher.run_once(self.path)
+        watcher.run_once(self.path)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_same_content_retried_after_error(self):
+        self.outcomes = ['error', SystemExit(), ValueError('x'), 'ok']
+        watcher = DmlWatcher(self.dir, self.process)
+        for n in range(5):
+            watcher.run_once(self.path)
+        self.assertEqual(len(self.calls), 4)
+
+    def test_worker_survives_exit(self):
+        done = threading.Event()
+        self.outcomes = [SystemExit(), 'ok']
+
+        def process(path):
+            try:
+                return self.process(path)
+            finally:
+                if not self.outcomes:
+                    done.set()
+
+        watcher = DmlWatcher(self.dir, process)
+        worker = threading.Thread(target=watcher.work)
+        worker.daemon = True
+        worker.start()
+        watcher.queue.put(self.path)
+        watcher.queue.put(self.path)
+        done.wait(5)
+        self.assertEqual(len(self.calls), 2)
+        self.assertTrue(worker.is_alive())
+
+    def test_poll_debounce(self):
+        watcher = DmlWatcher(self.dir, self.process, debounce_s=2)
+        watcher.poll(now=100)
+        self.assertTrue(watcher.queue.empty())
+        watcher.poll(now=101)
+        self.assertTrue(watcher.queue.empty())
+        watcher.poll(now=102)
+        self.assertEqual(watcher.queue.get_nowait(), self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
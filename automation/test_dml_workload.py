@@ -0,0 +1,70 @@
+'''
+Tests of dml_workload, no database needed
+
+Usage:
+    cd automation && python -m unittest discover -p 'test_*.py'
+'''
+
+import argparse
+import re
+import unittest
+from StringIO import StringIO
+
+from dml_workload import WorkloadGenerator, int_range, ratio_tuple
+
+STATEMENT = re.compile(r'^(insert|update|delete)\b', re.I | re.M)
+
+
+def generate(**kw):
+    gen = WorkloadGenerator(**kw)
+    out = StringIO()
+    gen.generate(out)
+    return gen, out.getvalue()
+
+
+class TestMix(unittest.TestCase):
+
+    def test_counts_match_script(self):
+        gen, script = generate(statements=2000, seed=3)
+        kinds = [k.lower() for k in STATEMENT.findall(script)]
+        self.assertEqual(len(kinds), 2000)
+        for kind in ('insert', 'update', 'delete'):
+            self.assertEqual(kinds.count(kind), gen.counts[kind])
+
+    def test_ratios(self):
+        for mix in ((5, 3, 2), (2, 1, 7), (1, 0, 0)):
+            gen, script = generate(statements=5000, mix=mix, seed=1)
+            for kind, weight in zip(('insert', 'update', 'delete'), mix):
+                share = gen.counts[kind] / 5000.0
+                self.assertAlmostEqual(share, weight / float(sum(mix)),
+                                       delta=0.03)
+
+    def test_rows_affected(self):
+        gen, script = generate(statements=500, mix=(0, 1, 1), rows=(3, 3))
+        self.assertEqual(gen.counts['insert'], 0)
+        self.assertEqual(gen.rows_affected, 1500)
+        self.assertTrue(gen.seeds)
+
+    def test_reproducible(self):
+        self.assertEqual(generate(statements=300, seed=7)[1],
+                         generate(statements=300, seed=7)[1])
+        self.assertNotEqual(generate(statements=300, seed=7)[1],
+                            generate(statements=300, seed=8)[1])
+
+
+class TestArguments(unittest.TestCase):
+
+    def test_ratio_tuple(self):
+        self.assertEqual(ratio_tuple('5,3,2'), (5.0, 3.0, 2.0))
+        self.assertRaises(argparse.ArgumentTypeError, ratio_tuple, '1,2')
+        self.assertRaises(argparse.ArgumentTypeError, ratio_tuple, '0,0,0')
+
+    def test_int_range(self):
+        self.assertEqual(int_range('1-5'), (1, 5))
+        self.assertEqual(int_range('3'), (3, 3))
+        self.assertRaises(argparse.ArgumentTypeError, int_range, '5-1')
+        self.assertRaises(argparse.ArgumentTypeError, int_range, '0')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+'''
+Tests of keyword_rules, no database needed
+
+Usage:
+    cd automation && python -m unittest discover -p 'test_*.py'
+'''
+
+import unittest
+
+from keyword_rules import RULES, KeywordScanner
+
+
+def scan(script, rules=('commit', 'disable'), block_lines=None):
+    '''
+    {rule: line} found in script, fed whole or block_lines at a time
+    '''
+    scanner = KeywordScanner(rules)
+    lines = script.lower().splitlines(True)
+    size = block_lines or len(lines) or 1
+    for n in range(0, len(lines), size):
+        scanner.feed(''.join(lines[n:n + size]))
+    scanner.finish()
+    return scanner.found
+
+
+class TestStatements(unittest.TestCase):
+
+    def test_statement_keywords(self):
+        self.assertEqual(scan('delete from t;\ncommit;\n'), {'commit': 2})
+        self.assertEqual(scan('alter trigger x disable;\n'), {'disable': 1})
+        self.assertEqual(scan('alter table t\n  disable constraint c;\n'),
+                         {'disable': 1})
+        self.assertEqual(scan('begin\n  commit;\nend;\n/\n'), {'commit': 2})
+
+    def test_not_a_statement_keyword(self):
+        self.assertEqual(scan("update t set commit_flag = 1;\n"), {})
+        self.assertEqual(scan("update t set a = 1 where commit = 2;\n"), {})
+        self.assertEqual(scan('alter session set x = 1;\n'), {})
+
+    def test_rules(self):
+        script = 'truncate table t;\nrollback;\nalter trigger x enable;\n'
+        self.assertEqual(scan(script, sorted(RULES)),
+                         {'ddl': 1, 'rollback': 2, 'alter_trigger': 3})
+        self.assertRaises(ValueError, KeywordScanner, ['commit', 'nope'])
+
+
+class TestLiteralsAndComments(unittest.TestCase):
+
+    def test_string_literals(self):
+        self.assertEqual(scan(
+            "insert into t (a) values ('x;\ncommit;\n');\n"), {})
+        self.assertEqual(scan(
+            "insert into t (a) values (q'[it's;\ncommit;]');\n"), {})
+        self.assertEqual(scan(
+            "update t set a = 'alter x disable';\n"), {})
+
+    def test_quoted_identifiers(self):
+        self.assertEqual(scan('select "x;\ncommit" from t;\n'), {})
+
+    def test_comments(self):
+        self.assertEqual(scan('-- commit later\ndelete from t;\n'), {})
+        self.assertEqual(scan('/* ;\ncommit;\n*/\ndelete from t;\n'), {})
+        self.assertEqual(scan('delete from t; -- ;\ncommit;\n'),
+                         {'commit': 2})
+
+    def test_line_after_literal(self):
+        script = "insert into t (a) values ('a\nb\nc');\ncommit;\n"
+        self.assertEqual(scan(script), {'commit': 4})
+
+    def test_split_blocks(self):
+        script = ("insert into t (a) values ('a;\ncommit;\nb');\n"
+                  "/* x\n;commit;\n*/\n"
+                  "alter table t\ndisable constraint c;\n"
+                  "commit;\n")
+        for size in (1, 2, 3):
+            self.assertEqual(scan(script, block_lines=size),
+                             {'disable': 7, 'commit': 9})
+
+    def test_unclosed_literal(self):
+        self.assertEqual(scan("insert into t (a) values ('a;\ncommit;\n"),
+                         {})
+
+
+class TestSqlPlus(unittest.TestCase):
+
+    def test_autocommit(self):
+        self.assertEqual(scan('set autocommit on\n'), {'commit': 1})
+        self.assertEqual(scan('set echo on auto 100\n'), {'commit': 1})
+        self.assertEqual(scan('set autocommit off\n'), {})
+        self.assertEqual(scan('set autoprint on\n'), {})
+
+    def test_command_line_ends_a_statement(self):
+        self.assertEqual(scan('prompt done\ncommit;\n'), {'commit': 2})
+        self.assertEqual(scan('@other.sql\ncommit;\n'), {'commit': 2})
+
+
+class TestDynamicSql(unittest.TestCase):
+
+    def test_execute_immediate(self):
+        script = "begin\n  execute immediate 'commit';\nend;\n/\n"
+        self.assertEqual(scan(script), {'commit': 2})
+        script = ("begin\n  execute immediate\n"
+                  "    'alter trigger x disable';\nend;\n/\n")
+        self.assertEqual(scan(script), {'disable': 2})
+
+    def test_quoting(self):
+        script = "begin\n  execute immediate q'{truncate table t}';\nend;\n"
+        self.assertEqual(scan(script, ['ddl']), {'ddl': 2})
+        script = ("begin\n  execute immediate "
+                  "'update t set a = ''commit''';\nend;\n")
+        self.assertEqual(scan(script), {})
+
+    def test_variable(self):
+        script = "begin\n  execute immediate stmt;\nend;\n"
+        self.assertEqual(scan(script), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+'''
+Tests of lob_store, no database needed
+
+Usage:
+    cd automation && python -m unittest discover -p 'test_*.py'
+'''
+
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from lob_store import LobRef, LobStore, write_restore
+
+
+class Lob:
+
+    '''
+    a LOB locator as fetched by cx_Oracle, reads counted
+    '''
+
+    def __init__(self, value):
+        self.value = value
+        self.reads = []
+
+    def size(self):
+        return len(self.value)
+
+    def read(self, offset, amount):
+        self.reads.append(amount)
+        return self.value[offset - 1:offset - 1 + amount]
+
+
+class LobCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def ref(self, data, kind='clob'):
+        path = os.path.join(self.dir, '{:06d}.{}'.format(
+            len(os.listdir(self.dir)), kind))
+        with open(path, 'wb') as f:
+            f.write(data)
+        return LobRef(path, kind, len(data))
+
+
+class TestSpill(LobCase):
+
+    def test_chunked_read(self):
+        lob = Lob(u'\xe9' * 2500)
+        store = LobStore(os.path.join(self.dir, 'lobs'), chunk=1000)
+        ref = store.spill(lob, 'clob')
+        self.assertEqual(lob.reads, [1000, 1000, 1000])
+        self.assertEqual((ref.kind, ref.size), ('clob', 2500))
+        with open(ref.path, 'rb') as f:
+            self.assertEqual(f.read(), '\xc3\xa9' * 2500)
+        self.assertEqual((store.count, store.bytes), (1, 5000))
+
+    def test_files(self):
+        store = LobStore(os.path.join(self.dir, 'lobs'))
+        first = store.spill(Lob('ab'), 'blob')
+        second = store.spill(Lob(''), 'clob')
+        self.assertNotEqual(first.path, second.path)
+        self.assertEqual(os.path.getsize(second.path), 0)
+
+
+class TestChunks(LobCase):
+
+    def test_sizes(self):
+        data = 'x' * 2500
+        chunks = list(self.ref(data).chunks(1000))
+        self.assertEqual([len(c) for c in chunks], [1000, 1000, 500])
+        self.assertEqual(''.join(chunks), data)
+
+    def test_no_split_character(self):
+        data = ('a' + '\xe2\x82\xac' * 400) * 3
+        chunks = list(self.ref(data).chunks(100))
+        self.assertEqual(''.join(chunks), data)
+        for chunk in chunks:
+            chunk.decode('utf-8')
+            self.assertLessEqual(len(chunk), 100)
+
+    def test_no_ascii(self):
+        data = '\xe2\x82\xac' * 100
+        chunks = list(self.ref(data).chunks(10))
+        self.assertEqual(''.join(chunks), data)
+        for chunk in chunks:
+            chunk.decode('utf-8')
+
+    def test_blob_cut_anywhere(self):
+        data = '\xff' * 25
+        chunks = list(self.ref(data, 'blob').chunks(10))
+        self.assertEqual([len(c) for c in chunks], [10, 10, 5])
+
+
+class TestRestore(LobCase):
+
+    def restore(self, refs, block_chunks):
+        out = StringIO()
+        write_restore(out, 't', '    insert into t ...;\n',
+                      [('c{}'.format(n), ref)
+                       for n, ref in enumerate(refs, 1)], block_chunks)
+        return out.getvalue()
+
+    def test_special_characters(self):
+        text = self.restore([self.ref("it's\n&x")], 10)
+        self.assertIn("s := 'it''s' || chr(10)\n        || chr(38)\n"
+                      "        || 'x';", text)
+
+    def test_blob_hex(self):
+        text = self.restore([self.ref('\x00\xff', 'blob')], 10)
+        self.assertIn("r := hextoraw('00FF');", text)
+
+    def test_blocks(self):
+        ref = self.ref('x' * 2500)
+        text = self.restore([ref], 2)
+        self.assertEqual(text.count('dbms_lob.writeappend(l1,'), 3)
+        self.assertEqual(text.count('end;\n/'), 2)
+        self.assertEqual(len(re.findall(
+            r'select c1 into l1 from t\n\s+where rowid = '
+            r'chartorowid\(:sysimp_lob_rowid\) for update;', text)), 1)
+
+    def test_lobs_share_first_block(self):
+        text = self.restore([self.ref('x'), self.ref('y', 'blob')], 10)
+        self.assertEqual(text.count('end;\n/'), 1)
+        self.assertIn('    l2 blob;\n', text)
+
+    def test_lob_after_split_new_block(self):
+        text = self.restore([self.ref('x' * 2500), self.ref('y')], 2)
+        self.assertEqual(text.count('end;\n/'), 3)
+        self.assertIn('select c2 into l2 from t', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
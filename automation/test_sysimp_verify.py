@@ -0,0 +1,279 @@
+'''
+Tests of the literal and script text helpers of sysimp_verify, no
+database needed
+
+Usage:
+    cd automation && python -m unittest discover -p 'test_*.py'
+'''
+
+import datetime
+import decimal
+import imp
+import os
+import re
+import shutil
+import tempfile
+import threading
+import types
+import unittest
+
+sysimp = imp.load_source('sysimp_verify', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'sysimp_verify - with_reversed_backout_20170718.py'))
+
+# SQL*Plus rejects longer lines (SP2-0027)
+SQLPLUS_LINE_CHARS = 2499
+
+
+def longest_line(text):
+    return max(len(line) for line in text.split('\n'))
+
+
+class TestSqlLiteral(unittest.TestCase):
+
+    def test_null_and_numbers(self):
+        self.assertEqual(sysimp.sql_literal(None), 'NULL')
+        self.assertEqual(sysimp.sql_literal(12), '12')
+        self.assertEqual(sysimp.sql_literal(decimal.Decimal('1.50')), '1.50')
+        self.assertEqual(sysimp.sql_literal(0.1), '0.1')
+
+    def test_strings(self):
+        self.assertEqual(sysimp.sql_literal("it's"), "'it''s'")
+        self.assertEqual(sysimp.sql_literal(' 12 ', 'number'), '12')
+        self.assertEqual(sysimp.sql_literal('12a', 'number'), "'12a'")
+        self.assertEqual(sysimp.sql_literal('12'), "'12'")
+
+    def test_dates(self):
+        self.assertEqual(
+            sysimp.sql_literal(datetime.datetime(1, 1, 1)),
+            "TO_DATE('0001-01-01 00:00:00', 'YYYY-MM-DD HH24:MI:SS')")
+        self.assertEqual(
+            sysimp.sql_literal(datetime.datetime(2017, 7, 18, 1, 2, 3, 4)),
+            "TO_TIMESTAMP('2017-07-18 01:02:03.000004', "
+            "'YYYY-MM-DD HH24:MI:SS.FF6')")
+        self.assertEqual(
+            sysimp.sql_literal(datetime.datetime(2017, 7, 18), 'timestamp'),
+            "TO_TIMESTAMP('2017-07-18 00:00:00.000000', "
+            "'YYYY-MM-DD HH24:MI:SS.FF6')")
+
+
+class TestForallBlocks(unittest.TestCase):
+
+    def blocks(self, values, kind):
+        data = [[v] for v in values]
+        return sysimp.forall_blocks(
+            'insert into t (a) values (c1(i))', [0], {0: kind}, data)
+
+    def test_chunks(self):
+        blocks = self.blocks(range(1201), 'number')
+        self.assertEqual(len(blocks), 3)
+        self.assertIn('forall i in 1 .. 500\n', blocks[0])
+        self.assertIn('forall i in 1 .. 201\n', blocks[2])
+        self.assertTrue(all(b.endswith('end;\n/') for b in blocks))
+
+    def test_dates_line_length(self):
+        dates = [datetime.datetime(2017, 1, 1) + datetime.timedelta(n)
+                 for n in range(500)]
+        block, = self.blocks(dates, 'date')
+        self.assertEqual(block.count('TO_DATE('), 500)
+        self.assertLess(longest_line(block), 100)
+
+    def test_long_strings_line_length(self):
+        values = ["'" * 4000, 'x' * 4000, 'short']
+        block, = self.blocks(values, 'string')
+        self.assertLessEqual(longest_line(block), SQLPLUS_LINE_CHARS)
+
+    def test_long_string_value_kept(self):
+        value = "a'b" * 700
+        literal = sysimp.bind_literal(value, 'string')
+        self.assertLessEqual(longest_line(literal), SQLPLUS_LINE_CHARS)
+        pieces = [p.strip() for p in literal.split(' ||\n')]
+        self.assertEqual(
+            ''.join(p[1:-1].replace("''", "'") for p in pieces), value)
+
+
+class TestBulk(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(suffix=' with spaces')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_fields(self):
+        self.assertEqual(sysimp.bulk_field(None), '')
+        self.assertEqual(sysimp.bulk_field(5, 'number'), '5')
+        self.assertEqual(sysimp.bulk_field('a  ', 'string'), 'a  ')
+        self.assertEqual(sysimp.bulk_field(u'\u20ac', 'string'),
+                         '\xe2\x82\xac')
+        self.assertEqual(
+            sysimp.bulk_field(datetime.datetime(2017, 1, 2), 'timestamp'),
+            '2017-01-02 00:00:00.000000')
+
+    def test_loadable(self):
+        self.assertTrue(sysimp.bulk_loadable(u'\u20ac'))
+        self.assertTrue(sysimp.bulk_loadable('\xe2\x82\xac'))
+        self.assertFalse(sysimp.bulk_loadable('\xe9'))
+        self.assertFalse(sysimp.bulk_loadable('a' + sysimp.BULK_FIELD))
+        self.assertFalse(sysimp.bulk_loadable(
+            sysimp.LobRef('x.clob', 'clob', 1)))
+
+    def test_load(self):
+        backout = types.InstanceType(sysimp.Backout)
+        backout.bulk_dir = self.dir
+        backout.loads = 0
+        backout.column_types = {'t': {'a': 'string', 'b': 'number'}}
+        step = backout.bulk_load('t', [[('a', u'caf\xe9  '), ('b', 1)],
+                                       [('a', 'x'), ('b', None)]])
+        host = step.split('\n')[-1]
+        self.assertTrue(host.startswith("host cd '{}' && sqlldr ".format(
+            self.dir)))
+        self.assertNotIn(self.dir, host.split('&&')[1])
+        base = os.path.join(self.dir, 'load_0001')
+        with open(base + '.ctl') as f:
+            control = f.read()
+        self.assertIn('CHARACTERSET AL32UTF8', control)
+        self.assertIn('PRESERVE BLANKS', control)
+        with open(base + '.dat', 'rb') as f:
+            self.assertEqual(f.read().split(sysimp.BULK_RECORD), [
+                'caf\xc3\xa9  ' + sysimp.BULK_FIELD + '1',
+                'x' + sysimp.BULK_FIELD, ''])
+
+
+class Tty:
+
+    def __init__(self):
+        self.text = ''
+
+    def isatty(self):
+        return True
+
+    def write(self, text):
+        self.text += text
+
+    def flush(self):
+        pass
+
+
+class TestConsoleOut(unittest.TestCase):
+
+    def test_redrawn_on_a_terminal(self):
+        stream = Tty()
+        console = sysimp.ConsoleOut(0, stream=stream)
+        console.write('t', 1, 1)
+        console.write('t', 2, 0)
+        console.finish()
+        self.assertIn('\r', stream.text)
+
+    def test_labelled_lines(self):
+        stream = Tty()
+
+        def job(label):
+            console = sysimp.ConsoleOut(0, 0, stream=stream, label=label)
+            for n in range(200):
+                console.write('t', n, 200 - n)
+            console.finish()
+
+        jobs = [threading.Thread(target=job, args=(label,))
+                for label in ('db1', 'db2')]
+        for t in jobs:
+            t.start()
+        for t in jobs:
+            t.join()
+        self.assertNotIn('\r', stream.text)
+        lines = stream.text.splitlines()
+        self.assertTrue(all(line.startswith(('db1: ', 'db2: '))
+                            for line in lines))
+        self.assertEqual(len([line for line in lines
+                              if line.startswith('db1: t ')]), 201)
+
+
+class Cd:
+
+    '''
+    the ConfigDict attributes ValidationScript reads: rows inserted on
+    lines 1 .. inserts, then a delete of deletes rows
+    '''
+
+    def __init__(self, inserts, deletes, width=3):
+        cols = ['column_{:03d}'.format(n) for n in range(width)]
+        self.column_types = {'t': dict((col, 'string') for col in cols)}
+        self.inserts = [[(col, 'v{}'.format(n)) for col in cols]
+                        for n in range(inserts)]
+        self.insert_line_nums = range(1, inserts + 1)
+        self.insert_tables = ['t'] * inserts
+        self.deletes = [[[(col, "d'{}".format(n)) for col in cols]
+                         for n in range(deletes)]]
+        self.delete_line_nums = [inserts + 1]
+        self.delete_tables = ['t']
+        self.line_list = range(1, inserts + 2)
+
+
+class TestGttValidation(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'x_validation.sql')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def script(self, cd):
+        sysimp.ValidationScript(self.path, cd,
+                                mode='gtt').create_validation()
+        with open(self.path) as f:
+            return f.read()
+
+    def test_no_ddl(self):
+        text = self.script(Cd(3, 2)).lower()
+        self.assertFalse(re.search(
+            r'^\s*(create|drop|truncate|commit|insert|alter)\b', text, re.M))
+        self.assertIn("'missing' sysimp_state", text)
+        self.assertIn("'not deleted' sysimp_state", text)
+
+    def test_chunks(self):
+        text = self.script(Cd(sysimp.GTT_STAGE_ROWS + 1, 1))
+        self.assertEqual(text.count("else 'FAIL' end"), 2)
+        self.assertIn(' of {} rows mismatching'.format(
+            sysimp.GTT_STAGE_ROWS), text)
+        self.assertIn(" of 2 rows mismatching'", text)
+
+    def test_line_length(self):
+        text = self.script(Cd(2, 2, width=200))
+        self.assertLessEqual(longest_line(text), SQLPLUS_LINE_CHARS)
+        # a blank line would end a statement early in SQL*Plus
+        self.assertFalse(re.search(
+            r'[^;\n]\n\n', text[len(sysimp.SET_VALIDATION_HEADER):]))
+
+
+class Cursor:
+
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, sql, *args, **kw):
+        self.executed.append(sql)
+
+
+class TestCaptureErrors(unittest.TestCase):
+
+    def config_dict(self):
+        cd = types.InstanceType(sysimp.ConfigDict)
+        cd.cursor = Cursor()
+        return cd
+
+    def test_update_without_where(self):
+        cd = self.config_dict()
+        self.assertRaises(sysimp.CaptureError, cd.process_update,
+                          "update t set a = 1 where(b = 2);", 't')
+        self.assertEqual(cd.cursor.executed, ['rollback'])
+
+    def test_update_without_set(self):
+        cd = self.config_dict()
+        self.assertRaises(sysimp.CaptureError, cd.process_update,
+                          "update t sett a = 1 where b = 2;", 't')
+        self.assertEqual(cd.cursor.executed, ['rollback'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+'''
+Per-phase timing for sysimp_verify runs
+
+Usage:
+    timings = Timings()
+    with timings.phase('parse'):
+        ...
+    timings.record_capture('delete', 'cbr_fx_rate_spreads', seconds, rows)
+    timings.write_report('run_timings.json')
+
+Description
+- clock() is monotonic on every platform the script runs on:
+  time.monotonic where it exists, time.clock on Windows (a
+  QueryPerformanceCounter wrapper in python 2), and
+  clock_gettime(CLOCK_MONOTONIC) through ctypes on Linux/Jenkins.
+- phases are accumulated by name, so a phase entered once per
+  statement reports its total time and how often it ran.
+- capture time is also broken down by statement kind and by table.
+- the JSON report carries a report_version so scripts that track
+  regressions across releases can tell formats apart.
+'''
+
+import ctypes
+import ctypes.util
+import datetime
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+REPORT_VERSION = 1
+
+
+def _linux_monotonic():
+    '''
+    return a clock_gettime(CLOCK_MONOTONIC) reader or None
+    '''
+    CLOCK_MONOTONIC = 1
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    for name in ('rt', 'c'):
+        path = ctypes.util.find_library(name)
+        if not path:
+            continue
+        try:
+            lib = ctypes.CDLL(path, use_errno=True)
+            clock_gettime = lib.clock_gettime
+        except (OSError, AttributeError):
+            continue
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        t = timespec()
+
+        def monotonic():
+            if clock_gettime(CLOCK_MONOTONIC, ctypes.pointer(t)) != 0:
+                return time.time()
+            return t.tv_sec + t.tv_nsec * 1e-9
+        return monotonic
+    return None
+
+
+if hasattr(time, 'monotonic'):
+    clock = time.monotonic
+elif sys.platform == 'win32':
+    clock = time.clock
+else:
+    clock = _linux_monotonic() or time.time
+
+
+class Timings:
+
+    '''
+    Accumulate named phase timings and capture statistics for one run
+    '''
+
+    def __init__(self):
+        self.started = datetime.datetime.utcnow()
+        self.start = clock()
+        self.phases = {}
+        self.capture_kinds = {}
+        self.capture_tables = {}
+        self.info = {}
+
+    def add(self, name, seconds, count=1):
+        p = self.phases.setdefault(name, {'seconds': 0.0, 'count': 0})
+        p['seconds'] += seconds
+        p['count'] += count
+
+    @contextmanager
+    def phase(self, name):
+        start = clock()
+        try:
+            yield
+        finally:
+            self.add(name, clock() - start)
+
+    def record_capture(self, kind, table, seconds, rows):
+        '''
+        add one captured statement to the per kind and per table totals
+        '''
+        self.add('capture', seconds)
+        for d in (self.capture_kinds.setdefault(kind, {}),
+                  self.capture_tables.setdefault(table, {}).setdefault(
+                      kind, {})):
+            d['seconds'] = d.get('seconds', 0.0) + seconds
+            d['statements'] = d.get('statements', 0) + 1
+            d['rows'] = d.get('rows', 0) + rows
+
+    def elapsed(self):
+        return clock() - self.start
+
+    def report(self):
+        total = self.elapsed()
+        statements = sum(k['statements'] for k in self.capture_kinds.values())
+        rows = sum(k['rows'] for k in self.capture_kinds.values())
+        capture_seconds = self.phases.get('capture', {}).get('seconds', 0.0)
+
+        def rate(n, seconds):
+            return n / seconds if seconds > 0 else None
+
+        return {
+            'report_version': REPORT_VERSION,
+            'started_utc': self.started.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'platform': sys.platform,
+            'info': self.info,
+            'total_seconds': total,
+            'phases': self.phases,
+            'capture': {
+                'statements': statements,
+                'rows': rows,
+                'statements_per_sec': rate(statements, capture_seconds),
+                'rows_per_sec': rate(rows, capture_seconds),
+                'by_kind': self.capture_kinds,
+                'by_table': self.capture_tables,
+            },
+        }
+
+    def write_report(self, path):
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+            f.write('\n')
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp, path)
+        return path